@@ -9,19 +9,33 @@
 """
 
 # Imported libraries
-from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve
-from scipy.fft import fft
+from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve, oaconvolve, kaiserord
+from scipy.fft import fft, next_fast_len
 import numpy as np
+from instrumentation import instrumentStage
+from compiledKernels import useCompiledKernels, symmetricFIRKernel
+
+
+# Global variables
+FFT_COST_FACTOR = 15 # Cost of one FFT butterfly unit relative to one direct form multiply-add, from benchmarkFFTCostFactor in benchmarks.py (10 to 19 for 99 to 4095 taps)
+FFT_SIZE_FACTOR = 8 # The FFT size used to estimate overlap-add cost, as a multiple of the number of taps
+OPTIMAL_STOP_HALF_WIDTHS = [0.001, 0.1, 0.2, 0.5, 1.0] # Stop band half widths (Hz) tried in turn until the optimal design converges
+OPTIMAL_MAX_GAIN = 1.25 # The largest pass band gain (about 2 dB) of a usable optimal design. Remez can converge on designs with huge ripple
+GAIN_CHECK_SIZE = 8192 # The number of frequencies the pass band gain of a design is checked at
+NOTCH_TOLERANCE = 0.1 # The distance (Hz) either side of each notch frequency the stop band attenuation must hold over
+RESPONSE_SIZE = 16384 # The number of frequencies a design is checked against its specification at
+FIR_OUTPUTS = ['all', 'cascade', 'overall'] # The sets of outputs applyFIRFilters can compute
+KAISER_MARGIN = 10 # The extra attenuation (dB) Kaiser windows are designed for, as the estimate falls short this close to the notch
 
 
 
 #
 # FIR Filter functions
 #
-def createWindowFilters(notches, sample_rate, notch_width, num_taps):
+@instrumentStage()
+def createWindowFilters(notches, sample_rate, notch_width, num_taps, window=('kaiser', 2.5)):
     """Compute and return the bandstop  window filter array for the specified notches. Adjusting the window type and band width changes attenuation."""
 
-    window = ('kaiser', 2.5) #Define the window type
     f1, f2 = notches #Seperate the cutoff frequencies specified
     width = notch_width / 2.0 #5 / 2 = 2.5 Hz one sided 3dB bandwidth
 
@@ -38,6 +52,7 @@ def createWindowFilters(notches, sample_rate, notch_width, num_taps):
 
 
 
+@instrumentStage()
 def createOptimalFilters(notches, sample_rate, notch_width, num_taps):
     """Compute and return the bandstop  optimal filter arrays for the specified notches. Adjusting the window type and band width changes attenuation."""
 
@@ -49,26 +64,41 @@ def createOptimalFilters(notches, sample_rate, notch_width, num_taps):
     weight_overall = [pass_, stop, pass_, stop, pass_] #Overall filter weighting
     gains = [1, 0, 1]
     gains_overall = [1, 0, 1, 0, 1] #Indicates stop and passband locations in the specified bands
-    alpha = 0.001 #Minimal Spacing of stop band notch to allow convergence
 
-    band_1= [0,  f1 - width, f1 - alpha, f1 + alpha, f1 + width, sample_rate / 2] #Pad the stop band as the method doesnt converge well otherwise
-    band_2= [0, f2 - width, f2 - alpha, f2 + alpha, f2 + width, sample_rate / 2]
-    bands = [0,  f1 - width, f1 - alpha, f1 + alpha, f1 + width, f2 - width, f2 - alpha, f2 + alpha, f2 + width, sample_rate / 2] #Overall filter bands
+    # Widen the stop band until the design converges to a usable filter. Remez only converges for some notch frequencies
+    # with the narrowest stop band, which is a problem now that notch frequencies are detected rather than tuned by hand
+    for alpha in OPTIMAL_STOP_HALF_WIDTHS: #Minimal Spacing of stop band notch to allow convergence
+        band_1= [0,  f1 - width, f1 - alpha, f1 + alpha, f1 + width, sample_rate / 2] #Pad the stop band as the method doesnt converge well otherwise
+        band_2= [0, f2 - width, f2 - alpha, f2 + alpha, f2 + width, sample_rate / 2]
+        bands = [0,  f1 - width, f1 - alpha, f1 + alpha, f1 + width, f2 - width, f2 - alpha, f2 + alpha, f2 + width, sample_rate / 2] #Overall filter bands
 
-    filter_1 = remez(numtaps=num_taps, bands=band_1, desired=gains, fs=sample_rate, weight=weight) #Filter 1
-    filter_2 = remez(numtaps=num_taps, bands=band_2, desired=gains, fs=sample_rate, weight=weight) #Filter 2
-    filter_overall = remez(numtaps=num_taps, bands=bands, desired=gains_overall, fs=sample_rate, weight=weight_overall) #Overall filter
-    
-    return filter_1, filter_2, filter_overall
+        try:
+            filter_1 = remez(numtaps=num_taps, bands=band_1, desired=gains, fs=sample_rate, weight=weight) #Filter 1
+            filter_2 = remez(numtaps=num_taps, bands=band_2, desired=gains, fs=sample_rate, weight=weight) #Filter 2
+            filter_overall = remez(numtaps=num_taps, bands=bands, desired=gains_overall, fs=sample_rate, weight=weight_overall) #Overall filter
+        except ValueError: # Failed to converge
+            continue
+        if max(calculatePeakGain(filter_array) for filter_array in [filter_1, filter_2, filter_overall]) <= OPTIMAL_MAX_GAIN:
+            return filter_1, filter_2, filter_overall
+
+    raise ValueError('No usable optimal design with {} taps for notches at {} Hz'.format(num_taps, notches))
+
+
+
+def calculatePeakGain(filter_array):
+    """Return the largest gain of an FIR filter at any frequency"""
+
+    return np.max(np.abs(np.fft.rfft(filter_array, max(GAIN_CHECK_SIZE, len(filter_array)))))
 
 
 
-def createFreqSamplingFilters(notches, sample_rate, notch_width, num_taps):
+@instrumentStage()
+def createFreqSamplingFilters(notches, sample_rate, notch_width, num_taps, window=('kaiser', 2.5)):
     """Compute and return the bandstop frequency sampling filter arrays for the specified notches. Adjusting the window type and band width changes attenuation."""
 
     # Define and computer frequency sampling filter coefficients
     f1, f2 = notches
-    window_type = ('kaiser', 2.5)
+    window_type = window
     width = notch_width / 2.0 # One sided 3dB bandwidth, in Hz
     alpha = width - 0.01 # Added transition points to narrow the band further
     omega = width - 0.1 
@@ -90,13 +120,188 @@ def createFreqSamplingFilters(notches, sample_rate, notch_width, num_taps):
 
 
 
-def applyFIRFilters(filter_1, filter_2, filter_overall, samples):
-    """Pass data through two cascaded FIR filters, and a single overall filter and return the result after each filter"""
+#
+# FIR specification functions
+#
+def measureNotchResponse(filter_array, notches, sample_rate, notch_width):
+    """Measure and return the stop band attenuation (dB), the smallest within NOTCH_TOLERANCE of any of the notch
+    frequencies, and the pass band ripple (dB), the largest gain error at least a notch width from every notch"""
+
+    frequencies, response = freqz(filter_array, worN=RESPONSE_SIZE, fs=sample_rate)
+    gain = np.maximum(np.abs(response), 1e-12) # Avoid taking the log of zero gain
+    distance = np.min(np.abs(frequencies[:, np.newaxis] - np.asarray(notches)[np.newaxis, :]), axis=1) # To the nearest notch
+
+    attenuation = -20 * np.log10(np.max(gain[distance <= NOTCH_TOLERANCE]))
+    ripple = np.max(np.abs(20 * np.log10(gain[distance >= notch_width])))
+
+    return attenuation, ripple
+
+
+
+def meetsNotchSpec(filters, notches, sample_rate, notch_width, attenuation, ripple):
+    """Return whether every filter of a (filter_1, filter_2, filter_overall) design has at least the stop band
+    attenuation (dB) at its notches, and at most the pass band ripple (dB)"""
+
+    for filter_array, filter_notches in zip(filters, [notches[:1], notches[1:], notches]): # Each filter's own notches
+        filter_attenuation, filter_ripple = measureNotchResponse(filter_array, filter_notches, sample_rate, notch_width)
+        if filter_attenuation < attenuation or filter_ripple > ripple:
+            return False
+
+    return True
+
+
+
+def estimateNotchTaps(sample_rate, notch_width, attenuation, ripple):
+    """Estimate and return the number of taps (kept odd) and the Kaiser window beta of a notch filter with the stop
+    band attenuation and pass band ripple (dB), with a margin of KAISER_MARGIN. The transition band runs from
+    NOTCH_TOLERANCE either side of the notch to a notch width away, either side of the cutoff half a notch width away"""
+
+    ripple_attenuation = -20 * np.log10(10 ** (ripple / 20) - 1) # A Kaiser window has equal pass and stop band ripple
+    transition_width = notch_width - 2 * NOTCH_TOLERANCE
+    num_taps, beta = kaiserord(max(attenuation, ripple_attenuation) + KAISER_MARGIN, transition_width / (sample_rate / 2))
+
+    return num_taps | 1, beta
+
+
+
+#
+# FIR application functions
+#
+def countFIROperations(num_taps, num_samples):
+    """Return the multiply-adds of direct form filtering, and the FFT butterfly units (size times log2 size, summed
+    over the blocks) of overlap-add FFT convolution, of num_samples samples through an FIR filter"""
+
+    direct_operations = num_samples * num_taps # One multiply-add per tap per sample
+
+    fft_size = next_fast_len(FFT_SIZE_FACTOR * num_taps) # FFT size of each overlap-add block
+    block_size = fft_size - num_taps + 1 # The number of new samples in each block
+    num_blocks = np.ceil((num_samples + num_taps - 1) / block_size) # Blocks needed to cover the whole convolution
+    fft_operations = num_blocks * fft_size * np.log2(fft_size) # A forward and inverse FFT per block
+
+    return direct_operations, fft_operations
 
-    half_filtered = lfilter(filter_1, 1, samples)
-    full_filtered = lfilter(filter_2, 1, half_filtered)
-    overall_filtered = lfilter(filter_overall, 1, samples)
 
-    return half_filtered, full_filtered, overall_filtered
 
+def chooseFIRMethod(num_taps, num_samples):
+    """Choose and return the cheaper way to apply an FIR filter, 'direct' or 'fft', by comparing the multiply-adds
+    of direct form filtering with the estimated cost of overlap-add FFT convolution"""
 
+    direct_operations, fft_operations = countFIROperations(num_taps, num_samples)
+
+    return 'fft' if FFT_COST_FACTOR * fft_operations < direct_operations else 'direct'
+
+
+
+def getFilterSymmetry(filter_array):
+    """Return 1 if an FIR filter's coefficients are symmetric, -1 if they are antisymmetric, or 0 if they are
+    neither. Each of the designers gives symmetric (linear-phase) filters"""
+
+    filter_array = np.asarray(filter_array)
+    if np.allclose(filter_array, filter_array[::-1]):
+        return 1
+    if np.allclose(filter_array, -filter_array[::-1]):
+        return -1
+
+    return 0
+
+
+
+def getLinearPhaseDelay(filter_array):
+    """Return the group delay (samples) of a linear-phase FIR filter, which is the same at every frequency. Only
+    filters with symmetric or antisymmetric coefficients and an odd number of taps have a whole sample delay"""
+
+    if getFilterSymmetry(filter_array) == 0 or len(filter_array) % 2 == 0:
+        raise ValueError('Only linear-phase FIR filters with an odd number of taps have a whole sample delay to compensate')
+
+    return (len(filter_array) - 1) // 2
+
+
+
+def applySymmetricFIRFilter(filter_array, samples, axis=-1, delay=0):
+    """Pass data through a symmetric or antisymmetric FIR filter along the given axis and return the result, which
+    matches lfilter to floating point precision. With the numba backend each pair of mirrored taps is applied to the
+    sum (or difference) of its two samples, halving the multiplies of direct form. Folding with NumPy array operations
+    is several times slower than lfilter, so the NumPy backend falls back to plain direct form (lfilter) on the
+    unpadded data, and nothing is folded. The result is advanced by delay samples"""
+
+    symmetry = getFilterSymmetry(filter_array)
+    if symmetry == 0:
+        raise ValueError('Only symmetric or antisymmetric FIR filters can be folded')
+
+    filter_array = np.asarray(filter_array, dtype=float)
+    num_taps = len(filter_array)
+    data = np.moveaxis(np.asarray(samples, dtype=float), axis, -1) # View the data with samples along the last axis
+    num_samples = data.shape[-1]
+
+    if not useCompiledKernels(): # Direct form, continuing past the end with zeros for the last delay outputs
+        filtered, state = lfilter(filter_array, 1, data, zi=np.zeros(data.shape[:-1] + (num_taps - 1,)))
+        if delay:
+            tail, state = lfilter(filter_array, 1, np.zeros(data.shape[:-1] + (delay,)), zi=state)
+            filtered = np.concatenate((filtered[..., delay:], tail), axis=-1)
+        return np.moveaxis(filtered, -1, axis)
+
+    # Zero pad so output sample i uses padded samples i to i + num_taps - 1, in reverse filter order
+    padding = [(0, 0)] * (data.ndim - 1) + [(num_taps - 1 - delay, delay)]
+    padded = np.pad(data, padding).reshape(-1, num_samples + num_taps - 1) # One row per record or lead
+    filtered = np.empty((padded.shape[0], num_samples))
+    symmetricFIRKernel(filter_array, padded, float(symmetry), filtered)
+
+    return np.moveaxis(filtered.reshape(data.shape), -1, axis)
+
+
+
+def applyFIRFilter(filter_array, samples, method='auto', axis=-1, compensate_delay=False):
+    """Pass data through an FIR filter along the given axis and return the result, which matches lfilter to floating
+    point precision. 2-D data (records or leads x samples) is filtered in one call. The method is 'direct', 'fft'
+    (overlap-add convolution), 'symmetric' (direct form with mirrored taps folded by the numba kernel, for
+    linear-phase filters, which falls back to 'direct' with the NumPy backend) or
+    'auto' to choose the cheaper of direct and fft. If compensate_delay is True the constant delay of
+    a linear-phase filter is trimmed from the result, so it is zero-phase and lines up with the input, without a
+    second pass"""
+
+    samples = np.asarray(samples)
+    num_samples = samples.shape[axis]
+    delay = getLinearPhaseDelay(filter_array) if compensate_delay else 0 # The samples to trim from the start
+    if method == 'auto': # Pick the cheaper method for this filter and signal length
+        method = chooseFIRMethod(len(filter_array), num_samples)
+
+    if method == 'direct':
+        if delay: # Pad the end so the trimmed result is still num_samples long
+            padding = [(0, 0)] * samples.ndim
+            padding[axis] = (0, delay)
+            samples = np.pad(samples, padding)
+        filtered = lfilter(filter_array, 1, samples, axis=axis)
+        return np.take(filtered, np.arange(delay, delay + num_samples), axis=axis) if delay else filtered
+    elif method == 'symmetric':
+        return applySymmetricFIRFilter(filter_array, samples, axis, delay)
+    elif method == 'fft':
+        filter_shape = [1] * samples.ndim # Broadcast the filter along every other axis
+        filter_shape[axis] = len(filter_array)
+        convolved = oaconvolve(samples, np.reshape(filter_array, filter_shape), axes=axis)
+        return np.take(convolved, np.arange(delay, delay + num_samples), axis=axis) # Keep the causal (or delay compensated) part
+    else:
+        raise ValueError('Unknown FIR method ' + str(method))
+
+
+
+@instrumentStage()
+def applyFIRFilters(filter_1, filter_2, filter_overall, samples, method='auto', axis=-1, compensate_delay=False, outputs='all'):
+    """Pass data through two cascaded FIR filters, and a single overall filter and return the result after each filter.
+    If compensate_delay is True each filter's delay is trimmed, so every result lines up with the input. outputs
+    selects what is computed: 'all' returns (half, full, overall), 'cascade' only the cascaded (half, full) and
+    'overall' only the overall filter's result, so no unused convolution is done"""
+
+    if outputs not in FIR_OUTPUTS:
+        raise ValueError('Unknown FIR outputs ' + str(outputs))
+
+    if outputs == 'overall':
+        return applyFIRFilter(filter_overall, samples, method, axis, compensate_delay)
+
+    half_filtered = applyFIRFilter(filter_1, samples, method, axis, compensate_delay)
+    full_filtered = applyFIRFilter(filter_2, half_filtered, method, axis, compensate_delay)
+    if outputs == 'cascade':
+        return half_filtered, full_filtered
+
+    overall_filtered = applyFIRFilter(filter_overall, samples, method, axis, compensate_delay)
+
+    return half_filtered, full_filtered, overall_filtered
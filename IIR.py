@@ -9,9 +9,15 @@
 """
 
 # Imported libraries
-from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve
+from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve, sosfilt, sosfilt_zi
 from scipy.fft import fft
 import numpy as np
+from instrumentation import instrumentStage
+
+
+# Global variables
+ZERO_PHASE_BLOCK_SIZE = 1 << 16 # The number of samples filtered at a time in each pass of zero-phase filtering
+
 
 
 #
@@ -50,21 +56,14 @@ def computeIIRNotchCoefficients(notch_freq, notch_width, sampling_freq):
 def calculateGainFactor(numerator, denominator, passband_freq):
     """Calculate and return the coefficent needed to normalise the passband gain of an IIR filter to unity"""
 
-    # Initalise variables
+    # Calculate the value of each tap's delay term at the passband frequency
     num_coeff = len(numerator) # Calculate number of tap coefficents
-    numerator_sum = 0 # The sum of filter's numerator at the passband frequency
-    denominator_sum = 0 # The sum of filter's denominator at the passband frequency
-
-    # Calculate the value of the numerator and denominator by iterating through each tap coefficent
-    for delay_index in range(len(numerator)):
-
-        # Calculate the value of the numerator at tap
-        numerator_coeff = numerator[delay_index] # Extract numerator tap coefficent
-        numerator_sum += numerator_coeff * (np.exp(((num_coeff - delay_index - 1) * 1j * 2 * np.pi * passband_freq))) # Add transfer function value to numerator sum
+    delays = num_coeff - np.arange(num_coeff) - 1 # The power of z for each tap coefficent
+    delay_terms = np.exp(delays * 1j * 2 * np.pi * passband_freq)
 
-        # Calculate the value of the denominator at tap
-        denominator_coeff = denominator[delay_index] # Extract denominator tap coefficent
-        denominator_sum += denominator_coeff * (np.exp(((num_coeff - delay_index - 1) * 1j * 2 * np.pi * passband_freq)))  # Add transfer function value to numerator sum
+    # Calculate the value of the numerator and denominator as the sum over every tap coefficent
+    numerator_sum = np.dot(numerator, delay_terms) # The sum of filter's numerator at the passband frequency
+    denominator_sum = np.dot(denominator, delay_terms) # The sum of filter's denominator at the passband frequency
 
     # Calculate gain factor.
     gain_factor = denominator_sum/numerator_sum # At unity gain: gain_factor * numerator_sum/denominator_sum = 1
@@ -74,6 +73,7 @@ def calculateGainFactor(numerator, denominator, passband_freq):
 
 
 
+@instrumentStage()
 def createIIRNotchFilter(notch_freq, notch_width, passband_f, sample_rate):
     """Create and return the coefficents of an IIR notch filter"""
 
@@ -85,11 +85,118 @@ def createIIRNotchFilter(notch_freq, notch_width, passband_f, sample_rate):
 
 
 
-def applyIIRNotchFilters(numerator_1, denominator_1, numerator_2, denominator_2, data):
-    """Pass data through two cascaded IIR filters and return the result after each filter"""
+def createIIRNotchSOS(notch_freqs, notch_width, passband_freqs, sample_rate):
+    """Create and return a cascade of IIR notch filters, one for each notch frequency, as second order sections"""
+
+    filters = [createIIRNotchFilter(notch_freq, notch_width, passband_f, sample_rate)
+               for notch_freq, passband_f in zip(notch_freqs, passband_freqs)] # Create each notch filter
+
+    return createSOSCascade(filters)
+
+
+
+def createSOSCascade(filters):
+    """Stack a list of (numerator, denominator) second order filters into a second order sections array, with one
+    row [b0, b1, b2, a0, a1, a2] per filter. Unlike combineFilters, no high order polynomial is formed"""
+
+    sos = np.zeros((len(filters), 6)) # One section per filter
+    for section, (numerator, denominator) in enumerate(filters): # Iterate through each filter
+        sos[section, :len(numerator)] = np.real(numerator) # Store the feedforward coefficients
+        sos[section, 3:3 + len(denominator)] = np.real(denominator) # Store the feedback coefficients
+        sos[section] /= sos[section, 3] # Normalise the section so that a0 = 1
+
+    return sos
+
+
+
+def applyIIRNotchSOS(sos, data, stage_outputs=False, axis=-1):
+    """Pass data through a cascade of second order sections along the given axis in a single pass and return the
+    result. 2-D data (records or leads x samples) is filtered in one call. If stage_outputs is True, a list of the
+    result after each section is returned instead, the last being the fully filtered data"""
+
+    # Apply every section in a single pass, without intermediate arrays
+    if not stage_outputs:
+        return sosfilt(sos, data, axis=axis)
+
+    # Apply each section in turn, keeping the result after each
+    outputs = []
+    stage_data = data
+    for section in sos: # Iterate through each section
+        stage_data = sosfilt(section[np.newaxis, :], stage_data, axis=axis) # Apply this section to the previous result
+        outputs.append(stage_data)
+
+    return outputs
+
+
+
+def calculateZeroPhasePadLength(sos):
+    """Return the number of samples the signal is extended by at each end for forward-backward filtering, matching
+    the default of scipy's sosfiltfilt"""
+
+    num_taps = 2 * len(sos) + 1
+    num_taps -= min(np.sum(sos[:, 2] == 0), np.sum(sos[:, 5] == 0)) # Sections which are really first order
+
+    return 3 * num_taps
+
+
+
+def applyZeroPhaseSOS(sos, data, axis=-1, block_size=ZERO_PHASE_BLOCK_SIZE, output=None):
+    """Pass data through a cascade of second order sections forwards and then backwards along the given axis, so the
+    result has no phase shift (and the magnitude response is squared), and return it. This matches scipy's
+    sosfiltfilt, with odd extension at each end, but both passes run block by block carrying the filter state, so
+    only one block of temporary memory is needed however long the recording. output may be a preallocated array
+    (for example a memmap) the shape of data to write the result into"""
+
+    data = np.moveaxis(np.asarray(data), axis, -1) # View the data with samples along the last axis
+    if output is None:
+        output = np.empty(np.moveaxis(data, -1, axis).shape)
+    filtered = np.moveaxis(output, axis, -1) # The same view of the output
+    num_samples = data.shape[-1]
+    pad_length = calculateZeroPhasePadLength(sos)
+    if num_samples <= pad_length:
+        raise ValueError('The data must be longer than the {} samples it is extended by at each end'.format(pad_length))
+
+    # Extend each end by its odd reflection, so the filters start and end settled on the signal's trend
+    front = 2 * data[..., :1] - data[..., pad_length:0:-1]
+    back = 2 * data[..., -1:] - data[..., -2:-(pad_length + 2):-1]
+    initial_state = sosfilt_zi(sos).reshape((len(sos),) + (1,) * (data.ndim - 1) + (2,)) # Steady state for a unit step
+    block_starts = range(0, num_samples, block_size)
+
+    # Forward pass, from the front extension through the data to the back extension
+    filtered_front, state = sosfilt(sos, front, zi=initial_state * front[..., :1])
+    for start in block_starts:
+        filtered[..., start:start + block_size], state = sosfilt(sos, data[..., start:start + block_size], zi=state)
+    filtered_back, state = sosfilt(sos, back, zi=state)
+
+    # Backward pass, from the end of the back extension through the data in reverse
+    reversed_back = filtered_back[..., ::-1]
+    dummy, state = sosfilt(sos, reversed_back, zi=initial_state * reversed_back[..., :1])
+    for start in reversed(block_starts):
+        reversed_block, state = sosfilt(sos, filtered[..., start:start + block_size][..., ::-1], zi=state)
+        filtered[..., start:start + block_size] = reversed_block[..., ::-1]
+
+    return output
+
+
+
+@instrumentStage()
+def applyIIRNotchFilters(numerator_1, denominator_1, numerator_2, denominator_2, data, partial_output=True, axis=-1,
+                         zero_phase=False):
+    """Pass data through two cascaded IIR filters along the given axis and return the result after each filter. If
+    partial_output is False only the fully filtered data is computed and returned, in a single pass. If zero_phase
+    is True each filter is applied forwards and backwards, so the results have no phase shift (for offline use)"""
+
+    sos = createSOSCascade([(numerator_1, denominator_1), (numerator_2, denominator_2)]) # Store the notches as second order sections
+
+    if zero_phase: # Each notch is applied forwards and backwards in turn, so the partial result is the same either way
+        partially_filtered_data = applyZeroPhaseSOS(sos[0:1], data, axis)
+        filtered_data = applyZeroPhaseSOS(sos[1:2], partially_filtered_data, axis)
+        return (partially_filtered_data, filtered_data) if partial_output else filtered_data
+
+    if not partial_output:
+        return applyIIRNotchSOS(sos, data, axis=axis) # Apply both notch filters to data in one pass
 
-    partially_filtered_data = lfilter(numerator_1, denominator_1, data) # Apply first filter to data
-    filtered_data = lfilter(numerator_2, denominator_2, partially_filtered_data) # Apply second notch filter to data
+    partially_filtered_data, filtered_data = applyIIRNotchSOS(sos, data, stage_outputs=True, axis=axis) # Apply both notch filters, keeping the first result
 
     return partially_filtered_data, filtered_data
 
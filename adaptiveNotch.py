@@ -0,0 +1,138 @@
+"""
+    adaptiveNotch.py
+    Contains the adaptive notch filter functions for ENEL420-20S2 Assignment 1.
+    Each notch is an LMS adaptive noise canceller: an internal quadrature oscillator is
+    weighted to match the interference, which is subtracted from the signal. The rotation
+    of the weights drives a frequency locked loop, so the notch follows the interference
+    frequency sample by sample as it drifts, instead of relying on a fixed wide notch.
+    Every channel is processed at once, and the state is kept between blocks.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import numpy as np
+from compiledKernels import useCompiledKernels, adaptiveNotchKernel
+
+
+# Global variables
+ADAPTIVE_STEP_SIZE = 0.005 # LMS step size of the interference amplitude and phase weights
+FREQUENCY_STEP_SIZE = 0.01 # Gain of the frequency locked loop
+TRACKING_RANGE = 2.0 # The furthest (Hz) each notch may move from its starting frequency
+
+
+
+#
+# Adaptive notch functions
+#
+def createAdaptiveNotchState(notch_freqs, sample_rate, num_channels=1, step_size=ADAPTIVE_STEP_SIZE,
+                             frequency_step_size=FREQUENCY_STEP_SIZE, tracking_range=TRACKING_RANGE):
+    """Create and return the state of a cascade of adaptive notch filters, one per starting notch frequency (Hz),
+    for num_channels channels. The state is updated by each block filtered, so blocks can be streamed"""
+
+    rads_per_hz = 2 * np.pi / sample_rate # Convert frequencies to radians per sample
+    start_omega = np.repeat(np.array(notch_freqs, dtype=float)[:, np.newaxis], num_channels, axis=1) * rads_per_hz
+
+    return {'sample_rate': sample_rate,
+            'step_size': step_size,
+            'frequency_step_size': frequency_step_size,
+            'omega': start_omega, # Current frequency of each notch (radians per sample), notches x channels
+            'omega_min': start_omega - tracking_range * rads_per_hz,
+            'omega_max': start_omega + tracking_range * rads_per_hz,
+            'phase': np.zeros_like(start_omega), # Phase of each notch's oscillator
+            'weights': np.zeros((len(notch_freqs), 2, num_channels))} # Cosine and sine weights of each notch
+
+
+
+def getAdaptiveNotchFrequencies(state):
+    """Return the frequency (Hz) each notch is currently tracking, as notches x channels"""
+
+    return state['omega'] * state['sample_rate'] / (2 * np.pi)
+
+
+
+def filterAdaptiveNotchStage(state, notch, data):
+    """Pass channels x samples data through one adaptive notch of the state and return the result. Each sample's
+    weights and frequency depend on the error of the sample before, so the NumPy path is vectorised across channels
+    only, and loops over the samples of the block. The compiled kernel is much faster for long recordings"""
+
+    if useCompiledKernels(): # The state arrays are updated in place by the kernel
+        filtered_data = np.empty_like(data)
+        adaptiveNotchKernel(np.ascontiguousarray(data), state['omega'][notch], state['omega_min'][notch],
+                            state['omega_max'][notch], state['phase'][notch], state['weights'][notch],
+                            state['step_size'], state['frequency_step_size'], filtered_data)
+        return filtered_data
+
+    step_size = state['step_size']
+    frequency_step_size = state['frequency_step_size']
+    omega = state['omega'][notch].copy()
+    omega_min = state['omega_min'][notch]
+    omega_max = state['omega_max'][notch]
+    phase = state['phase'][notch].copy()
+    cos_weight, sin_weight = state['weights'][notch].copy()
+    filtered_data = np.empty_like(data)
+
+    for index in range(data.shape[1]): # Iterate through each sample of every channel at once
+        cos_reference = np.cos(phase)
+        sin_reference = np.sin(phase)
+
+        # Subtract the estimated interference, and move the weights towards it (LMS)
+        error = data[:, index] - (cos_weight * cos_reference + sin_weight * sin_reference)
+        cos_update = step_size * error * cos_reference
+        sin_update = step_size * error * sin_reference
+
+        # The weights rotate when the oscillator is off frequency, so steer the frequency against the rotation
+        weight_power = np.maximum(cos_weight * cos_weight + sin_weight * sin_weight, np.finfo(float).tiny)
+        rotation = (cos_weight * sin_update - sin_weight * cos_update) / weight_power
+        omega = np.clip(omega - frequency_step_size * rotation, omega_min, omega_max)
+
+        cos_weight += cos_update
+        sin_weight += sin_update
+        phase = np.mod(phase + omega, 2 * np.pi)
+        filtered_data[:, index] = error
+
+    # Keep the state for the next block
+    state['omega'][notch] = omega
+    state['phase'][notch] = phase
+    state['weights'][notch] = cos_weight, sin_weight
+
+    return filtered_data
+
+
+
+def applyAdaptiveNotch(state, data, stage_outputs=False):
+    """Pass data (1-D, or channels x samples) through the cascade of adaptive notches and return the result. If
+    stage_outputs is True, a list of the result after each notch is returned instead, the last being the fully
+    filtered data"""
+
+    data = np.asarray(data, dtype=float)
+    channel_data = np.atleast_2d(data) # Treat a single channel as one row
+    if channel_data.shape[0] != state['omega'].shape[1]:
+        raise ValueError('Data has {} channels, but the adaptive notch state has {}'.format(channel_data.shape[0], state['omega'].shape[1]))
+
+    outputs = []
+    for notch in range(len(state['omega'])): # Iterate through each notch in the cascade
+        channel_data = filterAdaptiveNotchStage(state, notch, channel_data)
+        outputs.append(channel_data.reshape(data.shape))
+
+    return outputs if stage_outputs else outputs[-1]
+
+
+
+def applyAdaptiveNotchFilters(notch_freq_1, notch_freq_2, sample_rate, data, partial_output=True):
+    """Pass data through two cascaded adaptive notch filters, starting at the given frequencies, and return the
+    result after each filter. If partial_output is False only the fully filtered data is returned. The pipeline runs
+    it in place of applyIIRNotchFilters for a filter spec entry of kind 'adaptive'. Without Numba each sample is a
+    Python loop iteration, so it filters about 10k-20k samples/s, against millions for the IIR notch filters"""
+
+    num_channels = 1 if np.ndim(data) == 1 else np.shape(data)[0]
+    state = createAdaptiveNotchState([notch_freq_1, notch_freq_2], sample_rate, num_channels)
+    partially_filtered_data, filtered_data = applyAdaptiveNotch(state, data, stage_outputs=True)
+
+    if not partial_output:
+        return filtered_data
+
+    return partially_filtered_data, filtered_data
@@ -0,0 +1,197 @@
+"""
+    batch.py
+    Runs the IIR and FIR notch filter pipeline of ENEL420-20S2 Assignment 1 over a whole
+    directory (or glob) of recordings, spread over a pool of worker processes. The noise
+    power (variance) removed by every filter is saved for every record to one CSV table.
+    A record which cannot be processed gets a row of NaN with its error, and the rest of
+    the batch carries on.
+    With a reuse folder, records whose contents and configuration are unchanged since a
+    previous run are not processed again.
+
+    Usage: python batch.py <directory or glob> [-o output.csv] [-j workers] [-c cache] [-i stages.jsonl] [-r reuse] [-a]
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import glob
+import os
+from IIR import *
+from FIR import *
+from noise import *
+from configFiles import *
+from designCache import *
+from streaming import *
+from interference import *
+from instrumentation import *
+from incremental import *
+
+
+# Global variables
+DEFAULT_CONFIG = {'sample_rate': 1024, # Sample rate of data (Hz)
+                  'cutoff': (57.755, 88.824), # Frequencies to attenuate (Hz), or 'auto' to detect them in each record
+                  'passband_f': (10, 10), # Passband frequencies (Hz) used to calculate the gain factor
+                  'notch_width': 5, # 3 dB bandwidth of the notch filters (Hz)
+                  'num_FIR_taps': 399} # The number for each FIR filter
+RECORDING_EXTENSIONS = ['.txt', '.ecg'] # The file types picked up when a directory is given
+BLOCK_SIZE = 1 << 16 # The number of samples streamed through the pipeline at a time
+CUTOFF_DECIMALS = 2 # Detected frequencies are rounded to this many decimal places, so similar records share designs
+NOISE_POWER_NAMES = list(createFilterNoiseStages()) # The filters noise power is calculated for, in table order
+
+
+
+#
+# Recording functions
+#
+def findRecordings(location):
+    """Return a sorted list of the recordings in a directory, or matching a glob pattern"""
+
+    if os.path.isdir(location): # Pick up every recording in the directory
+        filenames = [os.path.join(location, name) for name in os.listdir(location)
+                     if os.path.splitext(name)[1] in RECORDING_EXTENSIONS]
+    else: # Treat the location as a glob pattern
+        filenames = glob.glob(location)
+
+    return sorted(filenames)
+
+
+
+#
+# Pipeline functions
+#
+def createFilters(config):
+    """Return every filter used by the pipeline for a configuration. FIR designs come from the design cache, so
+    workers only design each configuration once and reuse it for every record"""
+
+    cutoff = config['cutoff']
+    sample_rate = config['sample_rate']
+    notch_width = config['notch_width']
+    num_taps = config['num_FIR_taps']
+
+    filters = {'IIR': [createIIRNotchFilter(cutoff[0], notch_width, config['passband_f'][0], sample_rate),
+                       createIIRNotchFilter(cutoff[1], notch_width, config['passband_f'][1], sample_rate)],
+               'Window': createCachedFilters('window', cutoff, sample_rate, notch_width, num_taps),
+               'Optimal': createCachedFilters('optimal', cutoff, sample_rate, notch_width, num_taps),
+               'Frequency Sampling': createCachedFilters('freq_sampling', cutoff, sample_rate, notch_width, num_taps)}
+
+    return filters
+
+
+
+@instrumentStage()
+def processRecording(filename, config=DEFAULT_CONFIG):
+    """Stream one recording through the IIR and FIR filter pipeline and return the two notch frequencies followed by
+    the noise power removed by each filter, in the order of NOISE_POWER_NAMES. Only one block of the recording is in
+    memory at a time. If the cutoff is 'auto' and two interference frequencies cannot be found, a ValueError is
+    raised, so the record is reported as failed"""
+
+    # Detect the interference frequencies of this record
+    if config['cutoff'] == 'auto':
+        cutoff = detectInterferenceBlocks(importDataBlocks(filename, BLOCK_SIZE), config['sample_rate'], max_peaks=2)
+        if len(cutoff) != 2: # Too few peaks to place both notches
+            raise ValueError('found {} interference peaks, need 2'.format(len(cutoff)))
+        config = dict(config, cutoff=tuple(round(frequency, CUTOFF_DECIMALS) for frequency in cutoff))
+
+    filters = createFilters(config) # Reuse this process' FIR designs for the configuration
+    fir_filters = {family: filters[family] for family in FIR_FAMILIES}
+
+    noise_power_data = streamNoisePowerData(importDataBlocks(filename, BLOCK_SIZE), filters['IIR'], fir_filters)
+
+    return list(config['cutoff']) + [noise_power_data[filter_name] for filter_name in NOISE_POWER_NAMES]
+
+
+
+def processRecordingInWorker(job):
+    """Unpack the arguments of processRecording so it can be mapped over a process pool, and return its results,
+    whether they were reused, and the error if the record could not be processed (None if it was). A failed record's
+    results are NaN, so one bad record does not stop the batch. If the job has an incremental location, the results
+    are keyed on the recording's contents and the configuration, and reused from a previous run if they are found
+    there. Failures are not saved, so they are tried again next run"""
+
+    filename, config, incremental_location = job
+    try:
+        if incremental_location is None:
+            return processRecording(filename, config), False, None
+
+        key = createKey(processRecording, 'processRecording', config, hashFile(filename)) # Any change to the recording or configuration misses
+        found, results = loadOutput(incremental_location, key)
+        if found:
+            return results, True, None
+
+        results = processRecording(filename, config)
+        saveOutput(incremental_location, key, results)
+    except Exception as error: # Such as an unreadable or malformed recording
+        return [np.nan] * (2 + len(NOISE_POWER_NAMES)), False, '{}: {}'.format(type(error).__name__, error)
+
+    return results, False, None
+
+
+
+#
+# Batch functions
+#
+def initializeWorker(cache_location, instrumentation_filename):
+    """Set up a worker process: share filter designs through the cache folder, and record the time and memory of
+    each stage to the instrumentation file, if either is given"""
+
+    setDiskCache(cache_location)
+    if instrumentation_filename is not None:
+        enableInstrumentation([createJSONSink(instrumentation_filename)])
+
+
+
+def runBatch(location, output_filename, num_workers=None, config=DEFAULT_CONFIG, chunk_size=8, cache_location=None,
+             instrumentation_filename=None, incremental_location=None):
+    """Process every recording in a directory or glob over a pool of num_workers processes (all cores if None),
+    and save the noise power of every filter for every record to a CSV table. Returns the number of records, the
+    number whose results were reused, and the number which failed (their rows are NaN, with the error in the last
+    column). If cache_location is given, filter designs are shared between workers
+    and runs through that folder. If instrumentation_filename is given, every worker appends a record of each stage
+    to that JSON lines file. If incremental_location is given, each record's results are saved there, and records
+    whose contents and configuration are unchanged since a previous run are not processed again"""
+
+    filenames = findRecordings(location)
+    jobs = [(filename, config, incremental_location) for filename in filenames] # Every worker receives the configuration with each record
+    num_reused = 0
+    num_failed = 0
+
+    # Write each record's row as soon as it is done, in the order the records were found
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=initializeWorker,
+                             initargs=(cache_location, instrumentation_filename)) as pool, \
+         open(output_filename, 'w', newline='') as outputfile:
+        writer = csv.writer(outputfile)
+        writer.writerow(['record', 'first notch (Hz)', 'second notch (Hz)'] + NOISE_POWER_NAMES + ['error'])
+        for filename, (results, reused, error) in zip(filenames, pool.map(processRecordingInWorker, jobs, chunksize=chunk_size)):
+            writer.writerow([filename] + ['{:.6f}'.format(result) for result in results] + [error or ''])
+            num_reused += reused
+            num_failed += error is not None
+
+    return len(filenames), num_reused, num_failed
+
+
+
+# Run program if called
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ECG notch filter pipeline over many recordings')
+    parser.add_argument('location', help='A directory of recordings, or a glob pattern matching them')
+    parser.add_argument('-o', '--output', default='Group_18_Noise_Power_(Variance)_Batch.csv', help='The CSV table to save')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='The number of worker processes (default: all cores)')
+    parser.add_argument('-c', '--cache', default=None, help='A folder to cache filter designs in between runs')
+    parser.add_argument('-i', '--instrument', default=None, help='A JSON lines file to record the time and memory of each stage to')
+    parser.add_argument('-r', '--reuse', default=None, help='A folder to save each record\'s results to, so unchanged records are skipped next run')
+    parser.add_argument('-a', '--auto-cutoff', action='store_true', help='Detect the interference frequencies of each record, instead of using the fixed cutoff')
+    arguments = parser.parse_args()
+
+    config = dict(DEFAULT_CONFIG, cutoff='auto') if arguments.auto_cutoff else DEFAULT_CONFIG
+    num_records, num_reused, num_failed = runBatch(arguments.location, arguments.output, arguments.workers, config, cache_location=arguments.cache,
+                                       instrumentation_filename=arguments.instrument, incremental_location=arguments.reuse)
+    if arguments.reuse is not None:
+        print('Reused the results of {} of {} records, processed {}'.format(num_reused, num_records, num_records - num_reused))
+    if num_failed:
+        print('{} of {} records could not be processed, see the error column of {}'.format(num_failed, num_records, arguments.output))
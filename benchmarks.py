@@ -0,0 +1,599 @@
+"""
+    benchmarks.py
+    Contains the benchmarks for ENEL420-20S2 Assignment 1, run on synthetic ECG data.
+    The suite times and memory profiles every stage of the pipeline over a range of
+    recording lengths and tap counts, saves the results as JSON, and compares them to a
+    stored baseline so throughput regressions are caught.
+
+    Usage: python benchmarks.py [-o results.json] [-b baseline.json] [--sizes N ...] [--taps N ...]
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import scipy
+from signalPlots import getTimeData, calcFreqSpectrum
+from IIR import calculateGainFactor, computeIIRNotchCoefficients, applyIIRNotchFilters, createIIRNotchFilter, createIIRNotchSOS
+from FIR import createWindowFilters, createOptimalFilters, createFreqSamplingFilters, applyFIRFilters, applyFIRFilter, \
+                countFIROperations, FFT_COST_FACTOR
+from noise import calculateVariance, calculateNoiseVariance
+from configFiles import importData
+from adaptiveNotch import applyAdaptiveNotchFilters
+from streaming import createDataBlocks, streamNoisePowerData
+from realTime import createRealTimeIIRFilter, processFrame
+from compiledKernels import NUMBA_AVAILABLE, getBackend, setBackend
+from multirate import decimateSignal, scaleTapCount
+from designCache import DESIGN_METHODS, REFERENCE_TAPS, createMinimumTapFilters, clearCache, setDiskCache
+import main
+
+
+# Global variables
+SAMPLE_RATE = 1024 # Sample rate of the synthetic data (Hz)
+HELPER_NUM_SAMPLES = 10 ** 7 # The length of the recording the helper functions are timed on
+NOTCH_NUM_SAMPLES = 60 * SAMPLE_RATE # The length of the recordings the notch filters are compared on
+NOTCH_DRIFT = 0.02 # The rate (Hz/s) the interference drifts at in the drifting notch comparison
+RECORDING_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enel420_grp_18.txt') # The bundled recording the notch filters are also compared on
+PARITY_NUM_SAMPLES = 10 * SAMPLE_RATE # The length of the recording the backends are checked against each other on
+PARITY_TOLERANCE = 1e-14 # The largest relative difference allowed between the backends, as in test_compiledKernels.py
+MULTIRATE_FACTORS = [1, 2, 4] # The decimation factors the multirate front end is compared at
+FFT_COST_TAPS = [31, 99, 399, 1023, 4095] # The FIR tap counts the FFT cost factor is measured at
+FFT_COST_NUM_SAMPLES = 10 ** 6 # The length of the recording the FFT cost factor is measured on
+BACKEND_BLOCK_SIZE = 1 << 16 # The block size the streamed functions are timed with
+SUITE_SIZES = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7] # The recording lengths the suite runs on by default
+FULL_SUITE_SIZES = [10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8] # Every recording length, for nightly runs on large machines
+SUITE_TAPS = [99, 399, 1023, 4095] # The FIR tap counts the suite runs on
+SUITE_CUTOFF = (57.755, 88.824) # The notch frequencies (Hz) of the synthetic interference and the filters
+SUITE_NOTCH_WIDTH = 5 # 3 dB bandwidth of the notch filters (Hz)
+MAIN_MAX_SAMPLES = 10 ** 6 # The longest recording the full main() pipeline (which saves every figure) is run on
+DESIGNERS = {'createWindowFilters': createWindowFilters,
+             'createOptimalFilters': createOptimalFilters,
+             'createFreqSamplingFilters': createFreqSamplingFilters} # The FIR designers timed by the suite
+REGRESSION_TOLERANCE = 0.25 # The largest fractional increase over the baseline not reported as a regression
+MIN_COMPARED_TIME = 1e-3 # Stages faster than this (s) in the baseline are too noisy to compare times on
+COMPARED_METRICS = ['wall_time', 'peak_bytes'] # The measurements compared against the baseline
+
+
+
+#
+# Synthetic data functions
+#
+def createSyntheticECG(num_samples, sample_rate=SAMPLE_RATE, interference=(57.755, 88.824), seed=0, drift=0):
+    """Create and return a synthetic ECG (a train of QRS-like pulses at 72 bpm plus baseline noise) with sinusoidal
+    narrowband interference added at each interference frequency, each drifting by drift (Hz/s)"""
+
+    rng = np.random.default_rng(seed)
+    time = np.arange(num_samples) / sample_rate
+    beat_phase = np.mod(time, 60 / 72) # Time since the last beat
+    samples = 400 * np.exp(-np.square((beat_phase - 0.4) / 0.02)) # QRS complex
+    samples += 60 * np.exp(-np.square((beat_phase - 0.65) / 0.06)) # T wave
+    samples += 10 * rng.standard_normal(num_samples) # Broadband noise
+    for frequency in interference: # Add each narrowband interference
+        samples += 100 * np.sin(2 * np.pi * (frequency + 0.5 * drift * time) * time + rng.uniform(0, 2 * np.pi))
+
+    return samples
+
+
+
+#
+# Timing functions
+#
+def timeFunction(function, *args, repeats=3):
+    """Run a function repeats times and return the fastest wall time, in seconds"""
+
+    best_time = np.inf
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best_time = min(best_time, time.perf_counter() - start)
+
+    return best_time
+
+
+
+def measureFunction(function, *args, repeats=3):
+    """Run a function and return a dictionary of its fastest wall time and the CPU time of that run (s), and the
+    peak memory allocated while it ran (bytes). The memory is traced in a separate run, so tracing does not slow the
+    timed runs. The result of the function is returned with the measurements"""
+
+    wall_time = np.inf
+    for repeat in range(repeats): # Keep the fastest run, which is the least disturbed by the rest of the machine
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = function(*args)
+        run_time = time.perf_counter() - start_wall
+        if run_time < wall_time:
+            wall_time = run_time
+            cpu_time = time.process_time() - start_cpu
+        del result # Free the result before the next run
+
+    tracemalloc.start() # NumPy reports its array allocations to tracemalloc
+    result = function(*args)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_bytes': peak_bytes}, result
+
+
+
+#
+# Original helper implementations, kept to measure the speedup of the vectorized helpers against
+#
+def loopCalculateVariance(data):
+    """The original variance, using Python's builtin sum over the data"""
+
+    expected_data_power = sum((np.square(data)))/len(data)
+    power_of_expected_data = np.square(sum(data)/len(data))
+
+    return expected_data_power - power_of_expected_data
+
+
+
+def loopGetTimeData(sample_rate, num_samples):
+    """The original time axis, built by appending each sample time to a list"""
+
+    time = []
+    for i in range(num_samples):
+        time.append(i/sample_rate)
+
+    return time
+
+
+
+def loopCalculateGainFactor(numerator, denominator, passband_freq):
+    """The original gain factor, looping over each tap coefficent"""
+
+    num_coeff = len(numerator)
+    numerator_sum = 0
+    denominator_sum = 0
+    for delay_index in range(len(numerator)):
+        numerator_sum += numerator[delay_index] * (np.exp(((num_coeff - delay_index - 1) * 1j * 2 * np.pi * passband_freq)))
+        denominator_sum += denominator[delay_index] * (np.exp(((num_coeff - delay_index - 1) * 1j * 2 * np.pi * passband_freq)))
+
+    return np.real(denominator_sum/numerator_sum)
+
+
+
+#
+# Benchmarks
+#
+def benchmarkHelpers(num_samples=HELPER_NUM_SAMPLES):
+    """Time the original and vectorized helper functions on a synthetic recording and return a dictionary of
+    (original time, vectorized time) for each helper"""
+
+    samples = createSyntheticECG(num_samples)
+    numerator, denominator = computeIIRNotchCoefficients(57.755, 5, SAMPLE_RATE)
+
+    results = {'calculateVariance': (timeFunction(loopCalculateVariance, samples, repeats=1),
+                                     timeFunction(calculateVariance, samples)),
+               'getTimeData': (timeFunction(loopGetTimeData, SAMPLE_RATE, num_samples, repeats=1),
+                               timeFunction(getTimeData, SAMPLE_RATE, num_samples)),
+               'calculateGainFactor': (timeFunction(loopCalculateGainFactor, numerator, denominator, 10),
+                                       timeFunction(calculateGainFactor, numerator, denominator, 10))}
+
+    return results
+
+
+
+def printHelperResults(results, num_samples=HELPER_NUM_SAMPLES):
+    """Print the helper benchmark results as a table"""
+
+    print('Helper functions on {} samples'.format(num_samples))
+    for name, (original_time, vectorized_time) in results.items():
+        print('{:<20} original {:10.6f} s  vectorized {:10.6f} s  speedup {:8.1f}x'.format(
+            name, original_time, vectorized_time, original_time / vectorized_time))
+
+
+
+def benchmarkNotchFilters(samples, cutoff, sample_rate=SAMPLE_RATE, notch_width=5, passband_f=(10, 10)):
+    """Compare the fixed IIR notch filters against the adaptive notch filters on a recording, and return a dictionary
+    of (samples per second, noise power removed) for each"""
+
+    notch_1 = createIIRNotchFilter(cutoff[0], notch_width, passband_f[0], sample_rate)
+    notch_2 = createIIRNotchFilter(cutoff[1], notch_width, passband_f[1], sample_rate)
+    filters = {'Fixed IIR notch': lambda: applyIIRNotchFilters(*notch_1, *notch_2, samples, partial_output=False),
+               'Adaptive notch': lambda: applyAdaptiveNotchFilters(cutoff[0], cutoff[1], sample_rate, samples, partial_output=False)}
+
+    results = {}
+    for name, notch_filter in filters.items():
+        filter_time = timeFunction(notch_filter, repeats=1)
+        results[name] = (len(samples) / filter_time, calculateNoiseVariance(samples, notch_filter()))
+
+    return results
+
+
+
+def printNotchResults(results, description):
+    """Print the notch filter comparison results as a table"""
+
+    print('Notch filters on {}'.format(description))
+    for name, (samples_per_second, noise_power) in results.items():
+        print('{:<20} {:12.0f} samples/s  noise power removed {:10.2f}'.format(name, samples_per_second, noise_power))
+
+
+
+def benchmarkMultirate(samples, cutoff, num_taps=399, factors=MULTIRATE_FACTORS, sample_rate=SAMPLE_RATE, notch_width=5):
+    """Compare decimating a recording before the FIR window filters against filtering at the full rate, and return
+    a dictionary of (seconds, taps, noise power removed) for each decimation factor. The noise power is measured at
+    the rate the filters run at"""
+
+    results = {}
+    for factor in factors:
+        factor_taps = scaleTapCount(num_taps, factor) if factor > 1 else num_taps
+        filters = createWindowFilters(cutoff, sample_rate / factor, notch_width, factor_taps)
+        filterDecimated = lambda: applyFIRFilters(*filters, decimateSignal(samples, factor), outputs='overall')
+        results[factor] = (timeFunction(filterDecimated), factor_taps,
+                           calculateNoiseVariance(decimateSignal(samples, factor), filterDecimated()))
+
+    return results
+
+
+
+def printMultirateResults(results):
+    """Print the multirate comparison results as a table, relative to the first decimation factor"""
+
+    print('Multirate front end (decimation then FIR window filters)')
+    base_time, base_taps, base_noise = next(iter(results.values()))
+    for factor, (filter_time, num_taps, noise_power) in results.items():
+        print('factor {:<3} taps {:>5} {:10.6f} s  speedup {:6.1f}x  noise power change {:+6.2f}%'.format(
+            factor, num_taps, filter_time, base_time / filter_time, 100 * (noise_power - base_noise) / base_noise))
+
+
+
+def benchmarkFFTCostFactor(num_samples=FFT_COST_NUM_SAMPLES, taps=FFT_COST_TAPS):
+    """Measure the cost of one FFT butterfly unit relative to one direct form multiply-add, which chooseFIRMethod
+    weighs the two methods by (FFT_COST_FACTOR), and return a dictionary of the factor measured at each tap count.
+    Each factor is the time per butterfly unit of overlap-add convolution over the time per multiply-add of lfilter"""
+
+    samples = createSyntheticECG(num_samples)
+    results = {}
+    for num_taps in taps:
+        filter_array = createWindowFilters(SUITE_CUTOFF, SAMPLE_RATE, SUITE_NOTCH_WIDTH, num_taps | 1)[2] # Any filter has the same cost
+        direct_time = timeFunction(applyFIRFilter, filter_array, samples, 'direct')
+        fft_time = timeFunction(applyFIRFilter, filter_array, samples, 'fft')
+        direct_operations, fft_operations = countFIROperations(len(filter_array), num_samples)
+        results[len(filter_array)] = (fft_time / fft_operations) / (direct_time / direct_operations)
+
+    return results
+
+
+
+def printFFTCostResults(results):
+    """Print the FFT cost factor measured at each tap count, and their median, against FFT_COST_FACTOR"""
+
+    print('FFT cost factor (FFT_COST_FACTOR is {})'.format(FFT_COST_FACTOR))
+    for num_taps, factor in results.items():
+        print('taps {:>5} factor {:6.1f}'.format(num_taps, factor))
+    print('median     {:6.1f}'.format(np.median(list(results.values()))))
+
+
+
+def benchmarkMinimumTaps(samples, cutoff, sample_rate=SAMPLE_RATE, notch_width=5, reference_taps=REFERENCE_TAPS):
+    """Search for the fewest taps meeting the default specification with each FIR design method, and return a
+    dictionary of the search report, and the filtering time per sample of the fixed and searched designs, for each"""
+
+    results = {}
+    for method, designer in DESIGN_METHODS.items():
+        filters, report = createMinimumTapFilters(method, cutoff, sample_rate, notch_width, reference_taps=reference_taps)
+        reference_filters = designer(cutoff, sample_rate, notch_width, reference_taps)
+        results[method] = (report, timeFunction(applyFIRFilters, *reference_filters, samples) / len(samples),
+                           timeFunction(applyFIRFilters, *filters, samples) / len(samples))
+
+    return results
+
+
+
+def printMinimumTapResults(results, reference_taps=REFERENCE_TAPS):
+    """Print the minimum tap search results as a table"""
+
+    print('Minimum tap FIR designs, against {} taps'.format(reference_taps))
+    for method, (report, reference_time, searched_time) in results.items():
+        print('{:<14} taps {:>5} ({:>2} tried, {:6.3f} s)  attenuation {:5.1f} dB  ripple {:4.2f} dB  '
+              'multiply-adds saved {:>6}/sample  time saved {:+.2e} s/sample'.format(
+              method, report['num_taps'], report['designs_tried'], report['design_time'], report['attenuation'],
+              report['ripple'], report['multiply_adds_saved_per_sample'], reference_time - searched_time))
+
+
+
+#
+# Backend parity functions
+#
+def runBackendFunctions(samples, cutoff=(57.755, 88.824)):
+    """Run every function with a compiled kernel on a recording, with the backend currently selected, and return a
+    dictionary of each function's output"""
+
+    notch_1 = createIIRNotchFilter(cutoff[0], 5, 10, SAMPLE_RATE)
+    notch_2 = createIIRNotchFilter(cutoff[1], 5, 10, SAMPLE_RATE)
+    fir_filters = {'Window': createWindowFilters(cutoff, SAMPLE_RATE, 5, 399)}
+    real_time_state = createRealTimeIIRFilter(createIIRNotchSOS(cutoff, 5, [10, 10], SAMPLE_RATE), SAMPLE_RATE)
+    real_time_output = np.concatenate([processFrame(real_time_state, samples[start:start + 32]).copy()
+                                       for start in range(0, len(samples), 32)])
+    noise_power_data = streamNoisePowerData(createDataBlocks(samples, 4096), [notch_1, notch_2], fir_filters)
+
+    return {'calculateVariance': calculateVariance(np.stack([samples, samples[::-1]])),
+            'streamNoisePowerData': np.array(list(noise_power_data.values())),
+            'processFrame': real_time_output,
+            'applyAdaptiveNotchFilters': applyAdaptiveNotchFilters(cutoff[0], cutoff[1], SAMPLE_RATE, samples, partial_output=False)}
+
+
+
+def checkBackendParity(num_samples=PARITY_NUM_SAMPLES, tolerance=PARITY_TOLERANCE):
+    """Run every function with a compiled kernel with both backends, and return a dictionary of the largest
+    difference between them relative to the largest output, and of whether it is within tolerance, for each"""
+
+    if not NUMBA_AVAILABLE:
+        raise ImportError('The backends can only be compared when Numba is installed')
+
+    samples = createSyntheticECG(num_samples)
+    previous_backend = getBackend()
+    outputs = {}
+    try:
+        for backend_name in ['numpy', 'numba']: # Run every function with each backend
+            setBackend(backend_name)
+            outputs[backend_name] = runBackendFunctions(samples)
+    finally:
+        setBackend(previous_backend)
+
+    parity = {}
+    for name, numpy_output in outputs['numpy'].items():
+        difference = np.max(np.abs(outputs['numba'][name] - numpy_output)) / np.max(np.abs(numpy_output))
+        parity[name] = (difference, difference <= tolerance)
+
+    return parity
+
+
+
+def benchmarkBackends(num_samples=NOTCH_NUM_SAMPLES):
+    """Time every function with a compiled kernel with each backend, and return a dictionary of (numpy time, numba
+    time) for each. The kernels are compiled before timing"""
+
+    samples = createSyntheticECG(num_samples)
+    notch_1 = createIIRNotchFilter(57.755, 5, 10, SAMPLE_RATE)
+    notch_2 = createIIRNotchFilter(88.824, 5, 10, SAMPLE_RATE)
+    previous_backend = getBackend()
+    times = {}
+    try:
+        for backend_name in ['numpy', 'numba']: # Time every function with each backend
+            setBackend(backend_name)
+            runBackendFunctions(samples[:1024]) # Compile the kernels, so compilation is not timed
+            real_time_state = createRealTimeIIRFilter(createIIRNotchSOS([57.755, 88.824], 5, [10, 10], SAMPLE_RATE), SAMPLE_RATE)
+            functions = {'calculateVariance': lambda: calculateVariance(samples),
+                         'streamNoisePowerData': lambda: streamNoisePowerData(createDataBlocks(samples, BACKEND_BLOCK_SIZE), [notch_1, notch_2], {}),
+                         'processFrame': lambda: [processFrame(real_time_state, samples[start:start + 32]) for start in range(0, len(samples), 32)],
+                         'applyAdaptiveNotchFilters': lambda: applyAdaptiveNotchFilters(57.755, 88.824, SAMPLE_RATE, samples)}
+            times[backend_name] = {name: timeFunction(function, repeats=1) for name, function in functions.items()}
+    finally:
+        setBackend(previous_backend)
+
+    return {name: (times['numpy'][name], times['numba'][name]) for name in times['numpy']}
+
+
+
+def printBackendResults(parity, times):
+    """Print the backend parity checks and timings as a table"""
+
+    print('Backends')
+    for name, (difference, passed) in parity.items():
+        numpy_time, numba_time = times[name]
+        print('{:<26} numpy {:10.6f} s  numba {:10.6f} s  speedup {:8.1f}x  difference {:.1e} {}'.format(
+            name, numpy_time, numba_time, numpy_time / numba_time, difference, 'ok' if passed else 'MISMATCH'))
+
+
+
+#
+# Pipeline benchmark suite
+#
+def createResult(stage, num_samples, num_taps, measurements=None, error=None):
+    """Create and return the result of one stage measurement. num_samples or num_taps is None when the stage does not
+    depend on it, and error holds the message of a stage that failed"""
+
+    result = {'stage': stage, 'num_samples': num_samples, 'num_taps': num_taps}
+    if measurements is not None:
+        result.update(measurements)
+        if num_samples is not None: # Throughput of the stage
+            result['samples_per_second'] = num_samples / measurements['wall_time']
+    if error is not None:
+        result['error'] = error
+
+    return result
+
+
+
+def benchmarkStage(results, stage, num_samples, num_taps, function, *args, repeats=3):
+    """Measure one stage and append its result to results. A stage that raises is recorded with its error, so one
+    failing design does not stop the suite. Returns the result of the function, or None if it failed"""
+
+    try:
+        measurements, output = measureFunction(function, *args, repeats=repeats)
+    except Exception as error:
+        results.append(createResult(stage, num_samples, num_taps, error=str(error)))
+        return None
+
+    results.append(createResult(stage, num_samples, num_taps, measurements))
+    print('{:<26} samples {:>10} taps {:>5} {:12.6f} s {:12.1f} MB'.format(stage, str(num_samples), str(num_taps),
+          measurements['wall_time'], measurements['peak_bytes'] / 1e6), file=sys.stderr)
+
+    return output
+
+
+
+def runMain(data_filename):
+    """Run the full main() pipeline cold on a recording, in a temporary folder so its figures, noise file and filter
+    cache are thrown away afterwards. The in-process design cache is emptied first, so no design is reused from an
+    earlier run"""
+
+    previous_location = os.getcwd()
+    clearCache() # Designs from earlier runs in this process would otherwise be reused
+    with tempfile.TemporaryDirectory() as run_location:
+        os.symlink(os.path.abspath(data_filename), os.path.join(run_location, 'enel420_grp_18.txt')) # The recording main() reads
+        os.chdir(run_location)
+        try:
+            main.main()
+        finally:
+            os.chdir(previous_location)
+            setDiskCache(None) # main() points the disk cache into the temporary folder, which is about to be removed
+
+
+
+def runSuite(sizes=SUITE_SIZES, taps=SUITE_TAPS, main_max_samples=MAIN_MAX_SAMPLES):
+    """Time and memory profile every stage of the pipeline on synthetic recordings of each size, and with FIR filters
+    of each tap count, and return the results as a dictionary ready to save as JSON. The full main() pipeline runs
+    cold (designing its filters, and saving every figure); figures are drawn in worker processes, whose memory is not
+    included"""
+
+    results = []
+
+    # The filter designs do not depend on the recording
+    notch_1 = benchmarkStage(results, 'createIIRNotchFilter', None, None, createIIRNotchFilter, SUITE_CUTOFF[0], SUITE_NOTCH_WIDTH, 10, SAMPLE_RATE)
+    notch_2 = createIIRNotchFilter(SUITE_CUTOFF[1], SUITE_NOTCH_WIDTH, 10, SAMPLE_RATE)
+    fir_filters = {}
+    for num_taps in taps:
+        for designer_name, designer in DESIGNERS.items():
+            filters = benchmarkStage(results, designer_name, None, num_taps, designer, SUITE_CUTOFF, SAMPLE_RATE, SUITE_NOTCH_WIDTH, num_taps)
+            if filters is not None and num_taps not in fir_filters: # Any design will do to time applying the filters
+                fir_filters[num_taps] = filters
+
+    with tempfile.TemporaryDirectory() as data_location:
+        for num_samples in sizes: # Iterate through each recording length
+            samples = createSyntheticECG(num_samples)
+            data_filename = os.path.join(data_location, 'synthetic_{}.txt'.format(num_samples))
+            np.savetxt(data_filename, samples, fmt='%.7e') # The same text format as the recordings
+
+            benchmarkStage(results, 'importData', num_samples, None, importData, data_filename, repeats=1)
+            filtered = benchmarkStage(results, 'applyIIRNotchFilters', num_samples, None, applyIIRNotchFilters, *notch_1, *notch_2, samples)
+            for num_taps, filters in fir_filters.items():
+                benchmarkStage(results, 'applyFIRFilters', num_samples, num_taps, applyFIRFilters, *filters, samples, repeats=1)
+                benchmarkStage(results, 'applyFIRFilters overall', num_samples, num_taps, applyFIRFilters, *filters, samples,
+                               'auto', -1, False, 'overall', repeats=1)
+                benchmarkStage(results, 'applyFIRFilter symmetric', num_samples, num_taps, applyFIRFilter, filters[2], samples,
+                               'symmetric', repeats=1)
+            benchmarkStage(results, 'calcFreqSpectrum', num_samples, None, calcFreqSpectrum, samples, SAMPLE_RATE)
+            if filtered is not None: # The notch filters' output is needed to time the noise variance
+                benchmarkStage(results, 'calculateNoiseVariance', num_samples, None, calculateNoiseVariance, samples, filtered[1])
+            if num_samples <= main_max_samples:
+                benchmarkStage(results, 'main', num_samples, None, runMain, data_filename, repeats=1)
+
+            del samples, filtered # Free this recording before creating the next
+            os.remove(data_filename)
+
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'backend': getBackend(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+
+
+def saveSuiteResults(suite_results, output_filename):
+    """Save the suite results to a JSON file"""
+
+    with open(output_filename, 'w') as outputfile:
+        json.dump(suite_results, outputfile, indent=1)
+
+
+
+def loadSuiteResults(filename):
+    """Load and return suite results saved by saveSuiteResults"""
+
+    with open(filename) as inputfile:
+        return json.load(inputfile)
+
+
+
+def getResultKey(result):
+    """Return the key which matches a stage measurement to the same measurement in another run"""
+
+    return (result['stage'], result['num_samples'], result['num_taps'])
+
+
+
+def compareSuiteResults(suite_results, baseline_results, tolerance=REGRESSION_TOLERANCE):
+    """Compare suite results against a baseline and return a list of regressions, each a dictionary of the stage key,
+    metric, baseline and new values, and their ratio. A metric regresses when it grows by more than tolerance. Stages
+    which newly fail also count as regressions; stages missing from either run are skipped"""
+
+    baseline = {getResultKey(result): result for result in baseline_results['results']}
+    regressions = []
+
+    for result in suite_results['results']:
+        key = getResultKey(result)
+        if key not in baseline:
+            continue
+        baseline_result = baseline[key]
+        if 'error' in result and 'error' not in baseline_result: # The stage used to work
+            regressions.append({'key': key, 'metric': 'error', 'baseline': None, 'value': result['error'], 'ratio': np.inf})
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in baseline_result:
+                continue
+            if metric == 'wall_time' and baseline_result[metric] < MIN_COMPARED_TIME:
+                continue
+            ratio = result[metric] / max(baseline_result[metric], np.finfo(float).tiny)
+            if ratio > 1 + tolerance:
+                regressions.append({'key': key, 'metric': metric, 'baseline': baseline_result[metric],
+                                    'value': result[metric], 'ratio': ratio})
+
+    return regressions
+
+
+
+def printRegressions(regressions):
+    """Print the regressions found by compareSuiteResults as a table"""
+
+    if not regressions:
+        print('No regressions against the baseline')
+    for regression in regressions:
+        stage, num_samples, num_taps = regression['key']
+        print('REGRESSION {:<26} samples {:>10} taps {:>5} {:<10} baseline {} now {} ({:.2f}x)'.format(
+            stage, str(num_samples), str(num_taps), regression['metric'], regression['baseline'], regression['value'],
+            regression['ratio']))
+
+
+
+# Run benchmarks if called
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every stage of the ECG notch filter pipeline')
+    parser.add_argument('-o', '--output', default='Group_18_Benchmarks.json', help='The JSON file to save the results to')
+    parser.add_argument('-b', '--baseline', default=None, help='A saved JSON results file to check for regressions against')
+    parser.add_argument('-t', '--tolerance', type=float, default=REGRESSION_TOLERANCE, help='The fractional increase reported as a regression')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES, help='The recording lengths to run on')
+    parser.add_argument('--full', action='store_true', help='Run on every recording length, up to 10^8 samples')
+    parser.add_argument('--taps', type=int, nargs='+', default=SUITE_TAPS, help='The FIR tap counts to run on')
+    parser.add_argument('--main-max-samples', type=int, default=MAIN_MAX_SAMPLES, help='The longest recording main() is run on')
+    parser.add_argument('--comparisons', action='store_true', help='Also run the helper, notch filter, multirate, minimum tap and backend comparisons')
+    arguments = parser.parse_args()
+
+    if arguments.comparisons:
+        printHelperResults(benchmarkHelpers())
+        printNotchResults(benchmarkNotchFilters(createSyntheticECG(NOTCH_NUM_SAMPLES), SUITE_CUTOFF),
+                          'synthetic ECG with fixed interference')
+        printNotchResults(benchmarkNotchFilters(createSyntheticECG(NOTCH_NUM_SAMPLES, drift=NOTCH_DRIFT), SUITE_CUTOFF),
+                          'synthetic ECG with interference drifting {} Hz/s'.format(NOTCH_DRIFT))
+        printNotchResults(benchmarkNotchFilters(importData(RECORDING_FILENAME), SUITE_CUTOFF),
+                          'the bundled recording ' + os.path.basename(RECORDING_FILENAME))
+        printMultirateResults(benchmarkMultirate(createSyntheticECG(NOTCH_NUM_SAMPLES), SUITE_CUTOFF))
+        printFFTCostResults(benchmarkFFTCostFactor())
+        printMinimumTapResults(benchmarkMinimumTaps(createSyntheticECG(NOTCH_NUM_SAMPLES), SUITE_CUTOFF))
+        if NUMBA_AVAILABLE:
+            printBackendResults(checkBackendParity(), benchmarkBackends())
+
+    suite_results = runSuite(FULL_SUITE_SIZES if arguments.full else arguments.sizes, arguments.taps, arguments.main_max_samples)
+    saveSuiteResults(suite_results, arguments.output)
+
+    if arguments.baseline is not None: # Fail the run if anything has regressed, so nightly jobs catch it
+        regressions = compareSuiteResults(suite_results, loadSuiteResults(arguments.baseline), arguments.tolerance)
+        printRegressions(regressions)
+        sys.exit(1 if regressions else 0)
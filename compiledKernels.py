@@ -0,0 +1,197 @@
+"""
+    compiledKernels.py
+    Contains the optional compiled (Numba) kernels for ENEL420-20S2 Assignment 1, and the
+    backend selector that chooses between them and the NumPy/SciPy functions. Each kernel
+    does the per-sample work of a filter or statistic in one compiled pass, without the
+    temporary arrays the NumPy path creates. Without Numba the NumPy backend is used.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import numpy as np
+try:
+    from numba import njit
+except ImportError: # Numba is optional, the NumPy backend is used without it
+    njit = None
+
+
+# Global variables
+BACKENDS = ['numpy', 'numba'] # The backends which can be selected
+NUMBA_AVAILABLE = njit is not None # Whether the compiled kernels can be used
+
+backend = 'numba' if NUMBA_AVAILABLE else 'numpy' # The backend currently selected
+
+
+
+#
+# Backend functions
+#
+def setBackend(name):
+    """Select the backend ('numpy' or 'numba') used by the filters and statistics that have a compiled kernel"""
+
+    global backend
+
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend ' + str(name))
+    if name == 'numba' and not NUMBA_AVAILABLE:
+        raise ImportError('The numba backend needs Numba to be installed')
+    backend = name
+
+
+
+def getBackend():
+    """Return the name of the backend currently selected"""
+
+    return backend
+
+
+
+def useCompiledKernels():
+    """Return whether the compiled kernels should be used"""
+
+    return backend == 'numba'
+
+
+
+def compileKernel(function):
+    """Compile a kernel with Numba if it is installed, caching the machine code between runs. Without Numba the
+    kernel is left as a plain Python function, which is never called by the NumPy backend"""
+
+    if not NUMBA_AVAILABLE:
+        return function
+
+    return njit(cache=True, nogil=True)(function)
+
+
+
+#
+# Statistics kernels
+#
+@compileKernel
+def blockStatsKernel(data):
+    """Return the count, and the mean and sum of squared deviations of each row of 2-D data, summing the samples
+    and then their squared deviations from the mean, without creating a deviation array"""
+
+    num_rows, num_samples = data.shape
+    mean = np.zeros(num_rows)
+    m2 = np.zeros(num_rows)
+
+    for row in range(num_rows): # Iterate through each signal
+        total = 0.0
+        for index in range(num_samples):
+            total += data[row, index]
+        row_mean = total / num_samples
+        squared_total = 0.0
+        for index in range(num_samples):
+            deviation = data[row, index] - row_mean
+            squared_total += deviation * deviation
+        mean[row] = row_mean
+        m2[row] = squared_total
+
+    return num_samples, mean, m2
+
+
+
+#
+# Filter kernels
+#
+@compileKernel
+def sosStatsKernel(sos, block, state, stage_stats):
+    """Pass a block through a cascade of second order sections (transposed direct form II), updating the section
+    states, and add the input and each section's output to the running statistics in stage_stats (stages x count,
+    mean and sum of squared deviations). The filtered samples are never stored, so no arrays are created"""
+
+    num_sections = sos.shape[0]
+
+    for index in range(block.shape[0]): # Iterate through each sample
+        sample = block[index]
+        for stage in range(num_sections + 1): # Iterate through the input, then each section's output
+            if stage > 0: # Pass the sample through the section
+                section = stage - 1
+                filtered = sos[section, 0] * sample + state[section, 0]
+                state[section, 0] = sos[section, 1] * sample - sos[section, 4] * filtered + state[section, 1]
+                state[section, 1] = sos[section, 2] * sample - sos[section, 5] * filtered
+                sample = filtered
+            count = stage_stats[stage, 0] + 1 # Add the stage's sample to its running statistics
+            delta = sample - stage_stats[stage, 1]
+            stage_stats[stage, 0] = count
+            stage_stats[stage, 1] += delta / count
+            stage_stats[stage, 2] += delta * (sample - stage_stats[stage, 1])
+
+
+
+@compileKernel
+def sosFrameKernel(sos, frame, state, output):
+    """Pass a frame through a cascade of second order sections (transposed direct form II), writing into output and
+    updating the section states"""
+
+    for index in range(frame.shape[0]): # Iterate through each sample
+        sample = frame[index]
+        for section in range(sos.shape[0]): # The output of each section is the input of the next
+            filtered = sos[section, 0] * sample + state[section, 0]
+            state[section, 0] = sos[section, 1] * sample - sos[section, 4] * filtered + state[section, 1]
+            state[section, 1] = sos[section, 2] * sample - sos[section, 5] * filtered
+            sample = filtered
+        output[index] = sample
+
+
+
+@compileKernel
+def symmetricFIRKernel(filter_array, padded, symmetry, output):
+    """Pass each row of 2-D padded data through a symmetric (symmetry 1) or antisymmetric (symmetry -1) FIR filter,
+    writing into output. Each pair of mirrored taps shares one multiply, so half the multiplies of direct form are
+    needed. Output sample i uses padded samples i to i + len(filter_array) - 1"""
+
+    num_taps = filter_array.shape[0]
+    num_pairs = num_taps // 2
+
+    for row in range(output.shape[0]): # Iterate through each record or lead
+        for index in range(output.shape[1]): # Iterate through each output sample
+            total = filter_array[num_pairs] * padded[row, index + num_pairs] if num_taps % 2 else 0.0 # The unpaired centre tap
+            for tap in range(num_pairs): # Fold the mirrored samples before multiplying
+                total += filter_array[tap] * (padded[row, index + num_taps - 1 - tap] + symmetry * padded[row, index + tap])
+            output[row, index] = total
+
+
+
+@compileKernel
+def adaptiveNotchKernel(data, omega, omega_min, omega_max, phase, weights, step_size, frequency_step_size, output):
+    """Pass channels x samples data through one adaptive notch, writing into output and updating the frequency,
+    phase and weights (2 x channels) of each channel. The same algorithm as filterAdaptiveNotchStage"""
+
+    tiny = np.finfo(np.float64).tiny
+    two_pi = 2 * np.pi
+
+    for channel in range(data.shape[0]): # Iterate through each channel
+        channel_omega = omega[channel]
+        channel_phase = phase[channel]
+        cos_weight = weights[0, channel]
+        sin_weight = weights[1, channel]
+        for index in range(data.shape[1]): # Iterate through each sample
+            cos_reference = np.cos(channel_phase)
+            sin_reference = np.sin(channel_phase)
+
+            # Subtract the estimated interference, and move the weights towards it (LMS)
+            error = data[channel, index] - (cos_weight * cos_reference + sin_weight * sin_reference)
+            cos_update = step_size * error * cos_reference
+            sin_update = step_size * error * sin_reference
+
+            # Steer the frequency against the rotation of the weights
+            weight_power = max(cos_weight * cos_weight + sin_weight * sin_weight, tiny)
+            rotation = (cos_weight * sin_update - sin_weight * cos_update) / weight_power
+            channel_omega = min(max(channel_omega - frequency_step_size * rotation, omega_min[channel]), omega_max[channel])
+
+            cos_weight += cos_update
+            sin_weight += sin_update
+            channel_phase = (channel_phase + channel_omega) % two_pi
+            output[channel, index] = error
+
+        # Keep the state for the next block
+        omega[channel] = channel_omega
+        phase[channel] = channel_phase
+        weights[0, channel] = cos_weight
+        weights[1, channel] = sin_weight
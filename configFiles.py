@@ -9,28 +9,178 @@
 """
 import os
 import shutil
+import numpy as np
+from instrumentation import instrumentStage
+
+
+# Global variables
+READ_CHUNK_SIZE = 1 << 20 # The number of characters read from a text file at a time when importing in blocks
+BINARY_MAGIC = b'ECGB' # The first bytes of every binary ECG file
+BINARY_VERSION = 1 # The version of the binary ECG file layout
+BINARY_DTYPES = ['<f4', '<i2'] # The sample formats a binary ECG file can store
+BINARY_HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('dtype', 'S4'), ('num_channels', '<u4'),
+                          ('sample_rate', '<f8'), ('scale', '<f8')]) # The 32 byte header at the start of a binary ECG file
 
 #
 # File functions
 #
 
+@instrumentStage()
 def importData(filename):
-    """Import data from a text file"""
+    """Import data from a text file, or from a binary file created by convertTextToBinary"""
 
-    # Extract data from file
-    data_file = open(filename, 'r') # Create the file object where data is stored
-    data_string = data_file.read() # Read the data from the file object
-    data_list = data_string.split() # Create a list of each sample from the singular data string
+    # Binary files are memory mapped rather than parsed
+    if isBinaryData(filename):
+        data, sample_rate, scale = importBinaryData(filename)
+        return data * scale if scale != 1.0 else data # Integer samples are converted back to their original units in memory
 
-    # Convert data from strings to floats
-    data = [] # Create array for results to be stored in
-    for data_string in data_list:
-        sample = float(data_string)
-        data.append(sample)
+    # Extract data from file
+    data = np.fromfile(filename, sep=' ') # Parse every whitespace separated sample into a float array in one pass
 
     return data
 
 
+
+def importDataBlocks(filename, block_size):
+    """Import data from a text or binary file as a generator of numpy arrays of block_size samples (the last block
+    may be shorter). Only one block of samples is held in memory at a time, however long the recording is"""
+
+    # Binary files are memory mapped, so blocks are read straight from the mapping, and scaled one at a time
+    if isBinaryData(filename):
+        data, sample_rate, scale = importBinaryData(filename)
+        for start in range(0, data.shape[-1], block_size):
+            block = np.asarray(data[..., start:start + block_size])
+            yield block * scale if scale != 1.0 else block # Convert integer samples back to their original units
+        return
+
+    pending = np.empty(0) # Samples parsed but not yet yielded
+    partial_token = '' # A sample split across the boundary between two reads
+
+    with open(filename, 'r') as data_file:
+        while True:
+            text = data_file.read(READ_CHUNK_SIZE) # Read the next chunk of characters
+            if not text: # End of file reached
+                break
+
+            # Hold back the final sample if it may continue in the next chunk
+            text = partial_token + text # Join any sample cut off by the previous read
+            split_index = max(text.rfind(' '), text.rfind('\t'), text.rfind('\n'), text.rfind('\r')) + 1
+            partial_token = text[split_index:]
+
+            pending = np.concatenate((pending, np.fromstring(text[:split_index], sep=' '))) # Parse and queue the complete samples
+            while len(pending) >= block_size: # Yield every complete block available
+                yield pending[:block_size]
+                pending = pending[block_size:]
+
+    if partial_token: # The file did not end in whitespace
+        pending = np.concatenate((pending, [float(partial_token)]))
+    if len(pending) > 0: # Yield the final, shorter block
+        yield pending
+
+
+
+#
+# Binary file functions
+#
+def isBinaryData(filename):
+    """Check whether a file is a binary ECG file, by comparing its first bytes to the binary header marker"""
+
+    with open(filename, 'rb') as data_file:
+        return data_file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+
+def readBinaryHeader(filename):
+    """Read and return the header of a binary ECG file as a dictionary"""
+
+    header = np.fromfile(filename, dtype=BINARY_HEADER, count=1)[0] # Read the fixed size header
+
+    # Check the file is a binary ECG file that can be read
+    if header['magic'] != BINARY_MAGIC:
+        raise ValueError(filename + ' is not a binary ECG file')
+    if header['version'] != BINARY_VERSION:
+        raise ValueError(filename + ' has unsupported binary ECG version {}'.format(header['version']))
+
+    return {'dtype': header['dtype'].decode(), 'num_channels': int(header['num_channels']),
+            'sample_rate': float(header['sample_rate']), 'scale': float(header['scale'])}
+
+
+
+def importBinaryData(filename):
+    """Memory map a binary ECG file and return the samples, sample rate and scale. Samples are read from disk only
+    when used, so large recordings open almost instantly. Multiple channel files are returned as channels x samples.
+    int16 samples are returned as stored, and must be multiplied by the scale (1.0 for float files) to convert them
+    back to their original units, so they can be scaled a block at a time"""
+
+    header = readBinaryHeader(filename)
+    num_channels = header['num_channels']
+
+    # Map the samples after the header, which are stored one sample of every channel at a time
+    data = np.memmap(filename, dtype=header['dtype'], mode='r', offset=BINARY_HEADER.itemsize)
+    data = data.reshape(-1, num_channels).T # View the samples as channels x samples, without copying
+    if num_channels == 1: # Single channel recordings are returned as a 1-D array, like importData
+        data = data[0]
+
+    return data, header['sample_rate'], header['scale']
+
+
+
+def saveBinaryData(filename, data, sample_rate, dtype='<f4', scale=1.0):
+    """Save samples (1-D, or channels x samples) to a binary ECG file. int16 samples are stored divided by scale"""
+
+    data = np.atleast_2d(data) # Treat a single channel as one row
+    outputfile = open(filename, 'wb')
+    writeBinaryHeader(outputfile, dtype, len(data), sample_rate, scale)
+    writeBinarySamples(outputfile, data.T, dtype, scale) # Store one sample of every channel at a time
+    outputfile.close()
+
+
+
+def writeBinaryHeader(outputfile, dtype, num_channels, sample_rate, scale):
+    """Write the header of a binary ECG file to an open file"""
+
+    if dtype not in BINARY_DTYPES:
+        raise ValueError('Unsupported binary ECG sample format ' + dtype)
+
+    header = np.array([(BINARY_MAGIC, BINARY_VERSION, dtype.encode(), num_channels, sample_rate, scale)], dtype=BINARY_HEADER)
+    header.tofile(outputfile)
+
+
+
+def writeBinarySamples(outputfile, samples, dtype, scale):
+    """Write samples (samples x channels) to an open binary ECG file in the given format"""
+
+    if np.dtype(dtype).kind == 'i': # Integer formats are rounded to the nearest step of scale
+        limits = np.iinfo(dtype)
+        samples = np.clip(np.rint(np.asarray(samples) / scale), limits.min, limits.max)
+    np.asarray(samples).astype(dtype).tofile(outputfile)
+
+
+
+def convertTextToBinary(text_filename, binary_filename, sample_rate, dtype='<f4', num_channels=1, block_size=1 << 20):
+    """Convert a whitespace separated text recording to a binary ECG file, one block at a time so the text file never
+    needs to fit in memory. Multiple channel text files are expected to hold one sample of every channel per row"""
+
+    block_size -= block_size % num_channels # Keep every block a whole number of rows
+
+    # Find the scale needed to fit the largest sample into an integer format
+    scale = 1.0
+    if np.dtype(dtype).kind == 'i':
+        peak = max(np.max(np.abs(block)) for block in importDataBlocks(text_filename, block_size))
+        scale = peak / np.iinfo(dtype).max if peak > 0 else 1.0
+
+    # Write the header and then each block of samples
+    outputfile = open(binary_filename, 'wb')
+    writeBinaryHeader(outputfile, dtype, num_channels, sample_rate, scale)
+    for block in importDataBlocks(text_filename, block_size):
+        writeBinarySamples(outputfile, block, dtype, scale)
+    outputfile.close()
+
+
+
+#
+# Output functions
+#
 def createClean(filename, directory=False):
     """Create a file/folder at the target location and returns the path to this if it is a folder or a the file ready
     for reading and writing if it is a file.
@@ -51,7 +201,3 @@ def createClean(filename, directory=False):
         output = open(filename, "w+") # Create an open the file for reading and writing
 
     return output
-
-
-
-
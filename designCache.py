@@ -0,0 +1,306 @@
+"""
+    designCache.py
+    Contains the filter design cache for ENEL420-20S2 Assignment 1. Designs are keyed on
+    their design parameters and kept in an in-process LRU, and optionally saved to disk,
+    so repeated runs and batch workers reuse designs instead of recomputing them. Keys
+    include a hash of the designers' source, so a changed designer never serves old designs.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from collections import OrderedDict
+import hashlib
+import os
+import time
+import warnings
+import numpy as np
+from FIR import *
+from multirate import scaleTapCount
+from instrumentation import instrumentStage
+
+
+# Global variables
+CACHE_SIZE = 32 # The number of designs kept in memory
+DESIGN_METHODS = {'window': createWindowFilters,
+                  'optimal': createOptimalFilters,
+                  'freq_sampling': createFreqSamplingFilters} # The designer for each method
+WINDOWED_METHODS = ['window', 'freq_sampling'] # The methods which take a window
+DEFAULT_WINDOW = ('kaiser', 2.5) # The window used when none is specified
+SEARCH_ATTENUATION = 40 # The stop band attenuation (dB) at the notches searched designs must meet
+SEARCH_RIPPLE = 1 # The pass band ripple (dB) searched designs must meet
+SEARCH_MIN_TAPS = 11 # The fewest taps searched
+SEARCH_MAX_TAPS = 4095 # The most taps searched
+SEARCH_GROWTH = 1.25 # The factor the tap count is grown by until a design meets the specification
+SEARCH_TIME_BUDGET = 10 # The time (s) after which a search stops narrowing and keeps its best design so far
+REFERENCE_TAPS = 399 # The fixed tap count the saving of a searched design is reported against
+SCALED_TAP_ATTEMPTS = 8 # The most tap counts tried from the scaled count up, before a decimated design falls back to the full count
+DESIGNER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FIR.py') # The module holding the designers
+
+design_cache = OrderedDict() # Designs in least to most recently used order
+cache_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0} # Counts of how each design request was served
+disk_cache_location = None # The folder designs are saved to, or None to only cache in memory
+search_reports = {} # The report of each minimum tap search, keyed on its specification
+scaled_reports = {} # The report of each scaled tap count design, keyed on its specification
+design_version = None # The hash of the designers' source, once found
+
+
+
+#
+# Cache configuration functions
+#
+def setDiskCache(location):
+    """Save designs to, and load them from, the given folder. None turns the disk cache off"""
+
+    global disk_cache_location
+
+    if location is not None and not os.path.isdir(location):
+        os.makedirs(location) # Create the cache folder the first time it is used
+    disk_cache_location = location
+
+
+
+def getCacheStats():
+    """Return a copy of the cache hit and miss counters, and the number of designs held in memory"""
+
+    stats = dict(cache_stats)
+    stats['size'] = len(design_cache)
+
+    return stats
+
+
+
+def clearCache():
+    """Remove every design from the in-process cache and reset the counters. The disk cache is left in place"""
+
+    design_cache.clear()
+    for counter in cache_stats:
+        cache_stats[counter] = 0
+
+
+
+#
+# Design functions
+#
+def getDesignVersion():
+    """Return a hash of the source of the FIR designers, found once per process, so designs saved to disk by a
+    different version of the designers are not reused"""
+
+    global design_version
+
+    if design_version is None:
+        with open(DESIGNER_SOURCE, 'rb') as inputfile:
+            design_version = hashlib.sha1(inputfile.read()).hexdigest()
+
+    return design_version
+
+
+
+def createDesignKey(method, notches, sample_rate, notch_width, num_taps, window=None):
+    """Create and return the cache key for a design. Numbers are stored as floats so that, for example, a sample
+    rate of 1024 and 1024.0 share a design. The version of the designers is the last item of the key"""
+
+    if method not in DESIGN_METHODS:
+        raise ValueError('Unknown filter design method ' + str(method))
+    if method in WINDOWED_METHODS and window is None:
+        window = DEFAULT_WINDOW
+    if method not in WINDOWED_METHODS: # The window has no effect, so should not split the cache
+        window = None
+
+    return (method, tuple(float(notch) for notch in notches), float(sample_rate), float(notch_width), int(num_taps),
+            window if isinstance(window, (str, type(None))) else tuple(window), getDesignVersion())
+
+
+
+def getDiskCacheFilename(key):
+    """Return the disk cache file a design key is saved to"""
+
+    key_hash = hashlib.sha1(repr(key).encode()).hexdigest() # A stable name for the key
+
+    return os.path.join(disk_cache_location, key[0] + '_' + key_hash + '.npz')
+
+
+
+def saveDiskCache(key, filters):
+    """Save a design, or the ValueError of a failed design, to the disk cache. The file is written under a temporary
+    name and then renamed, so workers sharing the cache never read a partly written design"""
+
+    filename = getDiskCacheFilename(key)
+    temp_filename = filename + '.' + str(os.getpid()) + '.tmp' # Unique to this process
+
+    with open(temp_filename, 'wb') as outputfile:
+        if isinstance(filters, ValueError): # Save the reason, so the design is not attempted again
+            np.savez(outputfile, error=np.array(str(filters)))
+        else:
+            np.savez(outputfile, filter_1=filters[0], filter_2=filters[1], filter_overall=filters[2])
+    os.replace(temp_filename, filename)
+
+
+
+@instrumentStage()
+def createCachedFilters(method, notches, sample_rate, notch_width, num_taps, window=None):
+    """Return the (filter_1, filter_2, filter_overall) design for the parameters, from the in-process cache, the disk
+    cache, or by designing it. The returned arrays are shared between callers and so are read only. Designs which
+    fail with a ValueError are cached too, and raise the same ValueError whenever requested again"""
+
+    key = createDesignKey(method, notches, sample_rate, notch_width, num_taps, window)
+
+    # Serve the design from memory
+    if key in design_cache:
+        cache_stats['hits'] += 1
+        design_cache.move_to_end(key) # Mark the design as most recently used
+        filters = design_cache[key]
+        if isinstance(filters, ValueError): # Failed before
+            raise ValueError(str(filters))
+        return filters
+
+    # Serve the design from disk, or design it
+    filters = None
+    if disk_cache_location is not None:
+        filename = getDiskCacheFilename(key)
+        if os.path.exists(filename):
+            with np.load(filename) as saved:
+                if 'error' in saved.files:
+                    filters = ValueError(str(saved['error']))
+                else:
+                    filters = (saved['filter_1'], saved['filter_2'], saved['filter_overall'])
+            cache_stats['disk_hits'] += 1
+
+    if filters is None:
+        cache_stats['misses'] += 1
+        designer = DESIGN_METHODS[method]
+        try:
+            if method in WINDOWED_METHODS:
+                filters = designer(notches, sample_rate, notch_width, num_taps, window=key[5])
+            else:
+                filters = designer(notches, sample_rate, notch_width, num_taps)
+        except ValueError as error: # No usable design with these parameters
+            filters = error
+        if disk_cache_location is not None:
+            saveDiskCache(key, filters)
+
+    # Store the design in memory, removing the least recently used design if the cache is full
+    if not isinstance(filters, ValueError):
+        for filter_array in filters:
+            filter_array.setflags(write=False) # Stop one caller changing another caller's filter
+    design_cache[key] = filters
+    if len(design_cache) > CACHE_SIZE:
+        design_cache.popitem(last=False)
+    if isinstance(filters, ValueError):
+        raise ValueError(str(filters))
+
+    return filters
+
+
+
+#
+# Minimum tap design functions
+#
+@instrumentStage()
+def createMinimumTapFilters(method, notches, sample_rate, notch_width, attenuation=SEARCH_ATTENUATION, ripple=SEARCH_RIPPLE,
+                            max_taps=SEARCH_MAX_TAPS, time_budget=SEARCH_TIME_BUDGET, reference_taps=REFERENCE_TAPS):
+    """Search for and return the (filter_1, filter_2, filter_overall) design with the fewest taps that meets the stop
+    band attenuation and pass band ripple (dB), and a report of the search. The Kaiser estimate is grown until it
+    meets the specification, then bisected down towards the largest count found not to. Response is not strictly
+    monotonic in the tap count, so the result is the smallest found rather than a guaranteed minimum. The search
+    stops narrowing once time_budget (s) is spent. Windowed methods use the Kaiser window beta of the estimate"""
+
+    key = createDesignKey(method, notches, sample_rate, notch_width, 1) + (float(attenuation), float(ripple), int(max_taps))
+    if key in search_reports: # Searched before, so only the design itself is needed
+        report = search_reports[key]
+        return createCachedFilters(method, notches, sample_rate, notch_width, report['num_taps'], report['window']), report
+
+    start_time = time.perf_counter()
+    estimate, beta = estimateNotchTaps(sample_rate, notch_width, attenuation, ripple)
+    window = ('kaiser', beta) if method in WINDOWED_METHODS else None
+    designs = {} # Each tap count tried, and its design if it met the specification
+
+    def tryTaps(num_taps):
+        designer = DESIGN_METHODS[method]
+        try:
+            filters = designer(notches, sample_rate, notch_width, num_taps, window=window) if window else designer(notches, sample_rate, notch_width, num_taps)
+        except ValueError: # No usable design with this many taps
+            filters = None
+        if filters is not None and not meetsNotchSpec(filters, notches, sample_rate, notch_width, attenuation, ripple):
+            filters = None
+        designs[num_taps] = filters
+        return filters is not None
+
+    # Grow the estimate until a design meets the specification
+    low_taps = SEARCH_MIN_TAPS - 2 # The largest count known not to meet it
+    high_taps = min(max(estimate, SEARCH_MIN_TAPS), max_taps)
+    while not tryTaps(high_taps):
+        if high_taps >= max_taps:
+            raise ValueError('No {} design with up to {} taps meets {} dB attenuation and {} dB ripple'.format(
+                method, max_taps, attenuation, ripple))
+        low_taps, high_taps = high_taps, min(int(SEARCH_GROWTH * high_taps) | 1, max_taps)
+
+    # Bisect the odd counts between the largest failing and the smallest passing count
+    while high_taps - low_taps > 2 and time.perf_counter() - start_time < time_budget:
+        middle_taps = (low_taps + high_taps) // 2
+        middle_taps += 1 - middle_taps % 2 # Keep the count odd
+        if tryTaps(middle_taps):
+            high_taps = middle_taps
+        else:
+            low_taps = middle_taps
+
+    report = {'method': method, 'num_taps': high_taps, 'window': window, 'estimate': estimate, 'designs_tried': len(designs),
+              'design_time': time.perf_counter() - start_time, 'budget_exhausted': high_taps - low_taps > 2,
+              'multiply_adds_saved_per_sample': 3 * (reference_taps - high_taps)} # Direct form, over all three filters
+    report['attenuation'], report['ripple'] = measureNotchResponse(designs[high_taps][2], notches, sample_rate, notch_width)
+    search_reports[key] = report
+
+    return createCachedFilters(method, notches, sample_rate, notch_width, high_taps, window), report
+
+
+
+def getSearchReports():
+    """Return a list of the report of every minimum tap search made"""
+
+    return list(search_reports.values())
+
+
+
+#
+# Scaled tap design functions
+#
+@instrumentStage()
+def createScaledTapFilters(method, notches, sample_rate, notch_width, full_taps, decimation_factor, max_attempts=SCALED_TAP_ATTEMPTS):
+    """Return the (filter_1, filter_2, filter_overall) design for data decimated by decimation_factor, and a report.
+    The tap count is scaled down to give the same transition width at the reduced sample_rate (Hz), and stepped up
+    by two for up to max_attempts counts, as some counts have no usable design. Failed counts are cached, so they are
+    not designed again. If none is usable, the full_taps count is used and a warning is given, which the report
+    records as a fallback"""
+
+    key = createDesignKey(method, notches, sample_rate, notch_width, full_taps) + (int(decimation_factor), int(max_attempts))
+    scaled_taps = scaleTapCount(full_taps, decimation_factor)
+    report = {'method': method, 'scaled_taps': scaled_taps, 'num_taps': full_taps, 'designs_tried': 0, 'fallback': True}
+
+    for num_taps in range(scaled_taps, full_taps, 2)[:max_attempts]: # Iterate through each odd count from the scaled count up
+        report['designs_tried'] += 1
+        try:
+            filters = createCachedFilters(method, notches, sample_rate, notch_width, num_taps)
+        except ValueError: # No usable design with this many taps
+            continue
+        report.update(num_taps=num_taps, fallback=False)
+        scaled_reports[key] = report
+        return filters, report
+
+    if scaled_taps < full_taps:
+        warnings.warn('No usable {} design with {} to {} taps at {:g} Hz, using {} taps'.format(
+            method, scaled_taps, scaled_taps + 2 * (report['designs_tried'] - 1), sample_rate, full_taps))
+    else: # Nothing to scale down to
+        report['fallback'] = False
+    scaled_reports[key] = report
+
+    return createCachedFilters(method, notches, sample_rate, notch_width, full_taps), report
+
+
+
+def getScaledTapReports():
+    """Return a list of the report of every scaled tap count design made"""
+
+    return list(scaled_reports.values())
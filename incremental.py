@@ -0,0 +1,218 @@
+"""
+    incremental.py
+    Contains the incremental reprocessing functions for ENEL420-20S2 Assignment 1.
+    Each output is keyed on the content hash of the input recording and the parameters that
+    produce it, and saved under that key, so a re-run only recomputes the outputs whose
+    recording or parameters changed. Keys chain, as each step's key includes the keys of the
+    steps it depends on, so a key can be found without computing anything before it. Every
+    key also includes a hash of the code of the functions that produce the output (and the
+    functions and values they use, in turn), so a change to that code never reuses outputs
+    saved by the previous version, while changes to code the output never reaches, such as
+    the configuration in main.py, leave the key unchanged.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import hashlib
+import os
+import pickle
+import types
+
+
+# Global variables
+HASH_BLOCK_SIZE = 1 << 20 # The number of bytes of a file hashed at a time
+SOURCE_LOCATION = os.path.dirname(os.path.abspath(__file__)) # The folder holding the program's modules
+CONSTANT_TYPES = (bool, int, float, complex, str, bytes, type(None)) # Global values whose contents are keyed
+
+code_hashes = {} # The hash of each code object, once found
+
+
+
+#
+# Key functions
+#
+def hashFile(filename):
+    """Return the SHA-256 hash of a file's contents, reading one block at a time so the file never needs to fit in
+    memory"""
+
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as inputfile:
+        for block in iter(lambda: inputfile.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+
+def isProgramFile(filename):
+    """Return whether a file is one of the program's modules, rather than part of Python or a library"""
+
+    return os.path.dirname(os.path.abspath(filename)) == SOURCE_LOCATION
+
+
+
+def describeCode(code):
+    """Return a description of a code object: its bytecode, the names it uses and its constants, including the code
+    of any function defined in it. Unlike the source, this is exact for a lambda sharing its lines with others, and
+    is unchanged by comments and by code moving within its file"""
+
+    constants = []
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            constants.append(describeCode(constant))
+        elif isinstance(constant, frozenset): # Sorted, as the order of a set of strings changes between runs
+            constants.append(sorted(repr(item) for item in constant))
+        else:
+            constants.append(repr(constant))
+
+    return [code.co_code, code.co_names, code.co_varnames, constants]
+
+
+
+def getCodeHash(code):
+    """Return the hash of a code object's description, found once per process"""
+
+    if code not in code_hashes:
+        code_hashes[code] = hashlib.sha256(repr(describeCode(code)).encode()).hexdigest()
+
+    return code_hashes[code]
+
+
+
+def collectCode(value, found):
+    """Add the code hash of every function of the program reached from a value to found, following the functions
+    and global values each function uses, its default arguments and the variables it closes over (which include the
+    function a decorator wraps). Containers are searched for functions. Global constants of the program are added by
+    value, and a module used as a whole is added by the hash of its file"""
+
+    value = getattr(value, 'py_func', value) # The Python function of a compiled kernel
+    if isinstance(value, dict):
+        for item in value.values():
+            collectCode(item, found)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            collectCode(item, found)
+    elif isinstance(value, types.ModuleType):
+        filename = getattr(value, '__file__', None)
+        if filename and isProgramFile(filename) and value.__name__ not in found:
+            found[value.__name__] = hashFile(filename)
+    elif isinstance(value, types.FunctionType) and isProgramFile(value.__code__.co_filename):
+        name = value.__module__ + '.' + value.__qualname__ + ':' + getCodeHash(value.__code__) # Lambdas share a name
+        if name in found:
+            return
+        found[name] = True
+
+        # Follow every global name used by the function and the functions defined in it
+        codes = [value.__code__]
+        for code in codes:
+            codes += [constant for constant in code.co_consts if isinstance(constant, types.CodeType)]
+            for global_name in code.co_names:
+                if global_name not in value.__globals__:
+                    continue # An attribute name, or a builtin
+                global_value = value.__globals__[global_name]
+                if isinstance(global_value, CONSTANT_TYPES):
+                    found[value.__module__ + '.' + global_name] = repr(global_value)
+                else:
+                    collectCode(global_value, found)
+        collectCode(value.__defaults__ or (), found)
+        collectCode([cell.cell_contents for cell in value.__closure__ or () if cell.cell_contents is not None], found)
+
+
+
+def getCodeVersion(value):
+    """Return a hash of the program's code reached from a value (a function, or a container holding
+    functions, such as a step's inputs), and the global values it uses. Code the value never reaches does not change
+    the hash, so editing the configuration in main.py, or an unrelated function, does not invalidate an output"""
+
+    found = {}
+    collectCode(value, found)
+
+    return hashlib.sha256(repr(sorted(found.items())).encode()).hexdigest()
+
+
+
+def describeValue(value):
+    """Return a description of a value which is the same in every run: dictionaries are sorted, so the order
+    parameters were given in does not change the key, and functions are described by their module and name rather
+    than their address"""
+
+    if isinstance(value, dict):
+        return sorted((name, describeValue(item)) for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [describeValue(item) for item in value]
+    if callable(value):
+        return getattr(value, '__module__', '') + '.' + getattr(value, '__qualname__', repr(value))
+
+    return value
+
+
+
+def createKey(code, *parts):
+    """Create and return the key of an output from the code that produces it (a function, or a container of the
+    functions, see getCodeVersion) and the parts it is produced from (names, parameters and the keys of other
+    outputs)"""
+
+    return hashlib.sha256(repr([getCodeVersion(code)] + describeValue(list(parts))).encode()).hexdigest()
+
+
+
+def getFileFingerprints(filenames):
+    """Return a dictionary of the size and modification time of each file, which change if the file is rewritten"""
+
+    fingerprints = {}
+    for filename in filenames:
+        file_stats = os.stat(filename)
+        fingerprints[filename] = [file_stats.st_size, file_stats.st_mtime_ns]
+
+    return fingerprints
+
+
+
+def filesUnchanged(fingerprints):
+    """Return whether every file still exists with the fingerprint it had when it was written"""
+
+    try:
+        return getFileFingerprints(fingerprints) == fingerprints
+    except OSError: # A file has been removed
+        return False
+
+
+
+#
+# Storage functions
+#
+def getOutputFilename(location, key):
+    """Return the file an output with the key is saved to"""
+
+    return os.path.join(location, key + '.pkl')
+
+
+
+def loadOutput(location, key):
+    """Return (True, output) if an output with the key has been saved to the folder, or (False, None) if not"""
+
+    filename = getOutputFilename(location, key)
+    if not os.path.exists(filename):
+        return False, None
+
+    with open(filename, 'rb') as inputfile:
+        return True, pickle.load(inputfile)
+
+
+
+def saveOutput(location, key, output):
+    """Save an output under its key. The file is written under a temporary name and then renamed, so processes
+    sharing the folder never read a partly written output"""
+
+    if not os.path.isdir(location):
+        os.makedirs(location, exist_ok=True) # Create the folder the first time it is used
+    filename = getOutputFilename(location, key)
+    temp_filename = filename + '.' + str(os.getpid()) + '.tmp' # Unique to this process
+
+    with open(temp_filename, 'wb') as outputfile:
+        pickle.dump(output, outputfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_filename, filename)
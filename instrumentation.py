@@ -0,0 +1,175 @@
+"""
+    instrumentation.py
+    Contains the pipeline instrumentation functions for ENEL420-20S2 Assignment 1.
+    Each stage of the pipeline records its wall time, CPU time, peak allocated memory and
+    the number of samples it handled, and passes the record to every registered sink (a
+    log line, a JSON lines file, or any callable). With no sinks registered, as by default,
+    each instrumented function only checks the sink list before running.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+import numpy as np
+
+
+# Global variables
+LOGGER_NAME = 'ecg.instrumentation' # The logger used by log sinks
+
+instrumentation_sinks = [] # The callables each stage record is passed to. Instrumentation is off while empty
+instrumentation_settings = {'trace_memory': False} # Whether peak memory is traced, which slows allocation
+stage_stack = [] # The stages currently running, outermost first
+
+
+
+#
+# Configuration functions
+#
+def enableInstrumentation(sinks, trace_memory=True):
+    """Start passing a record of every instrumented stage to each sink. If trace_memory is True the peak memory of
+    each stage is traced with tracemalloc, which slows allocation, otherwise it is recorded as None"""
+
+    instrumentation_sinks.extend(sinks)
+    instrumentation_settings['trace_memory'] = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+
+def disableInstrumentation():
+    """Remove every sink, turning instrumentation off, and stop tracing memory"""
+
+    instrumentation_sinks.clear()
+    if instrumentation_settings['trace_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    instrumentation_settings['trace_memory'] = False
+
+
+
+def isInstrumented():
+    """Return whether any sink is registered"""
+
+    return bool(instrumentation_sinks)
+
+
+
+#
+# Sink functions
+#
+def createLogSink(level=logging.INFO):
+    """Create and return a sink which writes each record as one line to the instrumentation logger"""
+
+    logger = logging.getLogger(LOGGER_NAME)
+
+    def logSink(record):
+        peak = 'n/a' if record['peak_bytes'] is None else '{:.1f} MB'.format(record['peak_bytes'] / 1e6)
+        logger.log(level, '%s%s: wall %.6f s, cpu %.6f s, peak %s, samples %s', '  ' * record['depth'],
+                   record['stage'], record['wall_time'], record['cpu_time'], peak, record['num_samples'])
+
+    return logSink
+
+
+
+def createJSONSink(filename):
+    """Create and return a sink which appends each record to a JSON lines file. Each record is written with a single
+    append, so several processes can share the file"""
+
+    def jsonSink(record):
+        with open(filename, 'a') as outputfile:
+            outputfile.write(json.dumps(record) + '\n')
+
+    return jsonSink
+
+
+
+def emitRecord(record):
+    """Pass a stage record to every sink"""
+
+    for sink in instrumentation_sinks:
+        sink(record)
+
+
+
+#
+# Measurement functions
+#
+def countSamples(args):
+    """Return the number of samples along the last axis of the longest array argument, or None if there is none.
+    The longest is taken so filter coefficients passed before the data are not counted"""
+
+    lengths = [argument.shape[-1] for argument in args if isinstance(argument, np.ndarray) and argument.ndim > 0]
+
+    return max(lengths) if lengths else None
+
+
+
+@contextmanager
+def measureStage(stage_name, num_samples=None):
+    """Measure the block of code run inside the context as a pipeline stage, and pass its record to every sink. The
+    record dictionary is yielded, so num_samples can be filled in once it is known. Stages may be nested, and the
+    peak memory of a stage includes the peak of the stages inside it"""
+
+    if not instrumentation_sinks: # Instrumentation is off
+        yield {}
+        return
+
+    trace_memory = instrumentation_settings['trace_memory'] and tracemalloc.is_tracing()
+    record = {'stage': stage_name, 'num_samples': num_samples, 'depth': len(stage_stack),
+              'parent': stage_stack[-1]['stage'] if stage_stack else None, 'pid': os.getpid(), 'start': time.time()}
+    if trace_memory: # Keep the peak of the enclosing stage before resetting the peak for this one
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if stage_stack:
+            stage_stack[-1]['peak_traced'] = max(stage_stack[-1]['peak_traced'], peak_bytes)
+        tracemalloc.reset_peak()
+        record['start_traced'] = record['peak_traced'] = current_bytes
+    stage_stack.append(record)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.perf_counter() - start_wall
+        record['cpu_time'] = time.process_time() - start_cpu
+        stage_stack.pop()
+        record['peak_bytes'] = None
+        if trace_memory:
+            record['peak_traced'] = max(record['peak_traced'], tracemalloc.get_traced_memory()[1])
+            record['peak_bytes'] = record['peak_traced'] - record['start_traced'] # Allocated on top of what was already held
+            if stage_stack: # The enclosing stage peaked at least as high
+                stage_stack[-1]['peak_traced'] = max(stage_stack[-1]['peak_traced'], record['peak_traced'])
+            del record['start_traced'], record['peak_traced']
+        emitRecord(record)
+
+
+
+def instrumentStage(stage_name=None):
+    """Decorate a function so each call is measured as a pipeline stage, named after the function unless stage_name
+    is given. The sample count is taken from the array arguments, or else from an array result (for loaders)"""
+
+    def decorate(function):
+        name = stage_name or function.__name__
+
+        @functools.wraps(function)
+        def instrumentedFunction(*args, **kwargs):
+            if not instrumentation_sinks: # Instrumentation is off, so just run the function
+                return function(*args, **kwargs)
+            with measureStage(name, countSamples(args)) as record:
+                result = function(*args, **kwargs)
+                if record['num_samples'] is None:
+                    record['num_samples'] = countSamples([result])
+                return result
+
+        return instrumentedFunction
+
+    return decorate
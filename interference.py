@@ -0,0 +1,121 @@
+"""
+    interference.py
+    Contains the narrowband interference detection functions for ENEL420-20S2 Assignment 1.
+    Interference frequencies are found as peaks standing well above the local spectral
+    baseline, so the notch frequencies no longer need to be found by graphical analysis.
+    A zoom DFT tracker follows the detected frequencies block by block as they drift.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from scipy.signal import find_peaks, get_window, zoom_fft
+from scipy.ndimage import median_filter
+import numpy as np
+from signalPlots import calcFreqSpectrum, calcWelchSpectrum
+from instrumentation import instrumentStage
+
+
+# Global variables
+DETECTION_THRESHOLD = 20 # The height (dB) a peak must stand above the local spectral baseline to count as interference
+BASELINE_WIDTH = 5 # The width (Hz) of the median filter that estimates the local spectral baseline
+MIN_PEAK_SPACING = 2 # The smallest distance (Hz) between two detected interference frequencies
+DETECTION_SEGMENT_SIZE = 8192 # The Welch segment size used when detecting interference in streamed blocks
+TRACKING_BINS = 101 # The number of frequencies each tracked interference is searched over per block
+
+
+
+#
+# Detection functions
+#
+def findInterferencePeaks(frequency, frequency_data, max_peaks, threshold=DETECTION_THRESHOLD, band=None):
+    """Find and return up to max_peaks interference frequencies (Hz, ascending) in an amplitude spectrum. Peaks are
+    ranked by their height above the median filtered spectrum, and refined between bins by parabolic interpolation"""
+
+    spacing = frequency[1] - frequency[0] # Frequency resolution of the spectrum
+    spectrum_db = 20 * np.log10(np.maximum(frequency_data, np.finfo(float).tiny)) # Avoid the log of zero
+
+    # Measure each bin against the local baseline of the spectrum around it
+    baseline_bins = int(round(BASELINE_WIDTH / spacing)) | 1 # Odd, so the filter is centred
+    excess_db = spectrum_db - median_filter(spectrum_db, size=baseline_bins, mode='nearest')
+
+    # Find the bins standing out from the baseline, within the search band
+    peaks, properties = find_peaks(excess_db, height=threshold, distance=max(1, int(MIN_PEAK_SPACING / spacing)))
+    if band is not None: # Ignore peaks outside the band
+        in_band = (frequency[peaks] >= band[0]) & (frequency[peaks] <= band[1])
+        peaks = peaks[in_band]
+        properties['peak_heights'] = properties['peak_heights'][in_band]
+    strongest = peaks[np.argsort(properties['peak_heights'])[::-1][:max_peaks]] # The highest peaks
+
+    # Refine each peak by fitting a parabola through the bins either side of it
+    detected = []
+    for peak in strongest:
+        if 0 < peak < len(spectrum_db) - 1:
+            left, centre, right = spectrum_db[peak - 1:peak + 2]
+            offset = 0.5 * (left - right) / (left - 2 * centre + right) # Vertex of the parabola, in bins
+        else:
+            offset = 0
+        detected.append(float(frequency[peak] + offset * spacing))
+
+    return sorted(detected)
+
+
+
+@instrumentStage()
+def detectInterference(samples, sample_rate, max_peaks=2, threshold=DETECTION_THRESHOLD, band=None, segment_size=None):
+    """Detect and return up to max_peaks narrowband interference frequencies (Hz, ascending) in a recording, from the
+    spectrum given by calcFreqSpectrum. If segment_size is given, a Welch averaged spectrum is used instead"""
+
+    frequency, frequency_data = calcFreqSpectrum(samples, sample_rate, segment_size)
+
+    return findInterferencePeaks(frequency, frequency_data, max_peaks, threshold, band)
+
+
+
+def detectInterferenceBlocks(blocks, sample_rate, max_peaks=2, threshold=DETECTION_THRESHOLD, band=None,
+                             segment_size=DETECTION_SEGMENT_SIZE):
+    """Detect and return up to max_peaks interference frequencies (Hz, ascending) from blocks of samples, using a Welch
+    averaged spectrum so memory stays bounded however long the recording is"""
+
+    frequency, frequency_data = calcWelchSpectrum(blocks, sample_rate, segment_size)
+
+    return findInterferencePeaks(frequency, frequency_data, max_peaks, threshold, band)
+
+
+
+#
+# Tracking functions
+#
+def trackInterference(blocks, sample_rate, frequencies, search_width=1.0, num_bins=TRACKING_BINS):
+    """Follow drifting interference frequencies block by block. For each block, the DFT is evaluated at num_bins
+    frequencies within search_width (Hz) of each current estimate with a zoom DFT (the chirp z-transform, computed
+    by FFT convolution, so it needs memory for a few copies of the block rather than one per search frequency), and
+    the estimate moves to the refined peak. Yields an array of the current estimates after each block"""
+
+    estimates = np.array(frequencies, dtype=float)
+    offsets = np.linspace(-search_width, search_width, num_bins) # Search grid around each estimate
+    step = offsets[1] - offsets[0]
+
+    for block in blocks: # Iterate through each block of samples
+        block = np.asarray(block)
+        windowed_block = block * get_window('hann', len(block)) # Reduce leakage from the ECG and other interference
+
+        # Evaluate the DFT of the block at the search frequencies of each estimate in turn
+        search_frequencies = estimates[:, np.newaxis] + offsets # Estimates x search bins
+        for index, estimate in enumerate(estimates):
+            spectrum = zoom_fft(windowed_block, [estimate - search_width, estimate + search_width], m=num_bins, fs=sample_rate,
+                                endpoint=True)
+            magnitude_db = 20 * np.log10(np.abs(spectrum) + np.finfo(float).tiny)
+
+            # Move the estimate to the refined peak of its search
+            peak = int(np.argmax(magnitude_db))
+            offset = 0
+            if 0 < peak < num_bins - 1: # Refine the peak by fitting a parabola through its neighbours
+                left, centre, right = magnitude_db[peak - 1:peak + 2]
+                offset = 0.5 * (left - right) / (left - 2 * centre + right)
+            estimates[index] = search_frequencies[index, peak] + offset * step
+
+        yield estimates.copy()
@@ -0,0 +1,82 @@
+"""
+    multirate.py
+    Contains the multirate front end functions for ENEL420-20S2 Assignment 1.
+    The ECG is decimated by a polyphase anti-alias filter before notching, so the notch
+    and FIR filters run at a lower rate with proportionally fewer taps, and can be
+    interpolated back to the original rate by a polyphase filter afterwards.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from scipy.signal import resample_poly
+import numpy as np
+
+
+# Global variables
+MAX_BAND_FRACTION = 0.8 # The highest frequency kept, as a fraction of the reduced Nyquist frequency, clear of the anti-alias transition band
+MIN_FIR_TAPS = 31 # The fewest taps an FIR filter is scaled down to
+
+
+
+#
+# Rate functions
+#
+def getProcessingRate(sample_rate, decimation_factor):
+    """Return the sample rate (Hz) the filters run at after decimation"""
+
+    return sample_rate / decimation_factor
+
+
+
+def checkDecimationFactor(sample_rate, decimation_factor, highest_frequency):
+    """Raise a ValueError if decimating by decimation_factor would put highest_frequency (Hz), the top of the
+    highest notch or pass band, too close to the reduced Nyquist frequency"""
+
+    if decimation_factor < 1 or int(decimation_factor) != decimation_factor:
+        raise ValueError('The decimation factor must be a whole number of at least 1, not {}'.format(decimation_factor))
+
+    max_frequency = MAX_BAND_FRACTION * getProcessingRate(sample_rate, decimation_factor) / 2
+    if highest_frequency > max_frequency:
+        raise ValueError('Decimating by {} only keeps frequencies up to {:.1f} Hz, but {:.1f} Hz is needed'.format(
+            decimation_factor, max_frequency, highest_frequency))
+
+
+
+def scaleTapCount(num_taps, decimation_factor):
+    """Return the tap count giving an FIR filter the same transition width (Hz) at the reduced rate. The count is
+    kept odd, so the filter stays linear-phase with a whole sample delay"""
+
+    scaled_taps = max(MIN_FIR_TAPS, int(np.ceil(num_taps / decimation_factor)))
+
+    return scaled_taps | 1 # Round up to an odd count
+
+
+
+#
+# Resampling functions
+#
+def decimateSignal(samples, decimation_factor, axis=-1):
+    """Low pass filter and downsample data by decimation_factor along the given axis, using a polyphase filter (only
+    the kept outputs are computed). The filter's delay is compensated, so the result lines up with the input"""
+
+    if decimation_factor == 1:
+        return samples
+
+    return resample_poly(samples, 1, decimation_factor, axis=axis)
+
+
+
+def interpolateSignal(samples, interpolation_factor, num_samples, axis=-1):
+    """Upsample data by interpolation_factor along the given axis with a polyphase anti-imaging filter, and return
+    the first num_samples samples, so the result matches the length of the original recording"""
+
+    if interpolation_factor == 1:
+        return samples
+
+    interpolated = resample_poly(samples, interpolation_factor, 1, axis=axis)
+
+    return np.take(interpolated, np.arange(num_samples), axis=axis)
@@ -13,10 +13,19 @@ from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve
 from scipy.fft import fft
 import numpy as np
 from configFiles import *
+from compiledKernels import useCompiledKernels, blockStatsKernel
+from instrumentation import instrumentStage
 
 
+# Global variables
+VARIANCE_BLOCK_SIZE = 1 << 16 # The number of samples per block when accumulating variance, bounding temporary memory
+FIR_FAMILIES = ['Window', 'Optimal', 'Frequency Sampling'] # The FIR filter families noise power is reported for
+NOTCH_FILTERS = ['IIR'] # The IIR notch filter pairs noise power is reported for
 
 
+
+
+@instrumentStage()
 def saveNoisePowerData(noise_power_data, noise_power_output_filename):
     """Iterate through a list of filters, saving the noise power (variance) data"""
 
@@ -34,29 +43,167 @@ def saveNoisePowerData(noise_power_data, noise_power_output_filename):
 #
 # Noise Power (variance) calculations
 #
-def calculateVariance(data):
-    """Calculates and returns the variance of a signal"""
+def createVarianceStats(shape=()):
+    """Create and return empty running variance statistics (sample count, mean and sum of squared deviations) for
+    signals of the given shape, excluding the sample axis"""
+
+    return {'count': 0, 'mean': np.zeros(shape), 'm2': np.zeros(shape)}
+
+
+
+def calculateBlockStats(block):
+    """Calculate and return the count, and the mean and sum of squared deviations along the last axis, of a block of
+    samples. Uses the compiled single pass kernel when the numba backend is selected"""
+
+    block = np.asarray(block)
+    block_count = block.shape[-1]
+
+    if useCompiledKernels():
+        rows = np.ascontiguousarray(block.reshape(-1, block_count), dtype=float) # One row per signal
+        block_count, block_mean, block_m2 = blockStatsKernel(rows)
+        return block_count, block_mean.reshape(block.shape[:-1]), block_m2.reshape(block.shape[:-1])
+
+    block_mean = np.mean(block, axis=-1) # Uses pairwise summation
+    deviation = block - block_mean[..., np.newaxis] # Deviation of each sample from the block mean
+    block_m2 = np.einsum('...i,...i->...', deviation, deviation) # Sum of squared deviations, without squaring into a new array
+
+    return block_count, block_mean, block_m2
+
+
+
+def mergeVarianceStats(stats, block_count, block_mean, block_m2):
+    """Merge the statistics of a block (count, mean and sum of squared deviations) into running variance statistics,
+    using the pairwise (Chan et al.) form of Welford's algorithm"""
+
+    if block_count == 0: # Nothing to add
+        return stats
+
+    total_count = stats['count'] + block_count
+    delta = block_mean - stats['mean'] # Difference between the block and running means
+    stats['mean'] = stats['mean'] + delta * (block_count / total_count)
+    stats['m2'] = stats['m2'] + block_m2 + np.square(delta) * (stats['count'] * block_count / total_count)
+    stats['count'] = total_count
+
+    return stats
 
-    # Calculate the variance of the signal X using: variance = E[X^2] - E[X]^2
-    expected_data_power = sum((np.square(data)))/len(data)  # Calculate E[X^2]
-    power_of_expected_data = np.square(sum(data)/len(data))  # Calculate E[X]^2
-    variance_data = expected_data_power - power_of_expected_data  # Calculate the variance of the data
+
+
+def updateVarianceStats(stats, block):
+    """Add a block of samples (along its last axis) to running variance statistics. This is numerically stable and
+    needs only one pass over the data"""
+
+    if np.shape(block)[-1] == 0: # Nothing to add
+        return stats
+
+    return mergeVarianceStats(stats, *calculateBlockStats(block))
+
+
+
+def getVariance(stats):
+    """Return the variance held by running variance statistics"""
+
+    return stats['m2'] / stats['count']
+
+
+
+def calculateVariance(data, axis=-1):
+    """Calculates and returns the variance of a signal along the given axis. 2-D data (records or leads x samples)
+    gives one variance per record or lead"""
+
+    data = np.moveaxis(np.asarray(data), axis, -1) # View the data with samples along the last axis, without copying
+    stats = createVarianceStats(data.shape[:-1])
+
+    # Accumulate the variance one block at a time, so temporary arrays stay small however long the signal is
+    for start in range(0, data.shape[-1], VARIANCE_BLOCK_SIZE):
+        updateVarianceStats(stats, data[..., start:start + VARIANCE_BLOCK_SIZE])
+    variance_data = getVariance(stats)
 
     return variance_data
 
 
 
-def calculateNoiseVariance(data, filtered_data):
+@instrumentStage()
+def calculateNoiseVariance(data, filtered_data, axis=-1):
     """"Calculate the variance of the noise by comparing the filtered and unfiltered data. The variance of the noise
-    is approximated as the variance of the signal removed by the filter"""
-
-    # Turn data arrays into numpy arrays so that mathematical operations can be performed
-    np_data = np.array(data)
-    np_filtered_data = np.array(filtered_data)
+    is approximated as the variance of the signal removed by the filter. 2-D data gives one result per record or lead"""
 
     # Calculate the variance of the removed noise by finding the variances of the filtered and unfiltered data
-    data_variance = calculateVariance(np_data) # Calculate the variance of the unfiltered data
-    filtered_data_variance = calculateVariance(np_filtered_data) # Calculat the variance of the filtered data
+    data_variance = calculateVariance(data, axis) # Calculate the variance of the unfiltered data
+    filtered_data_variance = calculateVariance(filtered_data, axis) # Calculat the variance of the filtered data
     noise_data_variance = data_variance - filtered_data_variance # Calculate the variance of the removed noise
 
     return noise_data_variance
+
+
+
+#
+# Single pass noise power accounting
+#
+def createNotchNoiseStages(filter_name):
+    """Create and return a dictionary of the noise power names of one pair of IIR notch filters (as saved by
+    saveNoisePowerData) and the pipeline stages before and after each. The pair has no separate overall filter, so
+    its overall noise power is measured after the full cascade"""
+
+    return {filter_name + ' notch filters': ('input', filter_name + ' full'),
+            'first ' + filter_name + ' notch filter': ('input', filter_name + ' half'),
+            'second ' + filter_name + ' notch filter': (filter_name + ' half', filter_name + ' full')}
+
+
+
+def createFIRNoiseStages(family):
+    """Create and return a dictionary of the noise power names of one FIR family (as saved by saveNoisePowerData)
+    and the pipeline stages before and after each. Every FIR family has an overall filter and two cascaded filters"""
+
+    return {'FIR ' + family + ' filters': ('input', family + ' overall'),
+            'first ' + family.lower() + ' filter': ('input', family + ' half'),
+            'second ' + family.lower() + ' filter': (family + ' half', family + ' full')}
+
+
+
+def createFilterNoiseStages(fir_families=FIR_FAMILIES, notch_filters=NOTCH_FILTERS):
+    """Create and return a dictionary of each filter's noise power name (as saved by saveNoisePowerData) and the
+    pipeline stages before and after that filter. The noise power is the variance lost between the two stages"""
+
+    noise_stages = {}
+    for filter_name in notch_filters: # Every pair of IIR notch filters
+        noise_stages.update(createNotchNoiseStages(filter_name))
+    for family in fir_families: # Every FIR family
+        noise_stages.update(createFIRNoiseStages(family))
+
+    return noise_stages
+
+
+
+def createNoisePowerAccumulator(stage_names):
+    """Create and return running variance statistics for each named pipeline stage"""
+
+    return {stage_name: createVarianceStats() for stage_name in stage_names}
+
+
+
+def accumulateNoisePower(accumulator, stage_blocks):
+    """Add the latest block of each pipeline stage (a dictionary of stage name and block) to the accumulator"""
+
+    for stage_name, block in stage_blocks.items():
+        updateVarianceStats(accumulator[stage_name], block)
+
+
+
+def accumulateNoisePowerStats(accumulator, stage_stats):
+    """Add the statistics (count, mean and sum of squared deviations) of the latest block of each pipeline stage to
+    the accumulator, for stages whose blocks were never stored"""
+
+    for stage_name, block_stats in stage_stats.items():
+        mergeVarianceStats(accumulator[stage_name], *block_stats)
+
+
+
+def calculateAccumulatedNoisePower(accumulator, noise_stages):
+    """Calculate and return a dictionary of each filter's noise power from the accumulated stage statistics, in the
+    same form as the noise power data saved by saveNoisePowerData"""
+
+    noise_power_data = {}
+    for filter_name, (before_stage, after_stage) in noise_stages.items(): # Iterate through each filter
+        noise_power_data[filter_name] = getVariance(accumulator[before_stage]) - getVariance(accumulator[after_stage])
+
+    return noise_power_data
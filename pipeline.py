@@ -0,0 +1,556 @@
+"""
+    pipeline.py
+    Contains the configurable filter pipeline for ENEL420-20S2 Assignment 1.
+    A pipeline is a dictionary of named steps (load, detect, design, filter, spectrum,
+    noise power, figures), each with the steps it depends on, built from a configuration
+    and a declarative filter spec. Outputs are only computed when a requested report needs
+    them, and each output is freed as soon as every step that needs it has used it. With an
+    incremental location, each design, noise power and report is saved under a key of its
+    inputs and parameters, so a re-run only recomputes the steps whose recording or parameters
+    changed.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import os
+import numpy as np
+from signalPlots import *
+from IIR import *
+from FIR import *
+from noise import *
+from configFiles import *
+from designCache import *
+from interference import *
+from instrumentation import *
+from multirate import *
+from resultsStore import *
+from adaptiveNotch import *
+from streaming import *
+from incremental import *
+
+
+# Global variables
+DEFAULT_PIPELINE_CONFIG = {'filename': 'enel420_grp_18.txt', # Location in project where ECG data is stored
+                           'sample_rate': 1024, # Sample rate of data (Hz)
+                           'cutoff': [57.755, 88.824], # Frequencies to attenuate (Hz), or 'auto' to detect them in the data
+                           'passband_f': [10, 10], # Passband frequencies (Hz) used to calculate the gain factor
+                           'notch_width': 5, # 3 dB bandwidth of the notch filters (Hz)
+                           'num_FIR_taps': 399, # The number for each FIR filter, or 'auto' to search for the fewest meeting the specification below
+                           'stop_attenuation': 40, # The stop band attenuation (dB) at the notches searched FIR designs must meet
+                           'passband_ripple': 1, # The pass band ripple (dB) searched FIR designs must meet
+                           'design_time_budget': 10, # The time (s) each FIR tap count search may take before keeping its best design
+                           'zero_phase': False, # Filter the IIR notches forwards and backwards, and trim the FIR delay, so outputs line up with the data
+                           'decimation_factor': 1, # Decimate the data by this factor before filtering, with proportionally fewer FIR taps
+                           'interpolate_output': False, # Interpolate the filtered data back to the original rate for the figures
+                           'figures_location': 'Group_18_Figures', # Folder to save created figure images to
+                           'figure_formats': ['png'], # The file formats to save each figure in
+                           'figure_dpi': 100, # The resolution to save figures at (dots per inch)
+                           'noise_power_filename': 'Group_18_Noise_Power_(Variance)_Data_from_Created_Filters.txt', # File to save calculated noise power data
+                           'results_location': 'Group_18_Results', # Folder to save each record's filtered signals, spectra and noise power to
+                           'results_dtype': 'float32', # The format ('float64' or 'float32') filtered signals are saved in. float32 keeps about 7 significant digits, half the size of float64
+                           'results_compress': False, # Compress the saved results. Uncompressed signals are read by memory mapping
+                           'incremental_location': None} # Folder to save each design, noise power and report to, keyed on its inputs, so re-runs only recompute what changed
+DEFAULT_FILTER_SPEC = [{'name': 'IIR', 'kind': 'iir',
+                        'figures': [('IIR_Notched_ECG_Time_Plot', plotIIRNotchECG),
+                                    ('IIR_Notched_Freq_Plot', plotIIRNotchECGSpectrum),
+                                    ('IIR_Frequency_Response', plotIIRNotchFilterResponse)]},
+                       {'name': 'Window', 'kind': 'fir', 'method': 'window',
+                        'figures': [('Windowed_ECG_Time_Plot', plotWindowedECG),
+                                    ('Windowed_Freq_Plot', plotWindowedECGSpectrum),
+                                    ('Windowed_Frequency_Response', plotWindowFilterResponse)]},
+                       {'name': 'Optimal', 'kind': 'fir', 'method': 'optimal',
+                        'figures': [('Optimal_ECG_Time_Plot', plotOptimalECG),
+                                    ('Optimal_Freq_Plot', plotOptimalECGSpectrum),
+                                    ('Optimal_Frequency_Response', plotOptimalFilterResponse)]},
+                       {'name': 'Frequency Sampling', 'kind': 'fir', 'method': 'freq_sampling',
+                        'figures': [('Freq_Sampled_ECG_Time_Plot', plotFrequencySampledECG),
+                                    ('Freq_Sampled_Freq_Plot', plotFrequencySampledECGSpectrum),
+                                    ('Freq_Sampled_Frequency_Response', plotFrequencySampledFilterResponse)]}] # Each filter the pipeline runs, and its figures
+ADAPTIVE_FILTER_SPEC = {'name': 'Adaptive', 'kind': 'adaptive',
+                        'figures': [('Adaptive_Notched_ECG_Time_Plot', plotAdaptiveNotchECG),
+                                    ('Adaptive_Notched_Freq_Plot', plotAdaptiveNotchECGSpectrum)]} # Append to a filter spec to run the adaptive notches. Without Numba they filter about 10k-20k samples/s, against millions for the IIR notches
+NOTCH_KINDS = ['iir', 'adaptive'] # The filter kinds that are a pair of notches, with no separate overall filter
+REPORTS = {'noise': 'noise power', # The noise power removed by each filter, returned as a dictionary
+           'noise file': 'noise file', # The noise power, saved to the noise power file
+           'figures': 'figures', # Every figure, saved to the figures folder
+           'results': 'results'} # The filtered signals, spectra and noise power, saved to the results store
+STAGE_OUTPUTS = {'half': 0, 'full': 1, 'overall': 2} # Where each noise stage is in a filter's outputs
+NOISE_REPORTS = ['noise', 'noise file'] # The reports which only need the noise power, so can stream each filter's stages instead of holding them
+NOISE_BLOCK_SIZE = 1 << 16 # The number of samples streamed through each filter at a time when the noise power is streamed
+OUTPUT_RATE_KEYS = ['sample_rate', 'decimation_factor', 'interpolate_output'] # The configuration the rate of the plotted data depends on
+DESIGN_KEYS = ['sample_rate', 'decimation_factor', 'notch_width', 'passband_f', 'num_FIR_taps', 'stop_attenuation', 'passband_ripple',
+               'design_time_budget'] # The configuration each filter design uses
+FIGURE_KEYS = OUTPUT_RATE_KEYS + ['notch_width', 'figures_location', 'figure_formats', 'figure_dpi'] # The configuration the figures use
+RESULTS_KEYS = OUTPUT_RATE_KEYS + ['filename', 'results_location', 'results_dtype', 'results_compress'] # The configuration the saved results use
+PERSISTED_STEPS = ['cutoff', 'noise power', 'noise file', 'figures', 'results'] # The steps saved for reuse, which are small or are reports
+PERSISTED_FILTER_STEPS = [' design', ' noise'] # The steps of each filter saved for reuse. Signals are cheaper to recompute than to store
+
+
+
+#
+# Step functions
+#
+def findCutoff(config, samples):
+    """Return the notch frequencies (Hz) of the configuration, detecting them in the samples if the cutoff is 'auto'"""
+
+    if config['cutoff'] != 'auto':
+        return list(config['cutoff'])
+
+    cutoff = detectInterference(samples, config['sample_rate'], max_peaks=2) # The strongest narrowband peaks in the spectrum
+    if len(cutoff) != 2:
+        raise ValueError('Expected two interference frequencies in {}, found {}'.format(config['filename'], cutoff))
+
+    return cutoff
+
+
+
+def getOutputRate(config):
+    """Return the sample rate (Hz) of the filtered data plotted: the original rate, unless the data is decimated and
+    not interpolated back"""
+
+    if config['interpolate_output']:
+        return config['sample_rate']
+
+    return getProcessingRate(config['sample_rate'], config['decimation_factor'])
+
+
+
+def designFilter(config, filter_spec, cutoff):
+    """Design and return the filters of one filter spec entry at the processing rate: the two IIR notch filters'
+    (numerator, denominator) pairs, the adaptive notches' (notch_freq_1, notch_freq_2, sample_rate), or the FIR
+    designer's (filter_1, filter_2, filter_overall). FIR tap counts are
+    scaled down by the decimation factor (see getScaledTapReports for the count used), or searched for if 'auto' (see
+    getSearchReports for what each search found)"""
+
+    decimation_factor = config['decimation_factor']
+    checkDecimationFactor(config['sample_rate'], decimation_factor, max(list(cutoff) + list(config['passband_f'])) + config['notch_width'])
+    processing_rate = getProcessingRate(config['sample_rate'], decimation_factor)
+
+    if filter_spec['kind'] == 'iir':
+        return [createIIRNotchFilter(cutoff[index], config['notch_width'], config['passband_f'][index], processing_rate)
+                for index in range(2)]
+
+    if filter_spec['kind'] == 'adaptive': # The notches start at the cutoff, and track the interference from there
+        return (cutoff[0], cutoff[1], processing_rate)
+
+    if config['num_FIR_taps'] == 'auto': # Search for the fewest taps meeting the specification at the processing rate
+        filters, report = createMinimumTapFilters(filter_spec['method'], cutoff, processing_rate, config['notch_width'], config['stop_attenuation'],
+                                                  config['passband_ripple'], time_budget=config['design_time_budget'])
+        return filters
+
+    if decimation_factor > 1: # Fewer taps give the same transition width at the lower rate
+        filters, report = createScaledTapFilters(filter_spec['method'], cutoff, processing_rate, config['notch_width'], config['num_FIR_taps'],
+                                                 decimation_factor)
+        return filters
+
+    return createCachedFilters(filter_spec['method'], cutoff, processing_rate, config['notch_width'], config['num_FIR_taps'])
+
+
+
+def applyFilter(filter_spec, design, samples, zero_phase=False, outputs='all'):
+    """Apply the filters of one filter spec entry to the samples, and return the (half, full, overall) filtered
+    samples, or only the (half, full) cascade or the overall samples if outputs is 'cascade' or 'overall'. The IIR
+    and adaptive notch filters have no separate overall filter, so their overall output is the full output. If
+    zero_phase is True the outputs have no phase shift: the IIR filters run forwards and backwards, and the FIR
+    filters' constant delay is trimmed. The adaptive notches subtract their interference estimate from each sample
+    without delaying it, so have no phase shift to remove"""
+
+    if filter_spec['kind'] in NOTCH_KINDS:
+        if filter_spec['kind'] == 'iir':
+            (numerator_1, denominator_1), (numerator_2, denominator_2) = design
+            applyNotchFilters = lambda partial_output: applyIIRNotchFilters(numerator_1, denominator_1, numerator_2, denominator_2, samples,
+                                                                            partial_output=partial_output, zero_phase=zero_phase)
+        else:
+            applyNotchFilters = lambda partial_output: applyAdaptiveNotchFilters(*design, samples, partial_output=partial_output)
+        if outputs == 'overall':
+            return applyNotchFilters(False)
+        half_filtered_samples, filtered_samples = applyNotchFilters(True)
+        return (half_filtered_samples, filtered_samples) if outputs == 'cascade' else (half_filtered_samples, filtered_samples, filtered_samples)
+
+    return applyFIRFilters(*design, samples, compensate_delay=zero_phase, outputs=outputs)
+
+
+
+def calculateFilterNoise(filter_name, noise_stages, samples, outputs):
+    """Calculate and return the noise power removed by each of one filter's noise stages, as a dictionary"""
+
+    filter_noise = {}
+    for noise_name, (before_stage, after_stage) in noise_stages.items():
+        stage_filter, after_output = after_stage.rsplit(' ', 1) # The filter name may itself contain spaces
+        if stage_filter != filter_name: # Belongs to another filter
+            continue
+        before_data = samples if before_stage == 'input' else outputs[STAGE_OUTPUTS[before_stage.rsplit(' ', 1)[-1]]]
+        after_data = outputs[STAGE_OUTPUTS[after_output]]
+        filter_noise[noise_name] = calculateNoiseVariance(before_data, after_data)
+
+    return filter_noise
+
+
+
+def streamFilterStages(filter_spec, design, samples, block_size=NOISE_BLOCK_SIZE):
+    """Pass the samples through the filters of one filter spec entry block by block, and yield a dictionary of the
+    input block and each stage's filtered block, named as in the noise stages. The filter state is carried between
+    blocks, so only one block of each stage is held at a time"""
+
+    name = filter_spec['name']
+    blocks = createDataBlocks(samples, block_size)
+
+    if filter_spec['kind'] == 'iir':
+        (numerator_1, denominator_1), (numerator_2, denominator_2) = design
+        stage_stream = streamIIRNotchFilters(numerator_1, denominator_1, numerator_2, denominator_2, createDataBlocks(samples, block_size))
+        for block, (half_filtered_block, filtered_block) in zip(blocks, stage_stream):
+            yield {'input': block, name + ' half': half_filtered_block, name + ' full': filtered_block}
+    elif filter_spec['kind'] == 'adaptive':
+        notch_freq_1, notch_freq_2, sample_rate = design
+        state = createAdaptiveNotchState([notch_freq_1, notch_freq_2], sample_rate) # Kept between blocks, so the notches keep tracking
+        for block in blocks:
+            half_filtered_block, filtered_block = applyAdaptiveNotch(state, block, stage_outputs=True)
+            yield {'input': block, name + ' half': half_filtered_block, name + ' full': filtered_block}
+    else:
+        stage_stream = streamFIRFilters(*design, createDataBlocks(samples, block_size))
+        for block, (half_filtered_block, full_filtered_block, overall_filtered_block) in zip(blocks, stage_stream):
+            yield {'input': block, name + ' half': half_filtered_block, name + ' full': full_filtered_block, name + ' overall': overall_filtered_block}
+
+
+
+def streamFilterNoise(filter_spec, noise_stages, design, samples):
+    """Calculate and return the noise power removed by each of one filter's noise stages, as a dictionary, from
+    running variances of each stage accumulated block by block, so none of the filter's outputs are held in full"""
+
+    filter_stages = {noise_name: stages for noise_name, stages in noise_stages.items()
+                     if stages[1].rsplit(' ', 1)[0] == filter_spec['name']} # The filter name may itself contain spaces
+    accumulator = createNoisePowerAccumulator({stage_name for stages in filter_stages.values() for stage_name in stages})
+    for stage_blocks in streamFilterStages(filter_spec, design, samples):
+        accumulateNoisePower(accumulator, {stage_name: block for stage_name, block in stage_blocks.items() if stage_name in accumulator})
+
+    return calculateAccumulatedNoisePower(accumulator, filter_stages)
+
+
+
+def combineFilterNoise(noise_stages, *filter_noises):
+    """Combine each filter's noise power into one dictionary, in the order of the noise stages"""
+
+    combined_noise = {}
+    for filter_noise in filter_noises:
+        combined_noise.update(filter_noise)
+
+    return {noise_name: combined_noise[noise_name] for noise_name in noise_stages}
+
+
+
+def reduceTimeTrace(samples, sample_rate):
+    """Return the (samples, time) arguments of a time domain plot, reduced to the points the figure will draw, so
+    only those are sent to the figure's worker rather than the whole recording"""
+
+    time, plot_samples = reduceForFigure(getTimeData(sample_rate, len(samples)), samples)
+
+    return plot_samples, time
+
+
+
+def reduceSpectrum(frequency, frequency_data):
+    """Return the (frequency, amplitude) arguments of a spectrum plot, reduced to the points the figure will draw"""
+
+    return reduceForFigure(frequency, np.abs(frequency_data))
+
+
+
+def createFilterFigureJobs(config, filter_spec, cutoff, design, filtered_samples, spectrum):
+    """Create and return the figure jobs (name, plot function and arguments) of one filter spec entry"""
+
+    sample_rate = getProcessingRate(config['sample_rate'], config['decimation_factor']) # The rate the filters were designed at
+    (time_name, time_plot), (spectrum_name, spectrum_plot) = filter_spec['figures'][:2]
+
+    figure_jobs = [(time_name, time_plot, reduceTimeTrace(filtered_samples, getOutputRate(config))),
+                   (spectrum_name, spectrum_plot, reduceSpectrum(*spectrum))]
+    if filter_spec['kind'] == 'adaptive': # The adaptive notches follow the interference, so have no fixed response to plot
+        return figure_jobs
+
+    response_name, response_plot = filter_spec['figures'][2]
+    if filter_spec['kind'] == 'iir':
+        response_arguments = combineFilters(*design[0], *design[1]) + (sample_rate,) # The two notches combined
+    else:
+        response_arguments = (design[2], sample_rate) # The overall filter
+    figure_jobs.append((response_name, response_plot, response_arguments))
+    if filter_spec['kind'] == 'iir':
+        figure_jobs.append((filter_spec['name'].replace(' ', '_') + '_Pole_Zero_Plot', plotIIRPoleZero, (cutoff, config['notch_width'], sample_rate)))
+
+    return figure_jobs
+
+
+
+def renderPipelineFigures(config, filter_specs, samples, spectrum, cutoff, *filter_data):
+    """Create and save every figure: the input data, then each filter's. filter_data holds each filter's design,
+    plotted output and spectrum in turn"""
+
+    figure_jobs = [('ECG_Time_Plot', plotECG, reduceTimeTrace(samples, config['sample_rate'])),
+                   ('ECG_Freq_Plot', plotECGSpectrum, reduceSpectrum(*spectrum))]
+    for index, filter_spec in enumerate(filter_specs): # Iterate through each filter's design, plotted output and spectrum
+        design, filtered_samples, filter_spectrum = filter_data[3 * index:3 * index + 3]
+        figure_jobs += createFilterFigureJobs(config, filter_spec, cutoff, design, filtered_samples, filter_spectrum)
+
+    renderFigures(figure_jobs, config['figures_location'], config['figure_formats'], config['figure_dpi'])
+
+    return [figure_name for figure_name, plot_function, arguments in figure_jobs]
+
+
+
+def saveResults(config, filter_specs, samples, spectrum, noise_power, *filter_data):
+    """Save the input and each filter's plotted output and spectrum, and the noise power, to the results store under
+    the data file's record name (getRecordName), and return the record's folder. filter_data holds each filter's plotted output and
+    spectrum in turn"""
+
+    record_name = getRecordName(config['filename'])
+    signals = {'input': (samples, config['sample_rate'])}
+    spectra = {'input': spectrum}
+    for index, filter_spec in enumerate(filter_specs): # Iterate through each filter's plotted output and spectrum
+        signals[filter_spec['name']] = (filter_data[2 * index], getOutputRate(config))
+        spectra[filter_spec['name']] = filter_data[2 * index + 1]
+
+    return saveRecordResults(config['results_location'], record_name, signals, spectra, noise_power, config['results_dtype'],
+                             config['results_compress'], source=os.path.abspath(config['filename']))
+
+
+
+#
+# Pipeline functions
+#
+def createPipelineSteps(config, filter_specs, stream_noise=False):
+    """Create and return a dictionary of every step of the pipeline: the step's function, the names of the steps
+    whose outputs it is called with, and the step's inputs (the configuration values and filter spec entries it
+    uses). Each function is called with its inputs and then its dependencies' outputs, and never sees the rest of
+    the configuration, so a value a step uses but does not list raises a KeyError instead of being left out of the
+    step's key (see getStepKey). If stream_noise is True each filter's noise power is streamed from its design,
+    instead of measured on its outputs"""
+
+    noise_stages = {} # Each filter's noise stages, named after the filter, in the order of the filter spec
+    for filter_spec in filter_specs:
+        noise_stages.update(createNotchNoiseStages(filter_spec['name']) if filter_spec['kind'] in NOTCH_KINDS
+                            else createFIRNoiseStages(filter_spec['name']))
+    getInputs = lambda *keys, **extra: dict({key: config[key] for key in keys}, **extra) # The values a step is given
+
+    steps = {'samples': (lambda inputs: importData(inputs['filename']), [], getInputs('filename')), # Also keyed on the file's contents
+             'cutoff': (findCutoff, ['samples'], getInputs('filename', 'cutoff', 'sample_rate')),
+             'spectrum': (lambda inputs, samples: calcFreqSpectrum(samples, inputs['sample_rate']), ['samples'], getInputs('sample_rate')),
+             'processing samples': (lambda inputs, samples: decimateSignal(samples, inputs['decimation_factor']), ['samples'], # The data the filters run on
+                                    getInputs('decimation_factor'))}
+
+    for filter_spec in filter_specs: # Each filter is designed, applied, measured and plotted in its own steps
+        name = filter_spec['name']
+        steps[name + ' design'] = (lambda inputs, cutoff: designFilter(inputs, inputs['filter_spec'], cutoff), ['cutoff'],
+                                   getInputs(*DESIGN_KEYS, filter_spec=filter_spec))
+        if filter_spec['kind'] in NOTCH_KINDS: # The overall output is the end of the cascade, so comes with it
+            steps[name + ' outputs'] = (lambda inputs, design, samples: applyFilter(inputs['filter_spec'], design, samples, inputs['zero_phase']),
+                                        [name + ' design', 'processing samples'], getInputs('zero_phase', filter_spec=filter_spec))
+            steps[name + ' overall'] = (lambda inputs, outputs: outputs[STAGE_OUTPUTS['overall']], [name + ' outputs'], {})
+        else: # The overall filter is separate, so the cascade is only computed when the noise power needs it
+            steps[name + ' overall'] = (lambda inputs, design, samples: applyFilter(inputs['filter_spec'], design, samples, inputs['zero_phase'], 'overall'),
+                                        [name + ' design', 'processing samples'], getInputs('zero_phase', filter_spec=filter_spec))
+            steps[name + ' outputs'] = (lambda inputs, design, samples, overall: applyFilter(inputs['filter_spec'], design, samples, inputs['zero_phase'],
+                                                                                             'cascade') + (overall,),
+                                        [name + ' design', 'processing samples', name + ' overall'], getInputs('zero_phase', filter_spec=filter_spec))
+        steps[name + ' plotted'] = (lambda inputs, overall, samples: interpolateSignal(overall, inputs['decimation_factor'], len(samples))
+                                    if inputs['interpolate_output'] else overall, [name + ' overall', 'samples'],
+                                    getInputs('decimation_factor', 'interpolate_output'))
+        steps[name + ' spectrum'] = (lambda inputs, filtered_samples: calcFreqSpectrum(filtered_samples, getOutputRate(inputs)), [name + ' plotted'],
+                                     getInputs(*OUTPUT_RATE_KEYS))
+        if stream_noise: # Only the noise power is needed, so the outputs are never held in full
+            steps[name + ' noise'] = (lambda inputs, design, samples: streamFilterNoise(inputs['filter_spec'], inputs['noise_stages'], design, samples),
+                                      [name + ' design', 'processing samples'], {'filter_spec': filter_spec, 'noise_stages': noise_stages})
+        else: # Measured at the processing rate
+            steps[name + ' noise'] = (lambda inputs, samples, outputs: calculateFilterNoise(inputs['name'], inputs['noise_stages'], samples, outputs),
+                                      ['processing samples', name + ' outputs'], {'name': name, 'noise_stages': noise_stages})
+
+    steps['noise power'] = (lambda inputs, *filter_noises: combineFilterNoise(inputs['noise_stages'], *filter_noises),
+                            [filter_spec['name'] + ' noise' for filter_spec in filter_specs], {'noise_stages': noise_stages})
+    steps['noise file'] = (lambda inputs, noise_power_data: saveNoisePowerData(noise_power_data, inputs['noise_power_filename']),
+                           ['noise power'], getInputs('noise_power_filename'))
+    steps['figures'] = (lambda inputs, *arguments: renderPipelineFigures(inputs, inputs['filter_specs'], *arguments),
+                        ['samples', 'spectrum', 'cutoff'] + [filter_spec['name'] + step for filter_spec in filter_specs
+                                                             for step in [' design', ' plotted', ' spectrum']],
+                        getInputs(*FIGURE_KEYS, filter_specs=filter_specs))
+    steps['results'] = (lambda inputs, *arguments: saveResults(inputs, inputs['filter_specs'], *arguments),
+                        ['samples', 'spectrum', 'noise power'] + [filter_spec['name'] + step for filter_spec in filter_specs
+                                                                  for step in [' plotted', ' spectrum']],
+                        getInputs(*RESULTS_KEYS, filter_specs=filter_specs))
+
+    return steps
+
+
+
+def getStepFiles(config, step_name, output):
+    """Return the files a step which saves its results wrote, so a reused output is only trusted while they are
+    unchanged (another run with other parameters may have rewritten them)"""
+
+    if step_name == 'noise file':
+        return [config['noise_power_filename']]
+    if step_name == 'figures': # The output is the name of each figure
+        return [os.path.join(config['figures_location'], figure_name + '.' + file_format)
+                for figure_name in output for file_format in config['figure_formats']]
+    if step_name == 'results': # The output is the record's folder
+        return [os.path.join(output, filename) for filename in sorted(os.listdir(output))]
+
+    return []
+
+
+
+def getPersistedSteps(filter_specs):
+    """Return the set of steps whose outputs are saved for reuse in incremental mode: the designs, noise power and
+    reports. The loaded, filtered and plotted signals and spectra are not saved, as they are as large as the
+    recording and quick to recompute from a saved design"""
+
+    return set(PERSISTED_STEPS) | {filter_spec['name'] + step for filter_spec in filter_specs for step in PERSISTED_FILTER_STEPS}
+
+
+
+def createPipeline(config=None, filter_specs=DEFAULT_FILTER_SPEC):
+    """Create and return a pipeline from a configuration (any keys missing are taken from DEFAULT_PIPELINE_CONFIG)
+    and a filter spec. Nothing is computed until an output is requested"""
+
+    config = dict(DEFAULT_PIPELINE_CONFIG, **(config or {}))
+
+    return {'config': config,
+            'filter_specs': filter_specs,
+            'steps': createPipelineSteps(config, filter_specs),
+            'outputs': {}, # The outputs computed and not yet freed
+            'consumers': {}, # The number of planned uses left of each output
+            'keys': {}, # The key of each step's output, once found
+            'persisted': getPersistedSteps(filter_specs), # The steps whose outputs are saved for reuse
+            'reuse': {'reused': [], 'computed': []}} # The steps whose outputs were reused from a previous run, and those computed
+
+
+
+def planPipeline(pipeline, step_names):
+    """Count how many planned steps use each output needed to compute the named steps, so each output can be freed
+    after its last use. The named steps' own outputs are kept until they are returned"""
+
+    consumers = pipeline['consumers']
+    steps_to_visit = list(step_names)
+    visited = set()
+
+    for step_name in step_names: # The caller is one more user of each requested output
+        consumers[step_name] = consumers.get(step_name, 0) + 1
+    while steps_to_visit: # Walk back through every dependency of the requested steps
+        step_name = steps_to_visit.pop()
+        if step_name in visited:
+            continue
+        visited.add(step_name)
+        for dependency in pipeline['steps'][step_name][1]:
+            consumers[dependency] = consumers.get(dependency, 0) + 1
+            steps_to_visit.append(dependency)
+
+
+
+def releasePipelineOutput(pipeline, step_name):
+    """Note that one planned use of an output is done, and free the output once no planned step needs it. Outputs
+    which were never planned are kept, so they can be requested again. If the output was never computed (as every
+    step needing it was reused) its own dependencies are released in turn"""
+
+    consumers = pipeline['consumers']
+    if step_name not in consumers:
+        return
+
+    consumers[step_name] -= 1
+    if consumers[step_name] <= 0:
+        del consumers[step_name]
+        if step_name in pipeline['outputs']:
+            del pipeline['outputs'][step_name]
+        else: # Never computed, so its dependencies still count this step as a use
+            for dependency in pipeline['steps'][step_name][1]:
+                releasePipelineOutput(pipeline, dependency)
+
+
+
+def getStepKey(pipeline, step_name):
+    """Return the key of a step's output: a hash of the step's name, its inputs and the keys of the steps it depends
+    on, so it changes whenever the input recording or anything upstream of the step changes. The loaded samples are
+    also keyed on the recording's contents, so a rewritten file is loaded again"""
+
+    keys = pipeline['keys']
+    if step_name not in keys:
+        function, dependencies, inputs = pipeline['steps'][step_name]
+        parameters = dict(inputs, data=hashFile(inputs['filename'])) if step_name == 'samples' else inputs
+        keys[step_name] = createKey([function, inputs], step_name, parameters, # Keyed on the code the step runs, including functions in its inputs
+                                    [getStepKey(pipeline, dependency) for dependency in dependencies])
+
+    return keys[step_name]
+
+
+
+def loadReusableOutput(pipeline, step_name):
+    """Return (True, output) if the step's output was saved by a previous run with the same key, and any files it
+    wrote are unchanged, or (False, None) if the step must be computed"""
+
+    found, saved = loadOutput(pipeline['config']['incremental_location'], getStepKey(pipeline, step_name))
+    if found and filesUnchanged(saved['files']):
+        return True, saved['output']
+
+    return False, None
+
+
+
+def getPipelineOutput(pipeline, step_name):
+    """Return the output of a step, reusing it from a previous run if it is saved for reuse and nothing it depends on
+    has changed, or else computing it and the outputs it depends on if they are not already held"""
+
+    outputs = pipeline['outputs']
+    if step_name in outputs:
+        return outputs[step_name]
+
+    function, dependencies, inputs = pipeline['steps'][step_name]
+    incremental = pipeline['config']['incremental_location'] is not None and step_name in pipeline['persisted']
+    reused, output = False, None
+    if incremental:
+        with measureStage(step_name + ' lookup') as record: # Finding the key hashes the recording the first time
+            reused, output = loadReusableOutput(pipeline, step_name)
+            record['reused'] = reused
+    if reused: # None of the dependencies are needed for this step
+        outputs[step_name] = output
+        pipeline['reuse']['reused'].append(step_name)
+        for dependency in dependencies:
+            releasePipelineOutput(pipeline, dependency)
+        return output
+
+    arguments = [getPipelineOutput(pipeline, dependency) for dependency in dependencies]
+    with measureStage(step_name):
+        outputs[step_name] = function(inputs, *arguments)
+    del arguments # Drop this step's references, so released outputs are really freed
+    for dependency in dependencies:
+        releasePipelineOutput(pipeline, dependency)
+    pipeline['reuse']['computed'].append(step_name)
+    if incremental: # Save the output, and the files it wrote, for the next run
+        step_files = getFileFingerprints(getStepFiles(pipeline['config'], step_name, outputs[step_name]))
+        saveOutput(pipeline['config']['incremental_location'], getStepKey(pipeline, step_name), {'output': outputs[step_name], 'files': step_files})
+
+    return outputs[step_name]
+
+
+
+def runPipeline(pipeline, reports=('noise file', 'figures')):
+    """Run the steps needed for each report (see REPORTS) and return a dictionary of each report's output. Only the
+    outputs the reports need are computed, and each is freed once used. If only the noise power is reported (see
+    NOISE_REPORTS), each filter's stages are streamed block by block instead of computed in full"""
+
+    step_names = [REPORTS[report] for report in reports]
+    stream_noise = set(reports) <= set(NOISE_REPORTS) and not pipeline['config']['zero_phase'] # Zero phase filtering needs the whole recording
+    if stream_noise and not pipeline['keys'] and not pipeline['outputs']: # Nothing has been run yet, so the noise steps can still be swapped
+        pipeline['steps'] = createPipelineSteps(pipeline['config'], pipeline['filter_specs'], stream_noise)
+    planPipeline(pipeline, step_names)
+
+    results = {}
+    for report, step_name in zip(reports, step_names):
+        results[report] = getPipelineOutput(pipeline, step_name)
+        releasePipelineOutput(pipeline, step_name)
+
+    return results
+
+
+
+def getReuseReport(pipeline):
+    """Return a dictionary of the steps whose outputs were reused from a previous run, and of those computed"""
+
+    return {'reused': list(pipeline['reuse']['reused']), 'computed': list(pipeline['reuse']['computed'])}
@@ -0,0 +1,260 @@
+"""
+    realTime.py
+    Contains the real-time notch filtering functions for ENEL420-20S2 Assignment 1.
+    Samples are pushed in small frames into preallocated ring buffers and filtered
+    with persistent state, without allocating any arrays per frame. The processing
+    latency of every frame is recorded, and the group delay of the filter is reported.
+    A simulated source replays a recording at wall-clock rate for testing.
+
+    Usage: python realTime.py [seconds to replay]
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from scipy.signal import group_delay, sos2tf
+import sys
+import time
+import numpy as np
+from configFiles import importDataBlocks
+from IIR import createIIRNotchSOS
+from FIR import createWindowFilters
+from compiledKernels import useCompiledKernels, sosFrameKernel
+
+
+# Global variables
+DEFAULT_FRAME_SIZE = 32 # The largest number of samples pushed at once
+DEFAULT_HISTORY_SIZE = 1 << 14 # The number of recent input and output samples kept in the ring buffers
+LATENCY_HISTORY_SIZE = 1 << 14 # The number of recent frame latencies kept for the percentiles
+
+
+
+#
+# Filter state functions
+#
+def createRealTimeState(sample_rate, frame_size, history_size):
+    """Create and return the buffers shared by every real-time filter. Every array is allocated here, once"""
+
+    return {'sample_rate': sample_rate,
+            'frame_size': frame_size,
+            'frame_output': np.zeros(frame_size), # The filtered samples of the latest frame
+            'input_history': np.zeros(history_size), # Ring buffer of recent input samples
+            'output_history': np.zeros(history_size), # Ring buffer of recent filtered samples
+            'history_position': 0, # Where the next sample is written in the history ring buffers
+            'num_samples': 0, # The number of samples filtered so far
+            'latencies': np.zeros(LATENCY_HISTORY_SIZE), # Ring buffer of recent frame processing times (s)
+            'num_frames': 0} # The number of frames filtered so far
+
+
+
+def createRealTimeIIRFilter(sos, sample_rate, frame_size=DEFAULT_FRAME_SIZE, history_size=DEFAULT_HISTORY_SIZE):
+    """Create and return the state of a real-time IIR filter from second order sections, such as those returned by
+    createIIRNotchSOS"""
+
+    filter_state = createRealTimeState(sample_rate, frame_size, history_size)
+    filter_state['kind'] = 'iir'
+    filter_state['sos'] = np.asarray(sos, dtype=float)
+    filter_state['coefficients'] = [[float(coefficient) for coefficient in section] for section in sos] # Fast to index per sample
+    filter_state['section_states'] = [[0.0, 0.0] for section in sos] # Two delay elements per section, starting at rest
+    filter_state['compiled'] = useCompiledKernels() # The backend is fixed when the filter is created, as each keeps its own state
+    filter_state['state_array'] = np.zeros((len(sos), 2)) # The section states used by the compiled kernel
+
+    return filter_state
+
+
+
+def createRealTimeFIRFilter(filter_array, sample_rate, frame_size=DEFAULT_FRAME_SIZE, history_size=DEFAULT_HISTORY_SIZE):
+    """Create and return the state of a real-time FIR filter, such as one returned by the FIR designers"""
+
+    num_taps = len(filter_array)
+    filter_state = createRealTimeState(sample_rate, frame_size, history_size)
+    filter_state['kind'] = 'fir'
+    filter_state['filter_array'] = np.asarray(filter_array, dtype=float)
+    filter_state['reversed_taps'] = np.ascontiguousarray(filter_state['filter_array'][::-1]) # Oldest sample first
+    filter_state['delay_line'] = np.zeros(2 * (num_taps - 1) + frame_size) # The last num_taps - 1 samples, then room for frames
+    filter_state['delay_windows'] = np.lib.stride_tricks.sliding_window_view(filter_state['delay_line'], num_taps) # Row i is the num_taps samples from i, a view made once
+    filter_state['delay_position'] = num_taps - 1 # Where the next sample is written
+
+    return filter_state
+
+
+
+#
+# Processing functions
+#
+def processFrame(filter_state, frame):
+    """Push a frame of samples into the filter and return a view of the filtered frame. The view is overwritten by the
+    next frame, so copy it if it must be kept. The processing latency of the frame is recorded"""
+
+    start_time = time.perf_counter()
+    num_samples = len(frame)
+    if num_samples > filter_state['frame_size']:
+        raise ValueError('Frame of {} samples is larger than the frame size {}'.format(num_samples, filter_state['frame_size']))
+
+    output = filter_state['frame_output'][:num_samples] # Preallocated, so no array is created for the result
+    if filter_state['kind'] == 'iir':
+        filterIIRFrame(filter_state, frame, output)
+    else:
+        filterFIRFrame(filter_state, frame, output)
+    writeHistory(filter_state, frame, output)
+
+    # Record the processing latency of this frame
+    latencies = filter_state['latencies']
+    latencies[filter_state['num_frames'] % len(latencies)] = time.perf_counter() - start_time
+    filter_state['num_frames'] += 1
+
+    return output
+
+
+
+def filterIIRFrame(filter_state, frame, output):
+    """Filter a frame through each second order section in transposed direct form II, writing into output and
+    updating the persistent section states"""
+
+    if filter_state['compiled']:
+        sosFrameKernel(filter_state['sos'], np.asarray(frame, dtype=float), filter_state['state_array'], output)
+        return
+
+    for index in range(len(frame)): # Iterate through each sample
+        sample = float(frame[index])
+        for (b0, b1, b2, a0, a1, a2), section_state in zip(filter_state['coefficients'], filter_state['section_states']):
+            filtered = b0 * sample + section_state[0]
+            section_state[0] = b1 * sample - a1 * filtered + section_state[1]
+            section_state[1] = b2 * sample - a2 * filtered
+            sample = filtered # The output of this section is the input of the next
+        output[index] = sample
+
+
+
+def filterFIRFrame(filter_state, frame, output):
+    """Filter a frame through an FIR filter, writing into output and updating the persistent delay line. The frame is
+    appended to the delay line, and every output sample is found in one product of the frame's strided windows of
+    the delay line with the taps, without copying the windows"""
+
+    delay_line = filter_state['delay_line']
+    reversed_taps = filter_state['reversed_taps']
+    num_taps = len(reversed_taps)
+    position = filter_state['delay_position']
+    num_samples = len(frame)
+
+    # Move the last num_taps - 1 samples back to the start when the frame would not fit. The delay line is long enough
+    # that they never overlap where they are copied to
+    if position + num_samples > len(delay_line):
+        delay_line[:num_taps - 1] = delay_line[position - num_taps + 1:position]
+        position = num_taps - 1
+
+    delay_line[position:position + num_samples] = frame
+    first_window = position - num_taps + 1 # The window ending at the frame's first sample, oldest sample first
+    np.matmul(filter_state['delay_windows'][first_window:first_window + num_samples], reversed_taps, out=output)
+
+    filter_state['delay_position'] = position + num_samples
+
+
+
+def writeHistory(filter_state, frame, output):
+    """Copy a frame and its filtered samples into the history ring buffers, wrapping at the end"""
+
+    input_history = filter_state['input_history']
+    output_history = filter_state['output_history']
+    history_size = len(input_history)
+    position = filter_state['history_position']
+    num_samples = len(frame)
+
+    first_part = min(num_samples, history_size - position) # The samples that fit before the end of the buffer
+    input_history[position:position + first_part] = frame[:first_part]
+    output_history[position:position + first_part] = output[:first_part]
+    input_history[:num_samples - first_part] = frame[first_part:] # Wrap the rest to the start of the buffer
+    output_history[:num_samples - first_part] = output[first_part:]
+
+    filter_state['history_position'] = (position + num_samples) % history_size
+    filter_state['num_samples'] += num_samples
+
+
+
+#
+# Metric functions
+#
+def getLatencyPercentiles(filter_state, percentiles=(50, 90, 99, 99.9)):
+    """Return a dictionary of each percentile of the recent frame processing latencies, in seconds"""
+
+    num_latencies = min(filter_state['num_frames'], len(filter_state['latencies']))
+    if num_latencies == 0:
+        return {percentile: np.nan for percentile in percentiles}
+    latencies = filter_state['latencies'][:num_latencies]
+
+    return {percentile: float(np.percentile(latencies, percentile)) for percentile in percentiles}
+
+
+
+def calculateGroupDelay(filter_state, frequencies):
+    """Calculate and return the group delay of the filter, in seconds, at each frequency (Hz)"""
+
+    if filter_state['kind'] == 'iir':
+        transfer_function = sos2tf(filter_state['sos']) # Low order, so the polynomials are well conditioned
+    else:
+        transfer_function = (filter_state['filter_array'], 1)
+
+    freq, delay = group_delay(transfer_function, w=np.atleast_1d(frequencies), fs=filter_state['sample_rate'])
+
+    return delay / filter_state['sample_rate'] # Convert from samples to seconds
+
+
+
+#
+# Simulated source functions
+#
+def replayRecording(filename, sample_rate, frame_size=DEFAULT_FRAME_SIZE, realtime=True):
+    """Yield the samples of a recording in frames of frame_size. If realtime is True each frame is only released
+    once the wall-clock time of its last sample has passed, simulating a live source"""
+
+    start_time = time.perf_counter()
+    num_samples = 0
+
+    for frame in importDataBlocks(filename, frame_size): # Read one frame at a time
+        num_samples += len(frame)
+        if realtime: # Wait until the frame would have been recorded
+            delay = start_time + num_samples / sample_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield frame
+
+
+
+def runRealTimeFilter(filter_state, frames, output_callback=None):
+    """Filter every frame from a source as it arrives, passing each filtered frame view to output_callback"""
+
+    for frame in frames:
+        output = processFrame(filter_state, frame)
+        if output_callback is not None:
+            output_callback(output)
+
+    return filter_state
+
+
+
+# Run a simulated real-time service if called
+if __name__ == '__main__':
+    filename = 'enel420_grp_18.txt' # The recording to replay
+    sample_rate = 1024 # Sample rate of data (Hz)
+    cutoff = [57.755, 88.824] # Frequencies to attenuate (Hz)
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5 # Seconds of the recording to replay
+    frame_size = 32
+
+    iir_state = createRealTimeIIRFilter(createIIRNotchSOS(cutoff, 5, [10, 10], sample_rate), sample_rate, frame_size)
+    fir_state = createRealTimeFIRFilter(createWindowFilters(cutoff, sample_rate, 5, 399)[2], sample_rate, frame_size)
+    num_frames = int(duration * sample_rate / frame_size)
+
+    for frame_number, frame in enumerate(replayRecording(filename, sample_rate, frame_size)):
+        if frame_number >= num_frames:
+            break
+        processFrame(iir_state, frame)
+        processFrame(fir_state, frame)
+
+    for name, filter_state in [('IIR notch', iir_state), ('FIR window', fir_state)]:
+        latency = getLatencyPercentiles(filter_state)
+        print('{} filter: {} frames, latency p50 {:.1f} us, p99 {:.1f} us, group delay at 10 Hz {:.1f} ms'.format(
+            name, filter_state['num_frames'], latency[50] * 1e6, latency[99] * 1e6,
+            calculateGroupDelay(filter_state, 10)[0] * 1e3))
@@ -0,0 +1,189 @@
+"""
+    resultsStore.py
+    Contains the results store functions for ENEL420-20S2 Assignment 1.
+    The filtered signals, spectra and noise power of each record are saved to their own
+    folder in the store, so they can be re-plotted or re-analysed without re-running the
+    pipeline. Signals are saved in chunks, as float64 or float32. Uncompressed signals are
+    one .npy file, read by memory mapping, and compressed signals are an .npz file with one
+    member per chunk, so reading a time range only loads (or decompresses) the chunks it needs.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import hashlib
+import json
+import os
+import zipfile
+import numpy as np
+from configFiles import createClean
+from instrumentation import instrumentStage
+
+
+# Global variables
+STORE_CHUNK_SIZE = 1 << 16 # The number of samples saved (and read) at a time
+STORE_DTYPES = ['float64', 'float32'] # The formats signals can be saved in
+METADATA_FILENAME = 'metadata.json' # The file describing each record's results
+RECORD_HASH_LENGTH = 8 # The number of hex digits of the data file's path hash added to each record's name
+SPECTRA_FILENAME = 'spectra.npz' # The file holding each record's spectra
+
+
+
+#
+# Writing functions
+#
+@instrumentStage()
+def saveRecordResults(location, record_name, signals, spectra=None, noise_power=None, dtype='float32', compress=False,
+                      chunk_size=STORE_CHUNK_SIZE, source=None):
+    """Save the results of one record to its own folder in the store at location, replacing any previous results
+    for the record, and return the folder. signals is a dictionary of each signal's (samples, sample rate), with
+    samples along the last axis, spectra a dictionary of each spectrum's (frequencies, amplitudes), and noise_power
+    a dictionary of each filter's noise power. Signals are saved as dtype ('float64' or 'float32'), compressed if
+    compress is True. source is the data file the results came from, recorded in the metadata"""
+
+    if dtype not in STORE_DTYPES:
+        raise ValueError('Unsupported results store format ' + str(dtype))
+    if not os.path.isdir(location):
+        os.makedirs(location) # Create the store the first time it is used
+
+    record_location = createClean(getRecordLocation(location, record_name), directory=True)
+    metadata = {'record': record_name, 'source': source, 'signals': {}, 'spectra': [], 'noise_power': {}}
+
+    # Save each signal in chunks
+    for signal_name, (samples, sample_rate) in signals.items():
+        metadata['signals'][signal_name] = saveSignal(record_location, signal_name, samples, sample_rate, dtype, compress, chunk_size)
+
+    # Save the spectra together, as they are small and read whole
+    if spectra:
+        spectra_arrays = {}
+        for spectrum_name, (frequencies, amplitudes) in spectra.items():
+            spectra_arrays[spectrum_name + ' frequencies'] = np.asarray(frequencies, dtype=dtype)
+            spectra_arrays[spectrum_name + ' amplitudes'] = np.asarray(amplitudes, dtype=dtype)
+        (np.savez_compressed if compress else np.savez)(os.path.join(record_location, SPECTRA_FILENAME), **spectra_arrays)
+        metadata['spectra'] = list(spectra)
+
+    # Save the noise power as plain numbers, with the description of every signal
+    for filter_name, filter_noise_power in (noise_power or {}).items():
+        metadata['noise_power'][filter_name] = np.asarray(filter_noise_power).tolist()
+    with open(os.path.join(record_location, METADATA_FILENAME), 'w') as outputfile:
+        json.dump(metadata, outputfile, indent=1)
+
+    return record_location
+
+
+
+def saveSignal(record_location, signal_name, samples, sample_rate, dtype, compress, chunk_size):
+    """Save one signal to a record's folder a chunk at a time, so only one chunk is ever converted at once, and
+    return its description for the record's metadata"""
+
+    samples = np.asarray(samples)
+    num_samples = samples.shape[-1]
+    description = {'sample_rate': float(sample_rate), 'shape': list(samples.shape), 'dtype': dtype, 'compressed': compress,
+                   'chunk_size': chunk_size}
+
+    if not compress: # One .npy file, which can be memory mapped when read
+        description['filename'] = signal_name + '.npy'
+        saved = np.lib.format.open_memmap(os.path.join(record_location, description['filename']), mode='w+', dtype=dtype,
+                                          shape=samples.shape)
+        for start in range(0, num_samples, chunk_size):
+            saved[..., start:start + chunk_size] = samples[..., start:start + chunk_size]
+        saved.flush()
+        del saved # Close the memory map
+        return description
+
+    # One .npz member per chunk, so a time range only decompresses the chunks it covers
+    description['filename'] = signal_name + '.npz'
+    with zipfile.ZipFile(os.path.join(record_location, description['filename']), 'w', compression=zipfile.ZIP_DEFLATED) as outputfile:
+        for chunk, start in enumerate(range(0, num_samples, chunk_size)):
+            with outputfile.open(getChunkName(chunk) + '.npy', 'w', force_zip64=True) as chunkfile:
+                np.lib.format.write_array(chunkfile, np.ascontiguousarray(samples[..., start:start + chunk_size], dtype=dtype))
+
+    return description
+
+
+
+def getRecordName(filename):
+    """Return the name a data file's results are saved under: the file's name followed by a hash of its full path, so
+    recordings with the same name in different folders are saved to different records"""
+
+    path_hash = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:RECORD_HASH_LENGTH]
+
+    return os.path.splitext(os.path.basename(filename))[0] + '_' + path_hash
+
+
+
+#
+# Reading functions
+#
+def getRecordLocation(location, record_name):
+    """Return the folder a record's results are saved to in the store at location"""
+
+    return os.path.join(location, record_name)
+
+
+
+def getChunkName(chunk):
+    """Return the name of a chunk in a compressed signal file"""
+
+    return 'chunk_{:08d}'.format(chunk)
+
+
+
+def listRecords(location):
+    """Return the names of every record with results in the store at location"""
+
+    return sorted(name for name in os.listdir(location)
+                  if os.path.exists(os.path.join(location, name, METADATA_FILENAME)))
+
+
+
+def loadRecordInfo(location, record_name):
+    """Return the metadata of a record's results: the description of each signal (sample rate, shape, format and
+    file), the names of the spectra, and the noise power"""
+
+    with open(os.path.join(getRecordLocation(location, record_name), METADATA_FILENAME)) as inputfile:
+        return json.load(inputfile)
+
+
+
+@instrumentStage()
+def readSignal(location, record_name, signal_name, start_time=0, stop_time=None):
+    """Read and return the samples of a saved signal from start_time to stop_time (s), or to the end if stop_time is
+    None. Only the samples in the range are read: uncompressed signals are memory mapped and sliced, and compressed
+    signals only have the chunks covering the range decompressed"""
+
+    description = loadRecordInfo(location, record_name)['signals'][signal_name]
+    filename = os.path.join(getRecordLocation(location, record_name), description['filename'])
+    num_samples = description['shape'][-1]
+
+    # Convert the time range to a sample range within the signal
+    start = min(max(int(np.floor(start_time * description['sample_rate'])), 0), num_samples)
+    stop = num_samples if stop_time is None else min(max(int(np.ceil(stop_time * description['sample_rate'])), start), num_samples)
+
+    if stop == start: # Nothing to read
+        return np.zeros(description['shape'][:-1] + [0], dtype=description['dtype'])
+
+    if not description['compressed']:
+        saved = np.load(filename, mmap_mode='r')
+        return np.array(saved[..., start:stop]) # Copy the range, so the file is not held open
+
+    # Decompress each chunk the range covers, and trim the first and last
+    chunk_size = description['chunk_size']
+    first_chunk = start // chunk_size
+    last_chunk = max(first_chunk, (stop - 1) // chunk_size)
+    with np.load(filename) as saved:
+        chunks = [saved[getChunkName(chunk)] for chunk in range(first_chunk, last_chunk + 1)]
+    offset = first_chunk * chunk_size
+
+    return np.concatenate(chunks, axis=-1)[..., start - offset:stop - offset]
+
+
+
+def readSpectrum(location, record_name, spectrum_name):
+    """Read and return the (frequencies, amplitudes) of a saved spectrum"""
+
+    with np.load(os.path.join(getRecordLocation(location, record_name), SPECTRA_FILENAME)) as saved:
+        return saved[spectrum_name + ' frequencies'], saved[spectrum_name + ' amplitudes']
@@ -10,39 +10,157 @@
 """
 
 # Imported libraries
-from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve
-from scipy.fft import fft
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import os
+from scipy.signal import freqz, lfilter, firwin, remez, firwin2, convolve, get_window
+from scipy.fft import fft, rfft, rfftfreq, next_fast_len
+from matplotlib import rcParams
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.lines import Line2D
 import matplotlib.patches as mpatches
 import numpy as np
 from configFiles import *
+from instrumentation import instrumentStage
 
 
 # Global variables
 TIME_LINE_WIDTH = 0.5 # The linewidth of the time domain plots
 SPECTRUM_LINE_WIDTH = 0.2 # The linewidth of the signal spectrum plots
 FILTER_LINE_WIDTH = 1.7 # The linewidth of filter response plots
+PLOT_BUCKETS_PER_PIXEL = 4 # Min/max buckets per horizontal pixel, enough for antialiased line density to match the full trace
+WELCH_BATCH_SIZE = 256 # The number of Welch segments transformed at a time, bounding temporary memory
 
 
 # Functions
 
-def calcFreqSpectrum(samples, sample_rate):
-    """Compute and return the frequency spectrum of the input samples, for the specified sample rate. Used to plot frequency spectrum."""
+@instrumentStage()
+def calcFreqSpectrum(samples, sample_rate, segment_size=None):
+    """Compute and return the frequency spectrum of the input samples, for the specified sample rate, from 0 Hz to
+    the Nyquist frequency. Used to plot frequency spectrum. If segment_size is given, a Welch averaged amplitude
+    spectrum is returned instead, which needs memory proportional to segment_size rather than the recording length"""
 
-    freq_data = np.abs(fft(samples)) # Apply FFT to data
-    freq = np.linspace(0, sample_rate, len(freq_data)) # Create an array of frequencies to be plotted
+    if segment_size is not None: # Average the spectra of short segments
+        return calcWelchSpectrum([samples], sample_rate, segment_size)
+
+    fft_size = next_fast_len(len(samples), real=True) # Zero pad to a length the FFT is fast for
+    freq_data = np.abs(rfft(samples, fft_size)) # Apply a real FFT to data, giving only the bins up to Nyquist
+    freq = rfftfreq(fft_size, 1 / sample_rate) # Create an array of frequencies to be plotted
     return freq, freq_data
 
+
+
+def calcWelchSpectrum(blocks, sample_rate, segment_size):
+    """Compute and return the Welch averaged amplitude spectrum (the square root of the power spectral density) of
+    blocks of samples, using Hann windowed segments that overlap by half. Blocks are consumed one at a time, so the
+    spectrum of an arbitrarily long recording is computed in bounded memory"""
+
+    step = segment_size - segment_size // 2 # The number of samples between the start of each segment
+    window = get_window('hann', segment_size) # Segment window
+    power_sum = np.zeros(segment_size // 2 + 1) # Sum of each segment's power spectrum
+    num_segments = 0
+    pending = np.empty(0) # Samples not yet covered by a complete segment
+
+    for block in blocks: # Iterate through each block of samples
+        pending = np.asarray(block) if len(pending) == 0 else np.concatenate((pending, block))
+        if len(pending) < segment_size: # Wait until a complete segment is available
+            continue
+
+        # Transform the complete segments a batch at a time
+        segments = np.lib.stride_tricks.sliding_window_view(pending, segment_size)[::step] # A view of every segment
+        for first in range(0, len(segments), WELCH_BATCH_SIZE):
+            segment_spectra = rfft(segments[first:first + WELCH_BATCH_SIZE] * window, axis=-1)
+            power_sum += np.sum(np.square(np.abs(segment_spectra)), axis=0)
+
+        num_segments += len(segments)
+        pending = pending[len(segments) * step:] # Keep the samples the next segment starts with
+
+    if num_segments == 0:
+        raise ValueError('Not enough samples for a single segment of {} samples'.format(segment_size))
+
+    # Scale the averaged power to a one sided power spectral density
+    psd = power_sum / (num_segments * sample_rate * np.sum(np.square(window)))
+    psd[1:len(psd) - (segment_size % 2 == 0)] *= 2 # Fold the negative frequencies in, except at DC and Nyquist
+    freq = rfftfreq(segment_size, 1 / sample_rate) # Create an array of frequencies to be plotted
+
+    return freq, np.sqrt(psd)
+
+
+
 def getTimeData(sample_rate, num_samples):
     """Create and return an array containing the time each sample is taken. This assumes equal sampling periods. Used to set the time axis for plotting."""
 
-    time = [] # Create an array for the results to be stored in
-    for i in range(num_samples): # Iterate through each sample
-        sample_time = i/sample_rate # Calculate the time this sample is taken
-        time.append(sample_time) # Add time to results array
+    time = np.arange(num_samples) / sample_rate # Calculate the time each sample is taken
 
     return time
 
+
+
+def decimateMinMax(x, y, num_buckets):
+    """Reduce a trace to the minimum and maximum of y within each of num_buckets equal runs of samples, in the order
+    they occur, and return the reduced x and y. With at least one bucket per pixel column this is visually identical to
+    the full trace, but has at most 2 * num_buckets + 2 points however long the trace is. The first and last samples
+    are always kept, so the reduced trace spans the same x range and reducing it again returns it unchanged"""
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    num_samples = len(y)
+    if num_samples <= 2 * num_buckets + 2: # Already small enough to plot every sample
+        return x, y
+
+    # Find the positions of the minimum and maximum of each bucket, using a view of the whole buckets
+    bucket_size = int(np.ceil(num_samples / num_buckets)) # Samples per bucket
+    num_whole = num_samples // bucket_size # Buckets that are completely filled
+    buckets = y[:num_whole * bucket_size].reshape(num_whole, bucket_size)
+    bucket_starts = np.arange(num_whole) * bucket_size
+    min_index = bucket_starts + np.argmin(buckets, axis=1)
+    max_index = bucket_starts + np.argmax(buckets, axis=1)
+
+    # Add the final partly filled bucket
+    if num_whole * bucket_size < num_samples:
+        tail_start = num_whole * bucket_size
+        min_index = np.append(min_index, tail_start + np.argmin(y[tail_start:]))
+        max_index = np.append(max_index, tail_start + np.argmax(y[tail_start:]))
+
+    # Keep both points of each bucket in time order, so the trace is drawn as it occurs
+    index = np.stack((np.minimum(min_index, max_index), np.maximum(min_index, max_index)), axis=1).ravel()
+    index = np.concatenate(([0], index, [num_samples - 1])) # Keep the ends of the trace
+
+    return x[index], y[index]
+
+
+
+def reduceForPlot(figure, x, y):
+    """Decimate a trace to a few minimum and maximum pairs per horizontal pixel of the figure it will be plotted on"""
+
+    num_pixels = int(np.ceil(figure.get_figwidth() * figure.dpi)) # Width of the figure in pixels
+
+    return decimateMinMax(x, y, num_pixels * PLOT_BUCKETS_PER_PIXEL)
+
+
+
+def reduceForFigure(x, y, figsize=None):
+    """Decimate a trace to the points reduceForPlot keeps on a figure made by createFigure with the same figsize, so
+    a long trace can be reduced before it is sent to the process that draws it, which then plots it unchanged"""
+
+    width = (figsize or rcParams['figure.figsize'])[0] # Width of the figure in inches
+    num_pixels = int(np.ceil(width * rcParams['figure.dpi'])) # Width of the figure in pixels, as reduceForPlot finds it
+
+    return decimateMinMax(x, y, num_pixels * PLOT_BUCKETS_PER_PIXEL)
+
+
+
+def createFigure(figsize=None):
+    """Create and return a figure drawn by the Agg backend. The figure is not registered with pyplot, so it is freed
+    as soon as it is no longer used, and figures can be created in several processes at once"""
+
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure) # Attach the non-interactive Agg renderer
+
+    return figure
+
+
+
 def saveFigures(figures, figures_location, figure_names):
     """Save a list of figures as the corresponding name"""
 
@@ -50,8 +168,41 @@ def saveFigures(figures, figures_location, figure_names):
 
     # Iterate through each figure saving it as the corresponding name
     for i in range(len(figures)):
-        plt.figure(figures[i].number) # Set the figure as the current figure
-        plt.savefig(output_path + '/' + figure_names[i]) # Save the current figure
+        figures[i].savefig(output_path + '/' + figure_names[i]) # Save the figure
+
+
+
+def renderFigure(figure_job):
+    """Create one figure from a (figure name, plot function, plot arguments, output path, formats, dpi) job, save it
+    in every format and free it. Returns the saved filenames. Used as the worker of renderFigures"""
+
+    figure_name, plot_function, plot_arguments, output_path, formats, dpi = figure_job
+
+    figure = plot_function(*plot_arguments) # Draw the figure
+    filenames = []
+    for file_format in formats: # Save the figure in each format
+        filename = os.path.join(output_path, figure_name + '.' + file_format)
+        figure.savefig(filename, format=file_format, dpi=dpi)
+        filenames.append(filename)
+    figure.clear() # Free the figure's artists as soon as it is written
+
+    return filenames
+
+
+
+@instrumentStage()
+def renderFigures(figure_jobs, figures_location, formats=('png',), dpi=100, num_workers=None):
+    """Create and save each (figure name, plot function, plot arguments) figure job over a pool of num_workers
+    processes (all cores if None), so each worker holds only one figure at a time. Returns the saved filenames"""
+
+    output_path = createClean(figures_location, True) # Create a clear output path for figures to be stored in
+    jobs = [(figure_name, plot_function, plot_arguments, output_path, formats, dpi)
+            for figure_name, plot_function, plot_arguments in figure_jobs]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        filenames = [filename for job_filenames in pool.map(renderFigure, jobs) for filename in job_filenames]
+
+    return filenames
 
 
 #
@@ -60,12 +211,14 @@ def saveFigures(figures, figures_location, figure_names):
 def plotECG(samples, time):
     """Plot a time domain graph of the ECG data"""
 
-    ECG = plt.figure()
-    plt.plot(time, samples, linewidth=TIME_LINE_WIDTH)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Amplitude (µV)")
-    plt.suptitle("Time domain ECG signal")
-    plt.xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+    ECG = createFigure()
+    axis = ECG.subplots()
+    plot_time, plot_samples = reduceForPlot(ECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    ECG.suptitle("Time domain ECG signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
 
     return ECG
 
@@ -74,12 +227,14 @@ def plotECG(samples, time):
 def plotECGSpectrum(frequency, frequency_data):
     """Calculate and plot the frequency spectrum of the ECG"""
 
-    ECGSpectrum = plt.figure()
-    plt.plot(frequency, 20 * np.log10(abs(frequency_data)), linewidth=SPECTRUM_LINE_WIDTH)
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude (dB)")
-    plt.suptitle("Frequency Spectrum of the ECG signal")
-    plt.xlim(frequency[0], frequency[-1]/2) # Limit the x axis to locations with data points
+    ECGSpectrum = createFigure()
+    axis = ECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(ECGSpectrum, frequency, abs(frequency_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log10(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    ECGSpectrum.suptitle("Frequency Spectrum of the ECG signal")
+    axis.set_xlim(frequency[0], frequency[-1]) # Limit the x axis to locations with data points
 
     return ECGSpectrum
 
@@ -96,20 +251,21 @@ def plotIIRPoleZero(cutoffs, notch_width, f_samp):
     circle_radius = 1  # The unit circle has a radius of 1 by definition
 
     # Create figure
-    circle_fig, axis = plt.subplots(figsize=(6, 6))  # Create plot
-    plt.xlim([circle_centre[0] - 1, circle_centre[0] + 1])
-    plt.ylim([circle_centre[1] - 1, circle_centre[1] + 1])
+    circle_fig = createFigure(figsize=(6, 6))  # Create plot
+    axis = circle_fig.subplots()
+    axis.set_xlim([circle_centre[0] - 1, circle_centre[0] + 1])
+    axis.set_ylim([circle_centre[1] - 1, circle_centre[1] + 1])
 
     # Define pole/zero magnitudes
     zeros_magnitude = 1  # Place the zeros on the unit circle for maximum attenuation
     poles_magnitude = 1 - np.pi * (notch_width/f_samp)  # Calculate the optimal magnitude for the pole pairs
 
     # Create real and imaginary axis on graph
-    real_axis = plt.Line2D([circle_centre[0] - 2, circle_centre[0] + 2], [0, 0], color='black')
-    imag_axis = plt.Line2D([0, 0], [[circle_centre[1] - 2, circle_centre[1] + 2]], color='black')
+    real_axis = Line2D([circle_centre[0] - 2, circle_centre[0] + 2], [0, 0], color='black')
+    imag_axis = Line2D([0, 0], [[circle_centre[1] - 2, circle_centre[1] + 2]], color='black')
 
     # Plot unit circle
-    circle = plt.Circle(circle_centre, circle_radius, color ='black', fill=False, label='Unit circle') # Create circle
+    circle = mpatches.Circle(circle_centre, circle_radius, color ='black', fill=False, label='Unit circle') # Create circle
     axis = circle_fig.gca() # Create plot axis
     axis.add_artist(circle) # Add unit circle to figure
     axis.add_artist(real_axis)
@@ -126,8 +282,8 @@ def plotIIRPoleZero(cutoffs, notch_width, f_samp):
         pole_y_postion = poles_magnitude * np.sin(angle) # Calculate pole position in imaginary (y) axis
 
         # Plot lines between the origin and poles/zeros
-        zero_line = plt.Line2D([circle_centre[0], zero_x_postion], [circle_centre[1], zero_y_postion], color='grey', linestyle='--')
-        conjugate_zero_line = plt.Line2D([circle_centre[0], zero_x_postion], [circle_centre[1], -zero_y_postion], color='grey', linestyle='--')
+        zero_line = Line2D([circle_centre[0], zero_x_postion], [circle_centre[1], zero_y_postion], color='grey', linestyle='--')
+        conjugate_zero_line = Line2D([circle_centre[0], zero_x_postion], [circle_centre[1], -zero_y_postion], color='grey', linestyle='--')
         axis.add_artist(zero_line)
         axis.add_artist(conjugate_zero_line)
 
@@ -138,13 +294,13 @@ def plotIIRPoleZero(cutoffs, notch_width, f_samp):
         axis.plot([zero_x_postion], [-zero_y_postion], marker='o', color='blue', label='zero')
 
     # Label figure
-    plt.xlabel('Real{Z}')
-    plt.ylabel('Imag{Z}')
+    axis.set_xlabel('Real{Z}')
+    axis.set_ylabel('Imag{Z}')
 
     # Create legend
     zero_patch = mpatches.Patch(color='blue', hatch='o', label='Zeros')
     pole_patch = mpatches.Patch(color='red', hatch='x', label='Poles')
-    plt.legend(handles=[zero_patch, pole_patch, circle], loc='upper left')
+    axis.legend(handles=[zero_patch, pole_patch, circle], loc='upper left')
 
     return circle_fig
 
@@ -153,12 +309,14 @@ def plotIIRPoleZero(cutoffs, notch_width, f_samp):
 def plotIIRNotchECG(samples, time):
     """Plot a time domain graph of the IIR notch filtered ECG data"""
 
-    IIRNotchECG = plt.figure()
-    plt.plot(time, samples, linewidth=TIME_LINE_WIDTH)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Amplitude (µV)")
-    plt.suptitle("Time domain IIR Notch Filtered ECG signal")
-    plt.xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+    IIRNotchECG = createFigure()
+    axis = IIRNotchECG.subplots()
+    plot_time, plot_samples = reduceForPlot(IIRNotchECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    IIRNotchECG.suptitle("Time domain IIR Notch Filtered ECG signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
 
     return IIRNotchECG
 
@@ -167,12 +325,14 @@ def plotIIRNotchECG(samples, time):
 def plotIIRNotchECGSpectrum(notch_frequency, notch_freq_data):
     """Calculate and plot the frequency spectrum of the ECG after filtering with an IIR notch filter"""
 
-    IIRNotchECGSpectrum = plt.figure()
-    plt.plot(notch_frequency, 20 * np.log(abs(notch_freq_data)), linewidth=SPECTRUM_LINE_WIDTH)
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude (dB)")
-    plt.suptitle("Frequency Spectrum of the IIR Notch Filtered ECG signal")
-    plt.xlim(notch_frequency[0], notch_frequency[-1]/2)  # Limit the x axis to locations with data points
+    IIRNotchECGSpectrum = createFigure()
+    axis = IIRNotchECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(IIRNotchECGSpectrum, notch_frequency, abs(notch_freq_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    IIRNotchECGSpectrum.suptitle("Frequency Spectrum of the IIR Notch Filtered ECG signal")
+    axis.set_xlim(notch_frequency[0], notch_frequency[-1])  # Limit the x axis to locations with data points
 
     return IIRNotchECGSpectrum
 
@@ -185,9 +345,10 @@ def plotIIRNotchFilterResponse(numerator, denominator, f_samp):
     freq, response = freqz(numerator, denominator, fs=f_samp)
 
     # Create plot
-    IIRNotchFilterResponse, (IIR_ax1, IIR_ax2) = plt.subplots(2, 1)
-    plt.suptitle("IIR Notch Filter Frequency Response")
-    plt.xlabel("Frequency (Hz)")
+    IIRNotchFilterResponse = createFigure()
+    (IIR_ax1, IIR_ax2) = IIRNotchFilterResponse.subplots(2, 1)
+    IIRNotchFilterResponse.suptitle("IIR Notch Filter Frequency Response")
+    IIR_ax2.set_xlabel("Frequency (Hz)")
 
     # Plot magnitude response
     IIR_ax1.plot(freq, 20 * np.log(abs(response))) # Plot magnitude in dB vs Hz
@@ -203,18 +364,55 @@ def plotIIRNotchFilterResponse(numerator, denominator, f_samp):
 
 
 
+#
+# Adaptive Notch Filtered Plots
+#
+def plotAdaptiveNotchECG(samples, time):
+    """Plot a time domain graph of the adaptive notch filtered ECG data"""
+
+    adaptiveNotchECG = createFigure()
+    axis = adaptiveNotchECG.subplots()
+    plot_time, plot_samples = reduceForPlot(adaptiveNotchECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    adaptiveNotchECG.suptitle("Time domain Adaptive Notch Filtered ECG signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+
+    return adaptiveNotchECG
+
+
+
+def plotAdaptiveNotchECGSpectrum(notch_frequency, notch_freq_data):
+    """Calculate and plot the frequency spectrum of the ECG after filtering with the adaptive notch filters"""
+
+    adaptiveNotchECGSpectrum = createFigure()
+    axis = adaptiveNotchECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(adaptiveNotchECGSpectrum, notch_frequency, abs(notch_freq_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    adaptiveNotchECGSpectrum.suptitle("Frequency Spectrum of the Adaptive Notch Filtered ECG signal")
+    axis.set_xlim(notch_frequency[0], notch_frequency[-1])  # Limit the x axis to locations with data points
+
+    return adaptiveNotchECGSpectrum
+
+
+
 #
 # Window Filtered Plots
 #
 def plotWindowedECG(samples, time):
     """Plot a time domain graph of the window filtered ECG data"""
 
-    WindowedECG = plt.figure()
-    plt.plot(time, samples, linewidth=TIME_LINE_WIDTH)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Amplitude (µV)")
-    plt.suptitle("Time Domain Window Filtered ECG Signal")
-    plt.xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+    WindowedECG = createFigure()
+    axis = WindowedECG.subplots()
+    plot_time, plot_samples = reduceForPlot(WindowedECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    WindowedECG.suptitle("Time Domain Window Filtered ECG Signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
 
     return WindowedECG
 
@@ -223,12 +421,14 @@ def plotWindowedECG(samples, time):
 def plotWindowedECGSpectrum(frequency, frequency_data):
     """Calculate and plot the window filtered ECG frequency spectrum"""
 
-    WindowedECGSpectrum = plt.figure()
-    plt.plot(frequency, 20 * np.log10(abs(frequency_data)), linewidth=SPECTRUM_LINE_WIDTH)
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude (dB)")
-    plt.suptitle("Frequency Spectrum of the Window Filtered ECG Signal")
-    plt.xlim(frequency[0], frequency[-1]/2) # Limit the x axis from 0 to Nyquist frequency
+    WindowedECGSpectrum = createFigure()
+    axis = WindowedECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(WindowedECGSpectrum, frequency, abs(frequency_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log10(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    WindowedECGSpectrum.suptitle("Frequency Spectrum of the Window Filtered ECG Signal")
+    axis.set_xlim(frequency[0], frequency[-1]) # Limit the x axis from 0 to Nyquist frequency
 
     return WindowedECGSpectrum
 
@@ -241,9 +441,10 @@ def plotWindowFilterResponse(filter_array, f_samp):
      freq, response = freqz(filter_array, fs=f_samp)
 
      # Create plot
-     WindowFilterResponse, (window_ax1, window_ax2) = plt.subplots(2, 1)
-     plt.suptitle("Window Filter Frequency Response")
-     plt.xlabel("Frequency (Hz)")
+     WindowFilterResponse = createFigure()
+     (window_ax1, window_ax2) = WindowFilterResponse.subplots(2, 1)
+     WindowFilterResponse.suptitle("Window Filter Frequency Response")
+     window_ax2.set_xlabel("Frequency (Hz)")
 
      # Plot magnitude response
      window_ax1.plot(freq, 20 * np.log10(abs(response)), linewidth=FILTER_LINE_WIDTH)  # Plot magnitude in dB vs Hz
@@ -264,12 +465,14 @@ def plotWindowFilterResponse(filter_array, f_samp):
 def plotOptimalECG(samples, time):
     """Plot a time domain graph of the window filtered ECG data"""
 
-    OptimalECG = plt.figure()
-    plt.plot(time, samples, linewidth=TIME_LINE_WIDTH)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Amplitude (µV)")
-    plt.suptitle("Time Domain Optimal Filtered ECG Signal")
-    plt.xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+    OptimalECG = createFigure()
+    axis = OptimalECG.subplots()
+    plot_time, plot_samples = reduceForPlot(OptimalECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    OptimalECG.suptitle("Time Domain Optimal Filtered ECG Signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
 
     return OptimalECG
 
@@ -278,12 +481,14 @@ def plotOptimalECG(samples, time):
 def plotOptimalECGSpectrum(frequency, frequency_data):
     """Calculate and plot the window filtered ECG frequency spectrum"""
 
-    OptimalECGSpectrum = plt.figure()
-    plt.plot(frequency, 20 * np.log10(abs(frequency_data)), linewidth=SPECTRUM_LINE_WIDTH)
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude (dB)")
-    plt.suptitle("Frequency Spectrum of the Optimal Filtered ECG Signal")
-    plt.xlim(frequency[0], frequency[-1]/2) # Limit the x axis from 0 to Nyquist frequency
+    OptimalECGSpectrum = createFigure()
+    axis = OptimalECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(OptimalECGSpectrum, frequency, abs(frequency_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log10(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    OptimalECGSpectrum.suptitle("Frequency Spectrum of the Optimal Filtered ECG Signal")
+    axis.set_xlim(frequency[0], frequency[-1]) # Limit the x axis from 0 to Nyquist frequency
 
     return OptimalECGSpectrum
 
@@ -296,9 +501,10 @@ def plotOptimalFilterResponse(filter_array, f_samp):
      freq, response = freqz(filter_array, fs=f_samp)
 
      # Create plot
-     OptimalFilterResponse, (optimal_ax1, optimal_ax2) = plt.subplots(2, 1)
-     plt.suptitle("Optimal Filter Frequency Response")
-     plt.xlabel("Frequency (Hz)")
+     OptimalFilterResponse = createFigure()
+     (optimal_ax1, optimal_ax2) = OptimalFilterResponse.subplots(2, 1)
+     OptimalFilterResponse.suptitle("Optimal Filter Frequency Response")
+     optimal_ax2.set_xlabel("Frequency (Hz)")
 
      # Plot magnitude response
      optimal_ax1.plot(freq, 20 * np.log10(abs(response)), linewidth=FILTER_LINE_WIDTH)  # Plot magnitude in dB vs Hz
@@ -320,12 +526,14 @@ def plotOptimalFilterResponse(filter_array, f_samp):
 def plotFrequencySampledECG(samples, time):
     """Plot a time domain graph of the Frequency Sampling filtered ECG data"""
 
-    freqSampledECG = plt.figure()
-    plt.plot(time, samples, linewidth=TIME_LINE_WIDTH)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Amplitude (µV)")
-    plt.suptitle("Time Domain Frequency Sampling Filtered ECG Signal")
-    plt.xlim(time[0], time[-1]) # Limit the x axis to locations with data points
+    freqSampledECG = createFigure()
+    axis = freqSampledECG.subplots()
+    plot_time, plot_samples = reduceForPlot(freqSampledECG, time, samples) # Only plot the points that can be seen
+    axis.plot(plot_time, plot_samples, linewidth=TIME_LINE_WIDTH)
+    axis.set_xlabel("Time (s)")
+    axis.set_ylabel("Amplitude (µV)")
+    freqSampledECG.suptitle("Time Domain Frequency Sampling Filtered ECG Signal")
+    axis.set_xlim(time[0], time[-1]) # Limit the x axis to locations with data points
 
     return freqSampledECG
 
@@ -334,12 +542,14 @@ def plotFrequencySampledECG(samples, time):
 def plotFrequencySampledECGSpectrum(frequency, frequency_data):
     """Calculate and plot the Frequency Sampling filtered ECG frequency spectrum"""
 
-    FreqECGSpectrum = plt.figure()
-    plt.plot(frequency, 20 * np.log10(abs(frequency_data)), linewidth=SPECTRUM_LINE_WIDTH)
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude (dB)")
-    plt.suptitle("Frequency Spectrum of the Frequency Sampling Filtered ECG Signal")
-    plt.xlim(frequency[0], frequency[-1]/2) # Limit the x axis from 0 to Nyquist frequency
+    FreqECGSpectrum = createFigure()
+    axis = FreqECGSpectrum.subplots()
+    plot_frequency, plot_freq_data = reduceForPlot(FreqECGSpectrum, frequency, abs(frequency_data)) # Only plot the points that can be seen
+    axis.plot(plot_frequency, 20 * np.log10(plot_freq_data), linewidth=SPECTRUM_LINE_WIDTH)
+    axis.set_xlabel("Frequency (Hz)")
+    axis.set_ylabel("Amplitude (dB)")
+    FreqECGSpectrum.suptitle("Frequency Spectrum of the Frequency Sampling Filtered ECG Signal")
+    axis.set_xlim(frequency[0], frequency[-1]) # Limit the x axis from 0 to Nyquist frequency
 
     return FreqECGSpectrum
 
@@ -352,9 +562,10 @@ def plotFrequencySampledFilterResponse(filter_array, f_samp):
      freq, response = freqz(filter_array, fs=f_samp)
 
      # Create plot
-     FreqFilterResponse, (freq_ax1, freq_ax2) = plt.subplots(2, 1)
-     plt.suptitle("Frequency Sampling Filter Frequency Response")
-     plt.xlabel("Frequency (Hz)")
+     FreqFilterResponse = createFigure()
+     (freq_ax1, freq_ax2) = FreqFilterResponse.subplots(2, 1)
+     FreqFilterResponse.suptitle("Frequency Sampling Filter Frequency Response")
+     freq_ax2.set_xlabel("Frequency (Hz)")
 
      # Plot magnitude response
      freq_ax1.plot(freq, 20 * np.log10(abs(response)), linewidth=FILTER_LINE_WIDTH)  # Plot magnitude in dB vs Hz
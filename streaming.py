@@ -0,0 +1,194 @@
+"""
+    streaming.py
+    Contains the streaming (block by block) filter functions for ENEL420-20S2 Assignment 1.
+    The filter state is carried from one block to the next, so the streamed output matches
+    filtering the whole recording at once sample for sample, while only one block is held
+    in memory at a time.
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+from itertools import tee
+from scipy.signal import lfilter, sosfilt, oaconvolve
+import numpy as np
+from IIR import createSOSCascade
+from FIR import chooseFIRMethod
+from noise import createFilterNoiseStages, createNoisePowerAccumulator, accumulateNoisePower, accumulateNoisePowerStats, \
+                  calculateAccumulatedNoisePower, calculateBlockStats
+from compiledKernels import useCompiledKernels, sosStatsKernel
+
+
+#
+# Block functions
+#
+def createDataBlocks(samples, block_size):
+    """Split an in-memory array of samples into a generator of blocks of block_size samples. Used to stream data
+    that has already been loaded through the same functions as a file or live feed"""
+
+    samples = np.asarray(samples) # Slicing a numpy array returns views, so no samples are copied
+    for start in range(0, len(samples), block_size): # Iterate through the start of each block
+        yield samples[start:start + block_size]
+
+
+
+def collectBlocks(blocks):
+    """Join a generator of blocks back into a single array. Only needed when the full result must be in memory"""
+
+    return np.concatenate(list(blocks))
+
+
+
+#
+# Streaming filter functions
+#
+def createFilterState(numerator, denominator):
+    """Create and return the initial state (zi) of a filter. The state is zero, which matches the initial rest
+    condition that lfilter uses when filtering a whole recording at once"""
+
+    num_states = max(len(np.atleast_1d(numerator)), len(np.atleast_1d(denominator))) - 1 # One state per delay element
+
+    return np.zeros(num_states)
+
+
+
+def streamFilter(numerator, denominator, blocks):
+    """Pass each block of data through a filter, carrying the filter state across blocks, and yield each filtered block"""
+
+    state = createFilterState(numerator, denominator) # Start the filter at rest
+
+    for block in blocks: # Iterate through each block of samples
+        filtered_block, state = lfilter(numerator, denominator, block, zi=state) # Filter the block and keep the final state
+        yield filtered_block
+
+
+
+def filterFIRBlock(filter_array, block, state, method='auto'):
+    """Pass one block of data through an FIR filter and return the filtered block and the new state. The state is
+    the part of the previous blocks' convolution that overlaps this block, which is also lfilter's state (zi) for an
+    FIR filter, so the methods can be mixed from block to block. The method is 'direct' (lfilter), 'fft' (overlap-add
+    convolution) or 'auto' to choose the cheaper for the filter and block length"""
+
+    if method == 'auto':
+        method = chooseFIRMethod(len(filter_array), len(block))
+
+    if method == 'direct':
+        return lfilter(filter_array, 1, block, zi=state)
+
+    block_size = len(block)
+    convolved = oaconvolve(block, filter_array) # Full convolution of this block, block_size + taps - 1 long
+    convolved[:len(state)] += state # Add the overlap carried from the previous blocks
+
+    return convolved[:block_size], convolved[block_size:] # Carry the overlap into the next block
+
+
+
+def streamFFTFilter(filter_array, blocks):
+    """Pass each block of data through an FIR filter using overlap-add FFT convolution, carrying the convolution
+    tail across blocks, and yield each filtered block. Best suited to long filters and blocks longer than the filter"""
+
+    tail = createFilterState(filter_array, 1) # The part of the previous blocks' convolution that overlaps the next block
+
+    for block in blocks: # Iterate through each block of samples
+        filtered_block, tail = filterFIRBlock(filter_array, block, tail, 'fft')
+        yield filtered_block
+
+
+
+def streamSOSFilter(sos, blocks):
+    """Pass each block of data through a cascade of second order sections in a single pass, carrying the state of
+    every section across blocks, and yield each filtered block"""
+
+    state = np.zeros((len(sos), 2)) # Two delay elements per section, starting at rest
+
+    for block in blocks: # Iterate through each block of samples
+        filtered_block, state = sosfilt(sos, block, zi=state) # Filter the block and keep the final state
+        yield filtered_block
+
+
+
+def streamIIRNotchFilters(numerator_1, denominator_1, numerator_2, denominator_2, blocks):
+    """Pass each block of data through two cascaded IIR filters and yield the result after each filter, matching
+    applyIIRNotchFilters on the whole recording"""
+
+    sos = createSOSCascade([(numerator_1, denominator_1), (numerator_2, denominator_2)]) # Store the notches as second order sections
+    state = np.zeros((len(sos), 2)) # Two delay elements per section, starting at rest
+
+    for block in blocks: # Iterate through each block of samples
+        partially_filtered_block, state[0] = sosfilt(sos[0:1], block, zi=state[0:1]) # Apply first filter to block
+        filtered_block, state[1] = sosfilt(sos[1:2], partially_filtered_block, zi=state[1:2]) # Apply second filter to block
+        yield partially_filtered_block, filtered_block
+
+
+
+def streamIIRNotchStats(numerator_1, denominator_1, numerator_2, denominator_2, blocks):
+    """Pass each block of data through two cascaded IIR filters and yield the statistics (count, mean and sum of
+    squared deviations) of the block, and of the result after each filter, as a tuple. With the numba backend the
+    filtering and statistics are fused into one compiled pass, and the filtered blocks are never stored"""
+
+    sos = createSOSCascade([(numerator_1, denominator_1), (numerator_2, denominator_2)])
+    state = np.zeros((len(sos), 2)) # Two delay elements per section, starting at rest
+
+    for block in blocks: # Iterate through each block of samples
+        if useCompiledKernels():
+            stage_stats = np.zeros((len(sos) + 1, 3)) # Count, mean and sum of squared deviations of each stage
+            sosStatsKernel(sos, np.asarray(block, dtype=float), state, stage_stats)
+            yield tuple((int(count), mean, m2) for count, mean, m2 in stage_stats)
+        else:
+            partially_filtered_block, state[0] = sosfilt(sos[0:1], block, zi=state[0:1])
+            filtered_block, state[1] = sosfilt(sos[1:2], partially_filtered_block, zi=state[1:2])
+            yield calculateBlockStats(block), calculateBlockStats(partially_filtered_block), calculateBlockStats(filtered_block)
+
+
+
+def streamFIRFilters(filter_1, filter_2, filter_overall, blocks, method='auto'):
+    """Pass each block of data through two cascaded FIR filters, and a single overall filter, and yield the result
+    after each filter, matching applyFIRFilters on the whole recording. The method is 'direct', 'fft' (overlap-add)
+    or 'auto' to choose the cheaper for each filter and block, as applyFIRFilter does for a whole recording"""
+
+    state_1 = createFilterState(filter_1, 1) # State of the first FIR filter
+    state_2 = createFilterState(filter_2, 1) # State of the second FIR filter
+    state_overall = createFilterState(filter_overall, 1) # State of the overall FIR filter
+
+    for block in blocks: # Iterate through each block of samples
+        half_filtered_block, state_1 = filterFIRBlock(filter_1, block, state_1, method)
+        full_filtered_block, state_2 = filterFIRBlock(filter_2, half_filtered_block, state_2, method)
+        overall_filtered_block, state_overall = filterFIRBlock(filter_overall, block, state_overall, method)
+        yield half_filtered_block, full_filtered_block, overall_filtered_block
+
+
+
+#
+# Streaming noise power functions
+#
+def streamNoisePowerData(blocks, notch_filters, fir_filters):
+    """Pass each block of data through the IIR notch filters and every family of FIR filters, accumulating the
+    variance of the input and of each stage's output, and return the noise power of every filter from one pass over
+    the data. notch_filters is a list of two (numerator, denominator) pairs, and fir_filters a dictionary of FIR family
+    name and its (filter_1, filter_2, filter_overall). The result matches the noise power data main() saves"""
+
+    (numerator_1, denominator_1), (numerator_2, denominator_2) = notch_filters
+    families = list(fir_filters)
+    noise_stages = createFilterNoiseStages(families)
+    stage_names = {stage_name for stages in noise_stages.values() for stage_name in stages} # Every stage to accumulate
+    accumulator = createNoisePowerAccumulator(stage_names)
+
+    # Split the blocks between every filter, so the input is only read once. The streams are consumed in step, so
+    # only the current block is buffered
+    notch_blocks, *fir_blocks = tee(blocks, 1 + len(families))
+    notch_stream = streamIIRNotchStats(numerator_1, denominator_1, numerator_2, denominator_2, notch_blocks)
+    fir_streams = [streamFIRFilters(*fir_filters[family], family_blocks) for family, family_blocks in zip(families, fir_blocks)]
+
+    for (input_stats, half_notched_stats, notched_stats), *fir_outputs in zip(notch_stream, *fir_streams):
+        accumulateNoisePowerStats(accumulator, {'input': input_stats, 'IIR half': half_notched_stats, 'IIR full': notched_stats})
+        stage_blocks = {}
+        for family, (half_filtered_block, full_filtered_block, overall_filtered_block) in zip(families, fir_outputs):
+            stage_blocks[family + ' half'] = half_filtered_block
+            stage_blocks[family + ' full'] = full_filtered_block
+            stage_blocks[family + ' overall'] = overall_filtered_block
+        accumulateNoisePower(accumulator, stage_blocks)
+
+    return calculateAccumulatedNoisePower(accumulator, noise_stages)
@@ -0,0 +1,255 @@
+"""
+    test_compiledKernels.py
+    Contains the kernel and backend parity tests for ENEL420-20S2 Assignment 1.
+    Every kernel in compiledKernels.py is called directly and compared against the
+    NumPy/SciPy path that it replaces. Without Numba the kernels are the plain Python
+    functions, so these tests always run. The backend tests, which select the numba backend
+    and run each kernel through the function that uses it, are skipped when Numba is not
+    installed.
+
+    Usage: python -m pytest test_compiledKernels.py
+
+    Authors: Matt Blake   (58979250)
+             Reweti Davis (23200856)
+             Group Number: 18
+    Last Modified: 14/08/2020
+"""
+
+# Imported libraries
+import pytest
+import numpy as np
+from scipy.signal import lfilter
+from IIR import createIIRNotchFilter, createIIRNotchSOS, createSOSCascade
+from FIR import applySymmetricFIRFilter
+from noise import calculateBlockStats
+from streaming import createDataBlocks, streamIIRNotchStats
+from realTime import createRealTimeIIRFilter, processFrame
+from adaptiveNotch import applyAdaptiveNotchFilters, createAdaptiveNotchState, filterAdaptiveNotchStage
+from compiledKernels import NUMBA_AVAILABLE, getBackend, setBackend, blockStatsKernel, sosStatsKernel, sosFrameKernel, \
+                            symmetricFIRKernel, adaptiveNotchKernel
+
+
+# Global variables
+SAMPLE_RATE = 1024 # Sample rate of the test data (Hz)
+NUM_SAMPLES = 10 * SAMPLE_RATE # The length of the test recordings
+KERNEL_NUM_SAMPLES = 2 * SAMPLE_RATE # The length of the recordings the kernels are called on, short as they may be plain Python
+FRAME_SIZE = 32 # The number of samples in each real-time frame
+CUTOFF = (57.755, 88.824) # The notch frequencies (Hz) of the interference and the filters
+PARITY_TOLERANCE = 1e-14 # The largest difference allowed between the backends, relative to the largest output
+
+requiresNumba = pytest.mark.skipif(not NUMBA_AVAILABLE, reason='The numba backend needs Numba to be installed')
+
+
+
+#
+# Helper functions
+#
+def createTestECG(num_samples=NUM_SAMPLES, num_channels=None, seed=0):
+    """Create and return a pulse train with broadband noise and sinusoidal interference at each notch frequency,
+    as one signal, or as num_channels x samples if num_channels is given"""
+
+    rng = np.random.default_rng(seed)
+    time = np.arange(num_samples) / SAMPLE_RATE
+    samples = 400 * np.exp(-np.square((np.mod(time, 60 / 72) - 0.4) / 0.02)) # QRS-like pulses at 72 bpm
+    samples = samples + 10 * rng.standard_normal((num_channels or 1, num_samples)) # Broadband noise on each channel
+    for frequency in CUTOFF: # Add each narrowband interference
+        samples += 100 * np.sin(2 * np.pi * frequency * time + rng.uniform(0, 2 * np.pi))
+
+    return samples if num_channels else samples[0]
+
+
+
+def runWithBackend(backend_name, function, *args):
+    """Run a function with a backend selected, restoring the previous backend afterwards, and return its result"""
+
+    previous_backend = getBackend()
+    setBackend(backend_name)
+    try:
+        return function(*args)
+    finally:
+        setBackend(previous_backend)
+
+
+
+def assertParity(compiled_output, numpy_output, tolerance=PARITY_TOLERANCE):
+    """Assert that the kernel (or numba backend) and NumPy outputs have the same shape, and differ by at most
+    tolerance relative to the largest NumPy output"""
+
+    compiled_output = np.asarray(compiled_output, dtype=float)
+    numpy_output = np.asarray(numpy_output, dtype=float)
+    assert compiled_output.shape == numpy_output.shape
+    np.testing.assert_allclose(compiled_output, numpy_output, rtol=0, atol=tolerance * np.max(np.abs(numpy_output)))
+
+
+
+#
+# Kernel parity tests
+#
+def test_blockStatsKernel():
+    """The block statistics kernel matches the NumPy mean and sum of squared deviations of each row"""
+
+    rows = createTestECG(KERNEL_NUM_SAMPLES, num_channels=3)
+    kernel_count, kernel_mean, kernel_m2 = blockStatsKernel(rows)
+    numpy_count, numpy_mean, numpy_m2 = runWithBackend('numpy', calculateBlockStats, rows)
+
+    assert kernel_count == numpy_count
+    assertParity(kernel_mean, numpy_mean)
+    assertParity(kernel_m2, numpy_m2)
+
+
+
+def test_sosStatsKernel():
+    """The fused notch cascade and statistics kernel matches filtering with sosfilt and then measuring each stage,
+    with the section states carried across blocks"""
+
+    notch_1 = createIIRNotchFilter(CUTOFF[0], 5, 10, SAMPLE_RATE)
+    notch_2 = createIIRNotchFilter(CUTOFF[1], 5, 10, SAMPLE_RATE)
+    samples = createTestECG(KERNEL_NUM_SAMPLES)
+    sos = createSOSCascade([notch_1, notch_2])
+    state = np.zeros((len(sos), 2))
+    numpy_stats = runWithBackend('numpy', lambda: list(streamIIRNotchStats(*notch_1, *notch_2, createDataBlocks(samples, 512))))
+
+    for block, numpy_block_stats in zip(createDataBlocks(samples, 512), numpy_stats): # Every block
+        stage_stats = np.zeros((len(sos) + 1, 3))
+        sosStatsKernel(sos, block, state, stage_stats)
+        for (kernel_count, kernel_mean, kernel_m2), (numpy_count, numpy_mean, numpy_m2) in zip(stage_stats, numpy_block_stats):
+            assert kernel_count == numpy_count
+            assertParity(kernel_mean, numpy_mean)
+            assertParity(kernel_m2, numpy_m2)
+
+
+
+def test_sosFrameKernel():
+    """The real-time frame kernel matches the pure Python sections, frame after frame"""
+
+    samples = createTestECG(KERNEL_NUM_SAMPLES)
+    sos = createIIRNotchSOS(CUTOFF, 5, [10, 10], SAMPLE_RATE)
+    state = np.zeros((len(sos), 2))
+    kernel_output = np.empty_like(samples)
+    for start in range(0, len(samples), FRAME_SIZE):
+        sosFrameKernel(sos, samples[start:start + FRAME_SIZE], state, kernel_output[start:start + FRAME_SIZE])
+    numpy_filter = runWithBackend('numpy', createRealTimeIIRFilter, sos, SAMPLE_RATE)
+    numpy_output = np.concatenate([processFrame(numpy_filter, samples[start:start + FRAME_SIZE]).copy()
+                                   for start in range(0, len(samples), FRAME_SIZE)])
+
+    assertParity(kernel_output, numpy_output)
+
+
+
+@pytest.mark.parametrize('num_taps', [31, 398, 399])
+@pytest.mark.parametrize('symmetry', [1, -1])
+@pytest.mark.parametrize('delay', [0, 15])
+def test_symmetricFIRKernel(num_taps, symmetry, delay):
+    """The folded FIR kernel matches direct form lfilter for symmetric and antisymmetric filters, with odd and even
+    tap counts, with and without a delay trimmed, on 2-D data"""
+
+    samples = createTestECG(KERNEL_NUM_SAMPLES, num_channels=2)
+    taps = np.random.default_rng(num_taps).standard_normal(num_taps)
+    filter_array = taps + symmetry * taps[::-1] # Mirror the taps (an antisymmetric odd filter has a zero centre tap)
+    padded = np.pad(samples, [(0, 0), (num_taps - 1 - delay, delay)]) # Output sample i uses padded samples i to i + num_taps - 1
+    kernel_output = np.empty_like(samples)
+    symmetricFIRKernel(filter_array, padded, float(symmetry), kernel_output)
+    numpy_output = lfilter(filter_array, 1, np.pad(samples, [(0, 0), (0, delay)]), axis=-1)[:, delay:]
+
+    assertParity(kernel_output, numpy_output)
+
+
+
+def test_adaptiveNotchKernel():
+    """The adaptive notch kernel matches the NumPy path, which adapts every channel at once, for each notch"""
+
+    samples = createTestECG(KERNEL_NUM_SAMPLES, num_channels=2)
+    kernel_state = createAdaptiveNotchState(CUTOFF, SAMPLE_RATE, 2)
+    numpy_state = createAdaptiveNotchState(CUTOFF, SAMPLE_RATE, 2)
+
+    for notch in range(len(CUTOFF)): # Each notch in turn, with the other's state untouched
+        kernel_output = np.empty_like(samples)
+        adaptiveNotchKernel(samples, kernel_state['omega'][notch], kernel_state['omega_min'][notch], kernel_state['omega_max'][notch],
+                            kernel_state['phase'][notch], kernel_state['weights'][notch], kernel_state['step_size'],
+                            kernel_state['frequency_step_size'], kernel_output)
+        numpy_output = runWithBackend('numpy', filterAdaptiveNotchStage, numpy_state, notch, samples)
+        assertParity(kernel_output, numpy_output)
+        assertParity(kernel_state['omega'][notch], numpy_state['omega'][notch])
+
+
+
+#
+# Backend parity tests
+#
+@requiresNumba
+def test_blockStatsBackend():
+    """The numba backend's block statistics match the NumPy mean and sum of squared deviations of each row"""
+
+    block = createTestECG(num_channels=3)
+    compiled_count, compiled_mean, compiled_m2 = runWithBackend('numba', calculateBlockStats, block)
+    numpy_count, numpy_mean, numpy_m2 = runWithBackend('numpy', calculateBlockStats, block)
+
+    assert compiled_count == numpy_count
+    assertParity(compiled_mean, numpy_mean)
+    assertParity(compiled_m2, numpy_m2)
+
+
+
+@requiresNumba
+def test_sosStatsBackend():
+    """The numba backend's fused notch cascade and statistics match filtering with sosfilt and then measuring each
+    stage, with the section states carried across blocks"""
+
+    notch_1 = createIIRNotchFilter(CUTOFF[0], 5, 10, SAMPLE_RATE)
+    notch_2 = createIIRNotchFilter(CUTOFF[1], 5, 10, SAMPLE_RATE)
+    streamStats = lambda: list(streamIIRNotchStats(*notch_1, *notch_2, createDataBlocks(createTestECG(), 4096)))
+    compiled_stats = runWithBackend('numba', streamStats)
+    numpy_stats = runWithBackend('numpy', streamStats)
+
+    assert len(compiled_stats) == len(numpy_stats)
+    for compiled_block_stats, numpy_block_stats in zip(compiled_stats, numpy_stats): # Every block
+        for (compiled_count, compiled_mean, compiled_m2), (numpy_count, numpy_mean, numpy_m2) in zip(compiled_block_stats, numpy_block_stats):
+            assert compiled_count == numpy_count
+            assertParity(compiled_mean, numpy_mean)
+            assertParity(compiled_m2, numpy_m2)
+
+
+
+@requiresNumba
+def test_sosFrameBackend():
+    """The numba backend's real-time frame filter matches the pure Python sections, frame after frame"""
+
+    samples = createTestECG()
+    sos = createIIRNotchSOS(CUTOFF, 5, [10, 10], SAMPLE_RATE)
+    filterFrames = lambda filter_state: np.concatenate([processFrame(filter_state, samples[start:start + 32]).copy()
+                                                        for start in range(0, len(samples), 32)])
+    compiled_output = filterFrames(runWithBackend('numba', createRealTimeIIRFilter, sos, SAMPLE_RATE))
+    numpy_output = filterFrames(runWithBackend('numpy', createRealTimeIIRFilter, sos, SAMPLE_RATE))
+
+    assertParity(compiled_output, numpy_output)
+
+
+
+@requiresNumba
+@pytest.mark.parametrize('num_taps', [31, 398, 399])
+@pytest.mark.parametrize('symmetry', [1, -1])
+@pytest.mark.parametrize('delay', [0, 15])
+def test_symmetricFIRBackend(num_taps, symmetry, delay):
+    """The numba backend's folded FIR filter matches direct form lfilter for symmetric and antisymmetric filters, with
+    odd and even tap counts, with and without a delay trimmed, on 2-D data"""
+
+    samples = createTestECG(num_channels=2)
+    taps = np.random.default_rng(num_taps).standard_normal(num_taps)
+    filter_array = taps + symmetry * taps[::-1] # Mirror the taps (an antisymmetric odd filter has a zero centre tap)
+    compiled_output = runWithBackend('numba', applySymmetricFIRFilter, filter_array, samples, -1, delay)
+    numpy_output = lfilter(filter_array, 1, np.pad(samples, [(0, 0), (0, delay)]), axis=-1)[:, delay:]
+
+    assertParity(compiled_output, numpy_output)
+
+
+
+@requiresNumba
+def test_adaptiveNotchBackend():
+    """The numba backend's adaptive notch matches the NumPy path, which adapts every channel at once, for both notches"""
+
+    samples = createTestECG(num_channels=2)
+    compiled_outputs = runWithBackend('numba', applyAdaptiveNotchFilters, CUTOFF[0], CUTOFF[1], SAMPLE_RATE, samples)
+    numpy_outputs = runWithBackend('numpy', applyAdaptiveNotchFilters, CUTOFF[0], CUTOFF[1], SAMPLE_RATE, samples)
+
+    for compiled_output, numpy_output in zip(compiled_outputs, numpy_outputs): # After each notch
+        assertParity(compiled_output, numpy_output)